@@ -0,0 +1,69 @@
+# Line diff of extract_diff against difflib.ndiff, on the text representation of a large
+# transformer with many near-identical lines. --width changes the hidden size of every layer,
+# which makes ndiff compare every changed line with its near-identical neighbours.
+# usage: python benchmarks/bench_diff.py --layers 270 --changes 3 --repeat 5 [--width]
+import os
+import sys
+import time
+import random
+import difflib
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tvault.diff_utils import line_diff
+
+
+def transformer_repr(layers, dropout, hidden=768):
+    lines = ["Transformer(", "  (blocks): ModuleList("]
+    for i in range(layers):
+        lines += [
+            f"    ({i}): Block(",
+            "      (attn): Attention(",
+            "        (qkv): Linear(in_features=768, out_features=2304, bias=True)",
+            f"        (drop): Dropout(p={dropout.get(i, 0.1)}, inplace=False)",
+            "        (proj): Linear(in_features=768, out_features=768, bias=True)",
+            "      )",
+            "      (mlp): Mlp(",
+            "        (fc1): Linear(in_features=768, out_features=3072, bias=True)",
+            "        (act): GELU(approximate='none')",
+            "        (fc2): Linear(in_features=3072, out_features=768, bias=True)",
+            "      )",
+            "    )",
+        ]
+    lines += ["  )", ")"]
+    return [line.replace("768", str(hidden)) for line in lines]
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=270)
+    parser.add_argument("--changes", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--width", action="store_true")
+    args = parser.parse_args()
+
+    random.seed(0)
+    prev = transformer_repr(args.layers, dict())
+    changed = random.sample(range(args.layers), args.changes)
+    cur = transformer_repr(args.layers, {i: 0.2 for i in changed}, 1024 if args.width else 768)
+    cur.insert(len(cur) // 2, "    (norm): LayerNorm((768,), eps=1e-05, elementwise_affine=True)")
+
+    ndiff_ms, ndiff = measure(lambda: list(difflib.ndiff(prev, cur)), args.repeat)
+    line_diff_ms, diff = measure(lambda: line_diff(prev, cur), args.repeat)
+    ndiff_changes = sum(1 for line in ndiff if line[:2] in ("+ ", "- "))
+    changes = sum(1 for op, _ in diff if op != " ")
+
+    print(f"{len(prev)} lines, {args.changes} changed layers, width changed: {args.width}")
+    print(f"difflib.ndiff: {ndiff_ms:9.1f}ms  {ndiff_changes} changed lines")
+    print(f"line_diff:     {line_diff_ms:9.1f}ms  {changes} changed lines")
@@ -0,0 +1,150 @@
+# Compares the batched TorchVault.log_all against the legacy sequence of
+# log_model / log_optimizer / add_tag / add_result calls, and against log_all in the
+# background, whose time is the stall of the caller only. Every run is followed by a
+# training step of --step_ms, which is left out of the timings.
+# usage: python benchmarks/bench_log_all.py --runs 50 --tags 10 --step_ms 20
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import tvault
+from tvault import TorchVault
+
+MODEL_SRC = """
+import torch.nn as nn
+
+
+def make_block(dim):
+    return nn.Linear(dim, dim)
+
+
+class Block{i}(nn.Module):
+    def __init__(self, dim):
+        super().__init__()
+        self.fc = make_block(dim)
+
+    def forward(self, x):
+        return self.fc(x) + x
+"""
+
+
+class SyntheticModel:
+    def __init__(self, n_blocks):
+        lines = ["Net("]
+        for i in range(n_blocks):
+            lines.append(f"  (block{i}): Block{i}(")
+            lines.append(f"    (fc): Linear(in_features=64, out_features=64, bias=True)")
+            lines.append("  )")
+        lines.append(")")
+        self.text = "\n".join(lines)
+
+    def __str__(self):
+        return self.text
+
+
+class SyntheticOptimizer:
+    def __str__(self):
+        return "SGD (\nParameter Group 0\n    lr: 0.01\n    momentum: 0\n)"
+
+
+def make_workdir(n_blocks):
+    workdir = tempfile.mkdtemp(prefix="tvault-bench-")
+    subprocess.run(["git", "init", "-q", workdir], check=True)
+    os.makedirs(f"{workdir}/model")
+    for i in range(n_blocks):
+        with open(f"{workdir}/model/block{i}.py", "w") as f:
+            f.write(MODEL_SRC.format(i=i))
+    subprocess.run(
+        ["git", "-C", workdir, "-c", "user.name=bench", "-c", "user.email=bench@tvault"]
+        + ["commit", "-q", "--allow-empty", "-m", "bench"],
+        check=True,
+    )
+    return workdir
+
+
+def run_legacy(vault, model, optimizer, tags, result):
+    vault.log_model(model)
+    vault.log_optimizer(optimizer)
+    for tag_type, tag in tags.items():
+        vault.add_tag("", tag_type, tag)
+    vault.add_result("", result)
+
+
+def run_batched(vault, model, optimizer, tags, result):
+    vault.log_all(model, tags, result, optimizer)
+
+
+def run_background(vault, model, optimizer, tags, result):
+    vault.log_all(model, tags, result, optimizer, background=True)
+
+
+def measure(name, fn, args):
+    workdir = make_workdir(args.blocks)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        vault = TorchVault("./model_log", "./")
+        model = SyntheticModel(args.blocks)
+        optimizer = SyntheticOptimizer()
+        tags = {f"tag{i}": f"value{i}" for i in range(args.tags)}
+
+        # count writes by wrapping the write paths of the log store
+        stats = {"writes": 0, "bytes": 0}
+        store = vault.store
+
+        def log_size():
+            return sum(
+                os.path.getsize(f"{store.log_dir}/{filename}")
+                for filename in os.listdir(store.log_dir)
+            )
+
+        def counting(write):
+            def counting_write(*write_args):
+                before = log_size()
+                ret = write(*write_args)
+                stats["writes"] += 1
+                stats["bytes"] += max(log_size() - before, 0)
+                return ret
+
+            return counting_write
+
+        store._append_record = counting(store._append_record)
+        store.write = counting(store.write)
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for run in range(args.runs):
+                fn(vault, model, optimizer, tags, float(run))
+                time.sleep(args.step_ms / 1000)
+            elapsed = time.perf_counter() - start - args.runs * args.step_ms / 1000
+            # background logs are written relative to the work dir
+            tvault.flush()
+    finally:
+        os.chdir(cwd)
+    print(
+        f"{name:>10}: {elapsed:8.3f}s total, {elapsed / args.runs * 1000:8.2f}ms/run, "
+        f"{stats['writes'] / args.runs:5.1f} writes/run, {stats['bytes'] / 2**20:8.2f}MiB written"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--tags", type=int, default=10)
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--step_ms", type=float, default=20, help="training step between runs")
+    args = parser.parse_args()
+
+    measure("legacy", run_legacy, args)
+    measure("batched", run_batched, args)
+    measure("background", run_background, args)
+    stats = tvault.logging_stats()
+    print(
+        f"background stall: median {stats['stall_median_ms']:.2f}ms, "
+        f"max {stats['stall_max_ms']:.2f}ms, {stats['failed']} failed"
+    )
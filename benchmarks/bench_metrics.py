@@ -0,0 +1,50 @@
+# Cost of logging a metric every step, and of reading its summary, a downsampled series
+# and every point back.
+# usage: python benchmarks/bench_metrics.py --steps 1000000 --points 500
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tvault.storage import ModelLogStore
+from tvault.metrics import MetricBuffer, MetricSeries
+
+
+def timed(fn):
+    start = time.perf_counter()
+    ret = fn()
+    return time.perf_counter() - start, ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=1000000)
+    parser.add_argument("--points", type=int, default=500, help="blocks of the downsampled read")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix="tvault-bench-")
+    try:
+        store = ModelLogStore(log_dir)
+        buffer = MetricBuffer()
+
+        def log():
+            for step in range(args.steps):
+                buffer.add(store, "bench", 0, "loss", 1.0 / (step + 1), step)
+            buffer.flush()
+
+        elapsed, _ = timed(log)
+        print(f"{'log':>12}: {elapsed:8.3f}s, {elapsed / args.steps * 1e6:8.2f}us/step")
+
+        series = MetricSeries(log_dir, "bench", 0, "loss")
+        elapsed, summary = timed(series.summary)
+        print(f"{'summary':>12}: {elapsed * 1000:8.2f}ms, {summary['count']} points")
+        elapsed, blocks = timed(lambda: series.read(args.points))
+        print(f"{'downsampled':>12}: {elapsed * 1000:8.2f}ms, {len(blocks)} blocks")
+        elapsed, blocks = timed(series.read)
+        print(f"{'full':>12}: {elapsed * 1000:8.2f}ms, {len(blocks)} points")
+    finally:
+        shutil.rmtree(log_dir)
@@ -0,0 +1,59 @@
+# Startup cost of `import tvault` and `tvault --help`, measured over a bare interpreter.
+# Exits with status 1 if a budget is exceeded, or if `import tvault` pulls in modules that
+# should only be imported by the commands using them.
+# usage: python benchmarks/bench_startup.py --repeat 20 --import_budget 60 --help_budget 120
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# modules `import tvault` must not import
+LAZY_MODULES = ["click", "git", "prettytable", "astunparse", "tvault.parse_utils", "subprocess"]
+
+
+def run(args, repeat):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, env=env, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def check_lazy_modules():
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    code = f"import sys, tvault; print(' '.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True)
+    return out.stdout.decode().split()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--import_budget", type=float, default=60, help="ms over bare python")
+    parser.add_argument("--help_budget", type=float, default=120, help="ms over bare python")
+    args = parser.parse_args()
+
+    baseline = run(["-c", "pass"], args.repeat)
+    import_ms = run(["-c", "import tvault"], args.repeat) - baseline
+    help_ms = run(["-m", "tvault.cli", "--help"], args.repeat) - baseline
+    eager = check_lazy_modules()
+
+    print(f"python startup:  {baseline:7.1f}ms")
+    print(f"import tvault:  +{import_ms:7.1f}ms (budget {args.import_budget}ms)")
+    print(f"tvault --help:  +{help_ms:7.1f}ms (budget {args.help_budget}ms)")
+    failed = False
+    if eager:
+        print(f"FAIL: import tvault imports {', '.join(eager)}")
+        failed = True
+    if import_ms > args.import_budget:
+        print("FAIL: import tvault is over budget")
+        failed = True
+    if help_ms > args.help_budget:
+        print("FAIL: tvault --help is over budget")
+        failed = True
+    sys.exit(1 if failed else 0)
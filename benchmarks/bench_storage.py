@@ -0,0 +1,89 @@
+# Read and write cost of a model log in the current record format, against the pickled
+# model logs of older tvault versions.
+# usage: python benchmarks/bench_storage.py --experiments 100 --layers 48 --repeat 3
+import os
+import sys
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tvault.storage import ModelLogStore
+
+
+def synthetic_record(i, layers):
+    model_tree = [("", "GPT", "")]
+    for layer in range(layers):
+        path = f"blocks.{layer}"
+        model_tree += [
+            (path, "Block", ""),
+            (f"{path}.attn", "Attention", ""),
+            (f"{path}.attn.qkv", "Linear", "in_features=768, out_features=2304, bias=True"),
+            (f"{path}.attn.drop", "Dropout", "p=0.1, inplace=False"),
+            (f"{path}.mlp", "Mlp", ""),
+            (f"{path}.mlp.fc1", "Linear", "in_features=768, out_features=3072, bias=True"),
+            (f"{path}.mlp.fc2", "Linear", "in_features=3072, out_features=768, bias=True"),
+        ]
+    return {
+        "timestamp": time.time(),
+        "model_tree": model_tree,
+        "src_hash": {f"Class{c}": f"{c:064x}" for c in range(20)},
+        "external_func_hash": {f"func{c}": f"{c:064x}" for c in range(10)},
+        "optimizer": "SGD (\nParameter Group 0\n    lr: 0.1\n    momentum: 0.9\n)",
+        "tag-lr": 0.1 * i,
+        "tag-seed": i,
+        "result": i / 100,
+    }
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def legacy_write(path, model_log):
+    with open(path, "wb") as f:
+        pickle.dump(model_log, f)
+
+
+def legacy_read(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--experiments", type=int, default=100)
+    parser.add_argument("--layers", type=int, default=48)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    model_log = {i: synthetic_record(i, args.layers) for i in range(args.experiments)}
+    log_dir = tempfile.mkdtemp()
+    try:
+        store = ModelLogStore(log_dir)
+        legacy_path = f"{log_dir}/legacy"
+        tags = lambda key: key.startswith("tag-") or key == "result"
+
+        results = [
+            ("pickle write", measure(lambda: legacy_write(legacy_path, model_log), args.repeat)),
+            ("pickle read", measure(lambda: legacy_read(legacy_path), args.repeat)),
+            ("write", measure(lambda: store.write("0000000", model_log), args.repeat)),
+            ("read", measure(lambda: store.read("0000000"), args.repeat)),
+            ("read tags", measure(lambda: store.read("0000000", tags), args.repeat)),
+        ]
+        print(f"{args.experiments} experiments of {args.layers} layers")
+        print(f"pickle size: {os.path.getsize(legacy_path) / 1024:9.1f}KB")
+        print(f"size:        {os.path.getsize(store.snapshot_path('0000000')) / 1024:9.1f}KB")
+        for name, ms in results:
+            print(f"{name + ':':13}{ms:9.1f}ms")
+    finally:
+        shutil.rmtree(log_dir)
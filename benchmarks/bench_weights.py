@@ -0,0 +1,50 @@
+# Time to fingerprint the weights of a model, with and without stats, against hashing
+# on one thread, and to store it as a checkpoint, first and again unchanged, when every
+# chunk is already stored. Needs torch.
+# usage: python benchmarks/bench_weights.py --size_mb 2048 --layers 16
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import torch
+
+from tvault.weights import fingerprint_weights
+from tvault.checkpoint import CheckpointStore
+
+
+def make_model(size_mb, layers):
+    # square float32 linear layers adding up to size_mb
+    dim = int((size_mb * 2**20 / 4 / layers) ** 0.5)
+    return torch.nn.Sequential(*[torch.nn.Linear(dim, dim, bias=False) for _ in range(layers)])
+
+
+def measure(name, model, size_mb, fn=fingerprint_weights, **kwargs):
+    start = time.perf_counter()
+    fn(model, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>12}: {elapsed:8.3f}s, {size_mb / 1024 / elapsed:6.2f}GiB/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size_mb", type=int, default=2048)
+    parser.add_argument("--layers", type=int, default=16)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    model = make_model(args.size_mb, args.layers).to(args.device)
+    measure("one thread", model, args.size_mb, workers=1)
+    measure("hash", model, args.size_mb)
+    measure("hash+stats", model, args.size_mb, stats=True)
+    log_dir = tempfile.mkdtemp(prefix="tvault-bench-")
+    try:
+        checkpoints = CheckpointStore(log_dir)
+        measure("checkpoint", model, args.size_mb, checkpoints.save)
+        measure("unchanged", model, args.size_mb, checkpoints.save)
+    finally:
+        shutil.rmtree(log_dir)
@@ -0,0 +1,96 @@
+# Many processes logging on the same commit at once, e.g. sweep workers or DDP ranks.
+# Every writer appends experiments, tags some of them and now and then compacts the model
+# log. Exits with status 1 if an experiment or a tag is lost, or if model indices collide.
+# usage: python benchmarks/stress_concurrent_log.py --writers 16 --experiments 50
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tvault.storage import ModelLogStore
+
+SHA = "0000000"
+
+
+def writer(log_dir, writer_id, experiments, compact_every):
+    store = ModelLogStore(log_dir)
+    for i in range(experiments):
+        record = {
+            "timestamp": float(i),
+            "model": f"Net(writer={writer_id})",
+            "src": {"Net": f"class Net:\n    writer = {writer_id}"},
+            "external_func": {},
+            "optimizer": "",
+            "tag-writer": writer_id,
+            "tag-run": i,
+        }
+        idx = store.append(SHA, record)
+        store.update(SHA, idx, {"result": writer_id * 1000 + i})
+        if compact_every and i % compact_every == compact_every - 1:
+            store.compact(SHA)
+
+
+def check(log_dir, writers, experiments):
+    store = ModelLogStore(log_dir)
+    model_log = store.read(SHA)
+    errors = []
+    expected = writers * experiments
+    if sorted(model_log) != list(range(expected)):
+        errors.append(f"expected model indices 0..{expected - 1}, got {len(model_log)} indices")
+    runs = set()
+    for idx, model_record in model_log.items():
+        run = (model_record.get("tag-writer"), model_record.get("tag-run"))
+        if None in run:
+            errors.append(f"experiment {idx} was overwritten by a tag or result")
+            continue
+        if run in runs:
+            errors.append(f"experiment {run} logged twice")
+        runs.add(run)
+        if model_record.get("result") != run[0] * 1000 + run[1]:
+            errors.append(f"result of experiment {run} lost")
+        if model_record["src"]["Net"] != f"class Net:\n    writer = {run[0]}":
+            errors.append(f"source of experiment {run} corrupted")
+    missing = {(w, i) for w in range(writers) for i in range(experiments)} - runs
+    if missing:
+        errors.append(f"{len(missing)} experiments lost, e.g. {sorted(missing)[:5]}")
+    store.index.sync(store)
+    if store.index.count(SHA) != len(model_log):
+        errors.append(f"index has {store.index.count(SHA)} experiments, log has {len(model_log)}")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--experiments", type=int, default=50)
+    parser.add_argument("--compact_every", type=int, default=20, help="0 to never compact")
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp()
+    try:
+        processes = [
+            multiprocessing.Process(
+                target=writer, args=(log_dir, w, args.experiments, args.compact_every)
+            )
+            for w in range(args.writers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        if any(process.exitcode != 0 for process in processes):
+            print("FAIL: a writer crashed")
+            sys.exit(1)
+
+        errors = check(log_dir, args.writers, args.experiments)
+        for error in errors[:20]:
+            print(f"FAIL: {error}")
+        if errors:
+            sys.exit(1)
+        print(f"ok: {args.writers} writers x {args.experiments} experiments, nothing lost")
+    finally:
+        shutil.rmtree(log_dir)
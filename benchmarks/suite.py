@@ -0,0 +1,444 @@
+# Benchmark suite of tvault's hot paths on a synthetic registry and model_dir.
+# The registry has --commits commits of --experiments experiments each, with --classes
+# class sources of --src_kb KiB per commit, and model_dir has --files python files.
+# Every case runs in its own process, and reports its wall time, the bytes it added to the
+# log dir and model dir, and its peak RSS. Results are written as JSON to --out, and with
+# --baseline compared against the results of an earlier version: cases slower by more
+# than --threshold are reported and the suite exits with status 1.
+# The registry is kept in --workdir if given, and reused by runs with the same parameters.
+# log_all logs a module tree built on a stand-in of torch.nn in workdir/model/standin, so
+# it takes the module walk and per-file source lookup of real models, without torch.
+# usage: python benchmarks/suite.py --commits 1000 --experiments 100 --out results.json
+#        python benchmarks/suite.py --baseline results.json --cases find_tag,diff
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import resource
+import statistics
+import subprocess
+import contextlib
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+BUILD_PARAMS = ["commits", "experiments", "classes", "src_kb", "files"]
+# bumped when build changes the workdir, so workdirs of older versions are rebuilt
+LAYOUT = 2
+# commit log_all logs into, apart from the registry
+LOG_SHA = "log0000"
+
+CLASS_SRC = '''
+class Block{i}(nn.Module):
+    """variant {variant}"""
+
+    def __init__(self, dim):
+        super().__init__()
+        self.fc = make_block{i}(dim)
+{methods}
+    def forward(self, x):
+        return self.fc(x) + x
+
+
+def make_block{i}(dim):
+    return nn.Linear(dim, dim)
+'''
+
+METHOD_SRC = """
+    def helper{j}(self, x):
+        y = x * {j} + self.fc(x)
+        return y.relu() if y.sum() > {j} else y.tanh()
+"""
+
+
+# stand-in of torch.nn, so log_all walks a module tree and looks up the source files of its
+# classes as it does for a real nn.Module, without torch
+STANDIN_NN_SRC = """
+class Module:
+    def __init__(self):
+        self._modules = dict()
+
+    def __setattr__(self, name, value):
+        if isinstance(value, Module):
+            self.__dict__.setdefault("_modules", dict())[name] = value
+        object.__setattr__(self, name, value)
+
+    def named_modules(self, remove_duplicate=True, prefix=""):
+        yield prefix, self
+        for name, module in self._modules.items():
+            yield from module.named_modules(remove_duplicate, f"{prefix}.{name}" if prefix else name)
+
+    def modules(self):
+        return (module for _, module in self.named_modules())
+
+    def extra_repr(self):
+        return ""
+
+
+class Linear(Module):
+    def __init__(self, in_features, out_features, bias=True):
+        super().__init__()
+        self.shape = (in_features, out_features, bias)
+
+    def extra_repr(self):
+        return "in_features={}, out_features={}, bias={}".format(*self.shape)
+"""
+
+STANDIN_NET_SRC = """
+class Net(nn.Module):
+    def __init__(self, dim=64):
+        super().__init__()
+{blocks}
+"""
+
+
+def class_source(i, variant, src_kb):
+    methods = ""
+    j = 0
+    while len(methods) < src_kb * 1024:
+        methods += METHOD_SRC.format(j=j)
+        j += 1
+    return CLASS_SRC.format(i=i, variant=variant, methods=methods)
+
+
+def synthetic_sha(commit):
+    return f"{commit:07x}"
+
+
+def synthetic_record(commit, experiment, args, sources):
+    model_tree = [("", "Net", "")]
+    for i in range(args.classes):
+        model_tree += [
+            (f"block{i}", f"Block{i}", ""),
+            (f"block{i}.fc", "Linear", "in_features=64, out_features=64, bias=True"),
+        ]
+    return {
+        "timestamp": time.time(),
+        "model_tree": model_tree,
+        "src": sources,
+        "external_func": {f"model/block{i}.py:make_block{i}": "" for i in range(args.classes)},
+        "optimizer.type": "SGD",
+        "optimizer.lr": 0.1 * (experiment % 10 + 1),
+        "optimizer.momentum": 0.9,
+        "tag-lr": 0.1 * (experiment % 10 + 1),
+        "tag-seed": experiment,
+        "tag-size": ["small", "base", "large"][commit % 3],
+        "result": (commit * 31 + experiment * 17) % 1000 / 1000,
+    }
+
+
+def git(workdir, *args):
+    subprocess.run(
+        ["git", "-C", workdir, "-c", "user.name=bench", "-c", "user.email=bench@tvault"]
+        + list(args),
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+"""
+build the synthetic model_dir, a git repository, and the registry in workdir/model_log.
+"""
+
+
+def build(workdir, args):
+    from tvault.storage import ModelLogStore
+
+    os.makedirs(f"{workdir}/model")
+    git(workdir, "init", "-q")
+    with open(f"{workdir}/model/__init__.py", "w") as f:
+        f.write("")
+    for i in range(args.files):
+        with open(f"{workdir}/model/block{i}.py", "w") as f:
+            f.write("import torch.nn as nn\n" + class_source(i, 0, args.src_kb))
+    # the model log_all logs, the same classes built on the stand-in of torch.nn
+    os.makedirs(f"{workdir}/model/standin")
+    with open(f"{workdir}/model/standin/__init__.py", "w") as f:
+        f.write("")
+    with open(f"{workdir}/model/standin/nn.py", "w") as f:
+        f.write(STANDIN_NN_SRC)
+    for i in range(args.classes):
+        with open(f"{workdir}/model/standin/block{i}.py", "w") as f:
+            f.write("from . import nn\n" + class_source(i, 0, args.src_kb))
+    with open(f"{workdir}/model/standin/net.py", "w") as f:
+        f.write("from . import nn\n")
+        f.write("".join(f"from .block{i} import Block{i}\n" for i in range(args.classes)))
+        blocks = "".join(f"        self.block{i} = Block{i}(dim)\n" for i in range(args.classes))
+        f.write(STANDIN_NET_SRC.format(blocks=blocks))
+    git(workdir, "add", "-A")
+    git(workdir, "commit", "-q", "-m", "bench")
+
+    store = ModelLogStore(f"{workdir}/model_log")
+    base_sources = {
+        f"model/block{i}.py:Block{i}": class_source(i, 0, args.src_kb) for i in range(args.classes)
+    }
+    for commit in range(args.commits):
+        # every commit changes the source of one class
+        sources = dict(base_sources)
+        changed = f"model/block{commit % args.classes}.py:Block{commit % args.classes}"
+        sources[changed] = class_source(commit % args.classes, commit, args.src_kb)
+        model_log = {
+            experiment: synthetic_record(commit, experiment, args, sources)
+            for experiment in range(args.experiments)
+        }
+        store.write(synthetic_sha(commit), model_log)
+    store.index.sync(store)
+    with open(f"{workdir}/suite.json", "w") as f:
+        json.dump(dict({k: getattr(args, k) for k in BUILD_PARAMS}, layout=LAYOUT), f)
+
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, KiB elsewhere
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+"""
+cases, as functions of (vault, workdir, args) returning (setup, run): setup runs once
+before the timings, run is timed --repeat times.
+"""
+
+
+def remove_log_sha(vault):
+    for path in (vault.store.snapshot_path(LOG_SHA), vault.store.journal_path(LOG_SHA)):
+        if os.path.exists(path):
+            os.remove(path)
+    vault.store.index.sync(vault.store, [LOG_SHA])
+
+
+# logs into a commit of its own, removed when the case exits, so the registry measured by
+# other cases and later runs never grows
+def case_log_all(vault, workdir, args):
+    import atexit
+
+    sys.path.insert(0, workdir)
+    from model.standin.net import Net
+
+    model = Net()
+    tags = {"lr": 0.1, "seed": 0}
+    vault.sha = LOG_SHA
+    atexit.register(remove_log_sha, vault)
+    return lambda: remove_log_sha(vault), lambda: vault.log_all(model, tags, 0.5)
+
+
+def case_get_defs_cold(vault, workdir, args):
+    from tvault import parse_utils
+
+    def run():
+        # the in-process memo would make every run after the first warm
+        parse_utils._defs_memo.clear()
+        parse_utils.get_defs(f"{workdir}/model/")
+
+    return None, run
+
+
+def case_get_defs_disk(vault, workdir, args):
+    from tvault import parse_utils
+
+    cache_dir = tempfile.mkdtemp(prefix="tvault-bench-cache-")
+
+    def run():
+        # a new process, with the disk cache of an earlier one
+        parse_utils._defs_memo.clear()
+        parse_utils._disk_caches.clear()
+        parse_utils.get_defs(f"{workdir}/model/", cache_dir)
+
+    return lambda: parse_utils.get_defs(f"{workdir}/model/", cache_dir), run
+
+
+def case_get_defs_warm(vault, workdir, args):
+    from tvault.parse_utils import get_defs
+
+    run = lambda: get_defs(f"{workdir}/model/")
+    return run, run
+
+
+def case_find_hash(vault, workdir, args):
+    sha = synthetic_sha(args.commits // 2)
+    return None, lambda: vault.find("hash", hash=sha)
+
+
+def case_find_tag(vault, workdir, args):
+    return None, lambda: vault.find("tag", tag_type="seed", tag=3)
+
+
+def case_find_result(vault, workdir, args):
+    return None, lambda: vault.find("result", min=0.25, max=0.5)
+
+
+def case_find_query(vault, workdir, args):
+    query = "tag.size=base AND optimizer.lr>=0.5 AND result>=0.5"
+    return None, lambda: vault.find("query", query=query, sort="result", desc=True)
+
+
+def case_show_result(vault, workdir, args):
+    target_models = []
+
+    def setup():
+        target_models.extend(vault.find("result", min=0, max=1))
+
+    return setup, lambda: vault.show_result(target_models)
+
+
+def case_diff(vault, workdir, args):
+    sha1, sha2 = synthetic_sha(0), synthetic_sha(1)
+    return None, lambda: vault.diff(sha1, 0, sha2, args.experiments - 1)
+
+
+def case_reindex(vault, workdir, args):
+    return None, vault.reindex
+
+
+# model logs read one by one, the baseline of the thread pool of reindex
+def case_reindex_serial(vault, workdir, args):
+    vault.workers = 1
+    return None, vault.reindex
+
+
+def case_verify(vault, workdir, args):
+    return None, vault.verify
+
+
+CASES = {
+    name[len("case_") :]: func for name, func in list(globals().items()) if name.startswith("case_")
+}
+
+
+def run_case(name, workdir, args):
+    from tvault import TorchVault
+
+    os.chdir(workdir)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        vault = TorchVault("./model_log", "./")
+        setup, run = CASES[name](vault, workdir, args)
+        if setup is not None:
+            setup()
+        rss_before = peak_rss_kb()
+        size_before = dir_size(f"{workdir}/model_log") + dir_size(f"{workdir}/model")
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+        size_after = dir_size(f"{workdir}/model_log") + dir_size(f"{workdir}/model")
+    return {
+        "case": name,
+        "repeat": args.repeat,
+        "wall_ms_median": statistics.median(timings),
+        "wall_ms_min": min(timings),
+        "wall_ms_max": max(timings),
+        "bytes_written": max(size_after - size_before, 0),
+        "peak_rss_kb": peak_rss_kb(),
+        "rss_before_kb": rss_before,
+    }
+
+
+def tvault_revision():
+    try:
+        out = subprocess.run(
+            ["git", "-C", SRC_DIR, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+        )
+        return out.stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_baseline(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {r["case"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get(result["case"])
+        if before is None:
+            continue
+        ratio = result["wall_ms_median"] / max(before["wall_ms_median"], 1e-9)
+        flag = " REGRESSION" if ratio > threshold else ""
+        print(
+            f"{result['case']:>16}: {before['wall_ms_median']:10.2f}ms -> "
+            f"{result['wall_ms_median']:10.2f}ms ({ratio:5.2f}x){flag}",
+            file=sys.stderr,
+        )
+        if flag:
+            regressions.append(result["case"])
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=1000)
+    parser.add_argument("--experiments", type=int, default=100)
+    parser.add_argument("--classes", type=int, default=20, help="model classes per experiment")
+    parser.add_argument("--src_kb", type=int, default=16, help="size of a class source")
+    parser.add_argument("--files", type=int, default=200, help="python files of model_dir")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--cases", type=str, default="", help="comma separated, default all")
+    parser.add_argument("--workdir", type=str, default="", help="kept and reused if given")
+    parser.add_argument("--out", type=str, default="", help="json results, stdout if empty")
+    parser.add_argument("--baseline", type=str, default="", help="json results to compare to")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown of a regression")
+    parser.add_argument("--run_case", type=str, default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.files = max(args.files, args.classes)
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.workdir, args)))
+        sys.exit(0)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tvault-suite-")
+    try:
+        params = {k: getattr(args, k) for k in BUILD_PARAMS}
+        built = None
+        if os.path.exists(f"{workdir}/suite.json"):
+            with open(f"{workdir}/suite.json") as f:
+                built = json.load(f)
+        if built != dict(params, layout=LAYOUT):
+            if built is not None:
+                shutil.rmtree(workdir)
+            os.makedirs(workdir, exist_ok=True)
+            start = time.perf_counter()
+            build(workdir, args)
+            print(f"built registry in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        results = []
+        for name in [c for c in args.cases.split(",") if c] or list(CASES):
+            command = [sys.executable, os.path.abspath(__file__), "--run_case", name]
+            command += ["--workdir", workdir, "--repeat", str(args.repeat)]
+            command += [f"--{k}={getattr(args, k)}" for k in BUILD_PARAMS]
+            out = subprocess.run(command, check=True, capture_output=True)
+            results.append(json.loads(out.stdout.decode().strip().split("\n")[-1]))
+            print(f"{name:>16}: {results[-1]['wall_ms_median']:10.2f}ms", file=sys.stderr)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    report = {
+        "tvault_revision": tvault_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": dict(params, repeat=args.repeat),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline and compare_baseline(results, args.baseline, args.threshold):
+        sys.exit(1)
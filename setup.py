@@ -18,7 +18,7 @@ setup(
     packages=find_packages("src"),
     package_dir={"": "src"},
     include_package_data=True,
-    entry_points={"console_scripts": ["tvault = tvault.__init__:cli_main"]},
+    entry_points={"console_scripts": ["tvault = tvault.cli:cli_main"]},
     install_requires=read_reqs("requirements.txt"),
     python_requires=">=3",
 )
@@ -1,14 +1,24 @@
+import sys
+
 from .torchvault import TorchVault
-import click
 
 """
 Logging Functions
 """
 
 
-def log(model, log_dir="./model_log", model_dir="./"):
+# weights / weight_stats also log a fingerprint / summary stats of every tensor,
+# checkpoint also stores the state_dict
+def log(
+    model,
+    log_dir="./model_log",
+    model_dir="./",
+    weights=False,
+    weight_stats=False,
+    checkpoint=False,
+):
     vault = TorchVault(log_dir, model_dir)
-    vault.log_model(model)
+    vault.log_model(model, weights, weight_stats, checkpoint)
 
 
 def log_scheduler(scheduler, log_dir="./model_log", model_dir="./"):
@@ -21,10 +31,34 @@ def log_optimizer(optimizer, log_dir="./model_log", model_dir="./"):
     vault.log_optimizer(optimizer)
 
 
-def diff_f(sha1="", index1=-1, sha2="", index2=-1, ask_gpt=False, log_dir="./model_log"):
-    # def diff(self, sha1="", index1=-1, sha2="", index2=-1, out=False, ask_gpt=False)
+def diff_f(
+    sha1="", index1=-1, sha2="", index2=-1, ask_gpt=False, log_dir="./model_log", semantic=False
+):
+    # def diff(self, sha1="", index1=-1, sha2="", index2=-1, ask_gpt=False, semantic=False)
     vault = TorchVault(log_dir)
-    vault.diff(sha1, index1, sha2, index2, ask_gpt)
+    vault.diff(sha1, index1, sha2, index2, ask_gpt, semantic)
+
+
+# checkpoint of the most recent experiment
+def log_checkpoint(model, log_dir="./model_log", model_dir="./"):
+    vault = TorchVault(log_dir, model_dir)
+    return vault.log_checkpoint(model)
+
+
+# checkpoint of an experiment, loaded into model if given, or as a lazy name -> tensor mapping
+def load(sha="", idx=-1, model=None, strict=True, log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    checkpoint = vault.load_checkpoint(sha, idx)
+    if model is None:
+        return checkpoint
+    model.load_state_dict(checkpoint.state_dict(), strict=strict)
+    return model
+
+
+# tensors that differ between the weights of two experiments
+def weights_diff_f(sha1="", index1=-1, sha2="", index2=-1, log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    return vault.weights_diff(sha1, index1, sha2, index2)
 
 
 def add_tag(tag_type="", tag="", sha="", log_dir="./model_log"):
@@ -39,15 +73,69 @@ def add_result(result=0, sha="", log_dir="./model_log"):
 
 
 # tags should be a dictionary of key, value pairs
-def log_all(model, tags=dict(), result=-1, optimizer=None, log_dir="./model_log", model_dir="./"):
+# with background set, returns a Future of the model index, see background.py
+def log_all(
+    model,
+    tags=dict(),
+    result=-1,
+    optimizer=None,
+    log_dir="./model_log",
+    model_dir="./",
+    background=False,
+    weights=False,
+    weight_stats=False,
+    checkpoint=False,
+):
     vault = TorchVault(log_dir, model_dir)
-    vault.log_model(model)
-    if optimizer is not None:
-        vault.log_optimizer(optimizer)
-    for tag_type, tag in tags.items():
-        vault.add_tag("", tag_type, tag)
-    if result is not -1:
-        vault.add_result("", result)
+    return vault.log_all(
+        model, tags, result, optimizer, background, weights, weight_stats, checkpoint
+    )
+
+
+_metric_vaults = dict()
+
+
+# point of a metric series of the most recent experiment, e.g. log_metric("loss", loss, step)
+def log_metric(name, value, step, log_dir="./model_log", model_dir="./"):
+    # called every step, so the vault is kept. HEAD is read again, memoized on its files,
+    # as a commit in between starts a new experiment
+    vault = _metric_vaults.get((log_dir, model_dir))
+    if vault is None:
+        vault = _metric_vaults.setdefault((log_dir, model_dir), TorchVault(log_dir, model_dir))
+    vault.sha = None
+    vault.log_metric(name, value, step)
+
+
+# points of a metric series, downsampled to about points blocks if set
+def read_metric(name, sha="", idx=None, points=None, log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    return vault.read_metric(name, sha, idx, points)
+
+
+# wait until every log_all(..., background=True) and buffered metric is written
+def flush():
+    from .background import flush
+    from .metrics import flush as flush_metrics
+
+    flush()
+    flush_metrics()
+
+
+# counts of background logs and the stall they added to the caller
+def logging_stats():
+    from .background import stats
+
+    return stats()
+
+
+# profile stats of tvault calls, see profiler.py: of this process, or if log_dir is set,
+# summed over the runs saved in it (the last limit runs if set)
+def profile_stats(log_dir=None, limit=None):
+    from . import profiler
+
+    if log_dir is None:
+        return profiler.stats()
+    return profiler.aggregate(profiler.load_runs(log_dir, limit))
 
 
 """
@@ -55,6 +143,8 @@ Other utils
 """
 
 
+# models are printed as they are found, a table per page or csv / jsonl rows for piping,
+# columns: e.g. "hash,idx,tag.size,result", offset: models skipped, to page with limit
 def find_f(
     log_dir="./model_log",
     model_dir="./",
@@ -64,53 +154,142 @@ def find_f(
     tag="",
     min=0,
     max=100,
+    query="",
+    sort="",
+    desc=False,
+    limit=None,
+    offset=0,
+    columns="",
+    format="table",
+    workers=None,
 ):
-    vault = TorchVault(log_dir, model_dir)
-    target_models = vault.find(condition, hash, tag_type, tag, min, max)
-    vault.show_result(target_models)
+    import contextlib
+
+    # csv / jsonl rows are piped from stdout, so status messages go to stderr
+    status = sys.stdout if format == "table" else sys.stderr
+    with contextlib.redirect_stdout(status):
+        vault = TorchVault(log_dir, model_dir, workers=workers)
+        target_models = vault.find_iter(
+            condition,
+            hash,
+            tag_type,
+            tag,
+            min,
+            max,
+            query,
+            sort,
+            desc,
+            # one more, to tell if there are more models than shown
+            None if limit is None else limit + 1,
+            offset,
+        )
+    vault.show_result(target_models, columns, format, limit, offset)
+
+
+# workers: threads reading model logs, see storage.parallel_map
+def reindex_f(log_dir="./model_log", workers=None):
+    vault = TorchVault(log_dir, workers=workers)
+    indexed = vault.reindex()
+    print(f"tvault: indexed {indexed} model logs")
+
+
+# set a tag on every experiment given as runs or selected by query, across commits
+def retag_f(tag_type="", tag="", runs="", query="", workers=None, log_dir="./model_log"):
+    vault = TorchVault(log_dir, workers=workers)
+    tagged = vault.retag(tag_type, tag, runs, query)
+    for sha, count in tagged:
+        print(f"tvault: set tag {tag_type}={tag} for {count} experiments of model {sha}")
+    if len(tagged) == 0:
+        print(f"tvault: no model satisfying the conditions")
+    return tagged
+
+
+def verify_f(hash="", workers=None, log_dir="./model_log"):
+    vault = TorchVault(log_dir, workers=workers)
+    problems = vault.verify(hash)
+    for sha, problem in problems:
+        print(f"tvault: model {sha}: {problem}")
+    checked = 1 if hash != "" else len(vault.store.list_shas())
+    print(f"tvault: verified {checked} model logs, {len(problems)} problems")
+    return problems
+
+
+def compare_f(runs="", query="", workers=None, log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    labels, matrix, clusters = vault.compare(runs, query, workers)
+    vault.show_comparison(labels, matrix, clusters)
+    return labels, matrix, clusters
+
+
+def metrics_f(runs="", query="", names="", log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    summaries = vault.metric_summaries(runs, query, names)
+    vault.show_metric_summaries(summaries)
+    return summaries
+
+
+def stats_f(log_dir="./model_log", limit=None):
+    from prettytable import PrettyTable
+    from . import profiler
+
+    runs = profiler.load_runs(log_dir, limit)
+    if len(runs) == 0:
+        print(f"tvault: no profile stats in {log_dir}, run with TVAULT_PROFILE=1 to record them")
+        return dict()
+    stats = profiler.aggregate(runs)
+    tab = PrettyTable(["CALL", "RUNS", "CALLS", "TOTAL-S", "MS/CALL", "READ", "WRITTEN"])
+    for key, s in stats.items():
+        tab.add_row(
+            [
+                key,
+                s["runs"],
+                s["count"],
+                f"{s['seconds']:.3f}",
+                f"{s['seconds'] / s['count'] * 1000:.2f}",
+                profiler.format_bytes(s["bytes_read"]),
+                profiler.format_bytes(s["bytes_written"]),
+            ]
+        )
+    print(tab)
+    print(f"tvault: {len(runs)} runs")
+    return stats
+
+
+def compact_f(hash="", log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    shas = [hash] if hash != "" else vault.store.list_shas()
+    for sha in shas:
+        try:
+            compacted = vault.compact_model_log(sha)
+        except Exception as e:
+            print(f"tvault error: skipped model log {sha}, which can't be read: {e}")
+            continue
+        if compacted:
+            print(f"tvault: compacted model log {sha}")
+
+
+def migrate_f(hash="", log_dir="./model_log"):
+    vault = TorchVault(log_dir)
+    shas = [hash] if hash != "" else vault.store.list_shas()
+    for sha in shas:
+        try:
+            migrated = vault.store.migrate(sha)
+        except Exception as e:
+            print(f"tvault error: skipped model log {sha}, which can't be read: {e}")
+            continue
+        if migrated:
+            print(f"tvault: migrated model log {sha}")
 
 
 """
-cli utils
+cli_main lives in cli.py, so that importing tvault doesn't import click.
 """
 
 
-@click.command()
-@click.option("--find_flag", is_flag=True, default=False, help="tvault cli for tvault.find")
-@click.option("--diff_flag", is_flag=True, default=False, help="tvault cli for tvault.diff")
-# options for find
-@click.option("--log_dir", type=str, default="./model_log")
-@click.option("--model_dir", type=str, default="./")
-@click.option("--condition", type=str, default="hash")
-@click.option("--hash", type=str, default="")
-@click.option("--tag_type", type=str, default="")
-@click.option("--tag", type=str, default="")
-@click.option("--min", type=int, default=0)
-@click.option("--max", type=int, default=100)
-# options for diff
-@click.option("--sha1", type=str, default="")
-@click.option("--index1", type=int, default=0)
-@click.option("--sha2", type=str, default="")
-@click.option("--index2", type=int, default=0)
-def cli_main(
-    find_flag,
-    diff_flag,
-    log_dir,
-    model_dir,
-    condition,
-    hash,
-    tag_type,
-    tag,
-    min,
-    max,
-    sha1,
-    index1,
-    sha2,
-    index2,
-):
-    if find_flag:
-        find_f(log_dir, model_dir, condition, hash, tag_type, tag, min, max)
-    elif diff_flag:
-        diff_f(sha1, index1, sha2, index2, ask_gpt=False, log_dir=log_dir)
-    else:
-        print("tvault: not implemented")
+def __getattr__(name):
+    if name == "cli_main":
+        from .cli import cli_main
+
+        return cli_main
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,112 @@
+import time
+import queue
+import atexit
+import threading
+from concurrent.futures import Future
+
+"""
+Background logging for log_all(..., background=True).
+
+The training loop only pays for capturing the model: its module tree and classes,
+optimizer, tags and result, all read from memory. Parsing sources and writing the model
+log are done by a worker thread fed by a bounded queue, so a burst of logs blocks the
+caller instead of growing memory without bound.
+Pending logs are flushed when the interpreter exits, or by flush().
+The time every call spent in the caller, capture and waiting for the queue included, is
+kept in stats() so the stall logging adds to a training step can be checked.
+"""
+
+QUEUE_SIZE = 16
+
+
+class BackgroundLogger:
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue = queue.Queue(queue_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counts = {"submitted": 0, "logged": 0, "failed": 0}
+        self.stalls = []
+
+    def start(self):
+        with self.lock:
+            # a forked child inherits the logger but not its thread
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="tvault-logger", daemon=True)
+                self.thread.start()
+
+    """
+    queue job to run on the worker thread, returns a Future of its result.
+    start: perf_counter time the caller started logging at, to measure its stall
+    """
+
+    def submit(self, job, start):
+        future = Future()
+        self.start()
+        self.queue.put((job, future))
+        with self.lock:
+            self.counts["submitted"] += 1
+            self.stalls.append(time.perf_counter() - start)
+        return future
+
+    def run(self):
+        while True:
+            job, future = self.queue.get()
+            try:
+                result = job()
+            except Exception as e:
+                print(f"tvault error: background logging failed: {e!r}")
+                with self.lock:
+                    self.counts["failed"] += 1
+                future.set_exception(e)
+            else:
+                with self.lock:
+                    self.counts["logged"] += 1
+                future.set_result(result)
+            finally:
+                self.queue.task_done()
+
+    """
+    wait until every queued log is written.
+    """
+
+    def flush(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    """
+    counts of logs and the stall they added to the caller, in milliseconds.
+    """
+
+    def stats(self):
+        with self.lock:
+            stalls = sorted(self.stalls)
+            stats = dict(self.counts)
+        stats["pending"] = self.queue.unfinished_tasks
+        stats["stall_total_ms"] = sum(stalls) * 1000
+        stats["stall_max_ms"] = stalls[-1] * 1000 if stalls else 0.0
+        stats["stall_median_ms"] = stalls[len(stalls) // 2] * 1000 if stalls else 0.0
+        return stats
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            _logger = BackgroundLogger()
+            atexit.register(_logger.flush)
+    return _logger
+
+
+def flush():
+    if _logger is not None:
+        _logger.flush()
+
+
+def stats():
+    if _logger is None:
+        return BackgroundLogger().stats()
+    return _logger.stats()
@@ -0,0 +1,131 @@
+import os
+import json
+import mmap
+from collections.abc import Mapping
+
+from .storage import tmp_suffix
+
+"""
+Checkpoints of experiments, deduplicated across runs.
+
+Tensors of a state_dict are split into the chunks fingerprinted by weights.py, and every
+chunk is stored once under its hash:
+    checkpoints/chunks/ab/cdef...    raw bytes of one chunk
+    checkpoints/{sha}/{idx}.json     manifest of the experiment, the shape, dtype and
+                                     chunk hashes of every tensor
+Chunks shared by runs, e.g. of a frozen backbone or of layers that didn't change, are
+stored by the first run only, so they cost nothing in later ones.
+Chunks are kept uncompressed so a tensor held in one chunk is loaded as a copy-on-write
+memory map of its file; tensors are only read when they are accessed.
+"""
+
+
+class CheckpointStore:
+    def __init__(self, log_dir="./model_log"):
+        self.checkpoint_dir = f"{log_dir}/checkpoints"
+
+    def chunk_path(self, digest):
+        return f"{self.checkpoint_dir}/chunks/{digest[:2]}/{digest[2:]}"
+
+    def manifest_path(self, sha, idx):
+        return f"{self.checkpoint_dir}/{sha}/{idx}.json"
+
+    def exists(self, sha, idx):
+        return os.path.exists(self.manifest_path(sha, idx))
+
+    """
+    model indices of the experiments of a commit that have a checkpoint.
+    """
+
+    def list_idxs(self, sha):
+        if not os.path.exists(f"{self.checkpoint_dir}/{sha}"):
+            return []
+        idxs = []
+        for filename in os.listdir(f"{self.checkpoint_dir}/{sha}"):
+            name, ext = os.path.splitext(filename)
+            if ext == ".json" and name.isdigit():
+                idxs.append(int(name))
+        return sorted(idxs)
+
+    """
+    store a chunk unless a run already did, called from the threads of scan_weights.
+    """
+
+    def put_chunk(self, digest, data):
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + tmp_suffix()
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    """
+    store the chunks of every tensor of model, which may also be a state_dict.
+    returns the manifest of the checkpoint, written by write_manifest once the experiment
+    has a model index.
+    """
+
+    def save(self, model, workers=None, stats=False):
+        from .weights import scan_weights
+
+        return scan_weights(model, stats, workers, self.put_chunk)
+
+    def write_manifest(self, sha, idx, manifest):
+        path = self.manifest_path(sha, idx)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + tmp_suffix()
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def load(self, sha, idx):
+        with open(self.manifest_path(sha, idx)) as f:
+            return LazyCheckpoint(self, json.load(f))
+
+
+"""
+name -> tensor mapping of a checkpoint, read from its chunks when accessed.
+"""
+
+
+class LazyCheckpoint(Mapping):
+    def __init__(self, store, manifest):
+        self.store = store
+        self.manifest = manifest
+
+    def __getitem__(self, name):
+        import torch
+
+        info = self.manifest[name]
+        dtype = getattr(torch, info["dtype"])
+        paths = [self.store.chunk_path(digest) for digest in info["chunks"]]
+        if len(paths) == 1 and os.path.getsize(paths[0]) > 0:
+            with open(paths[0], "rb") as f:
+                # private pages, so the tensor is writable and never written back
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            return torch.frombuffer(buffer, dtype=dtype).reshape(info["shape"])
+        tensor = torch.empty(info["shape"], dtype=dtype)
+        data = memoryview(tensor.reshape(-1).view(torch.uint8).numpy())
+        offset = 0
+        for path in paths:
+            with open(path, "rb") as f:
+                offset += f.readinto(data[offset:])
+        return tensor
+
+    def __contains__(self, name):
+        return name in self.manifest
+
+    def __iter__(self):
+        return iter(self.manifest)
+
+    def __len__(self):
+        return len(self.manifest)
+
+    """
+    every tensor, e.g. for model.load_state_dict.
+    """
+
+    def state_dict(self):
+        return {name: self[name] for name in self.manifest}
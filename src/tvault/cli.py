@@ -0,0 +1,173 @@
+import click
+
+from . import (
+    find_f,
+    diff_f,
+    reindex_f,
+    retag_f,
+    verify_f,
+    compact_f,
+    compare_f,
+    migrate_f,
+    metrics_f,
+    stats_f,
+)
+from .output import FORMATS
+
+"""
+cli utils
+"""
+
+
+@click.command()
+@click.option("--find_flag", is_flag=True, default=False, help="tvault cli for tvault.find")
+@click.option("--diff_flag", is_flag=True, default=False, help="tvault cli for tvault.diff")
+@click.option(
+    "--reindex_flag", is_flag=True, default=False, help="rebuild the experiment index of find"
+)
+@click.option(
+    "--retag_flag",
+    is_flag=True,
+    default=False,
+    help="set --tag_type / --tag on experiments of --runs or --query",
+)
+@click.option(
+    "--verify_flag", is_flag=True, default=False, help="check model logs, sources and checkpoints"
+)
+@click.option(
+    "--compact_flag", is_flag=True, default=False, help="fold model log journals into snapshots"
+)
+@click.option(
+    "--compare_flag", is_flag=True, default=False, help="compare many experiments at once"
+)
+@click.option(
+    "--migrate_flag", is_flag=True, default=False, help="rewrite pickled model logs safely"
+)
+@click.option(
+    "--metrics_flag", is_flag=True, default=False, help="summarize metrics of experiments"
+)
+@click.option(
+    "--stats_flag", is_flag=True, default=False, help="profile stats saved with TVAULT_PROFILE"
+)
+# options for find
+@click.option("--log_dir", type=str, default="./model_log")
+@click.option("--model_dir", type=str, default="./")
+@click.option("--condition", type=str, default="hash", help="hash, tag, result or query")
+@click.option("--hash", type=str, default="")
+@click.option("--tag_type", type=str, default="")
+@click.option("--tag", type=str, default="")
+@click.option("--min", type=float, default=0)
+@click.option("--max", type=float, default=100)
+@click.option(
+    "--query", type=str, default="", help='e.g. "tag.size=0.5x AND result>=0.9 AND sha in a..b"'
+)
+@click.option("--sort", type=str, default="", help="field to sort by, e.g. result or tag.size")
+@click.option("--desc", is_flag=True, default=False, help="sort in descending order")
+@click.option(
+    "--limit",
+    type=int,
+    default=None,
+    help="show at most this many models, or stats of the last runs",
+)
+@click.option("--offset", type=int, default=0, help="models skipped, to page with --limit")
+@click.option("--columns", type=str, default="", help='e.g. "hash,idx,tag.size,result"')
+@click.option(
+    "--format",
+    type=click.Choice(FORMATS),
+    default="table",
+    help="csv and jsonl are written row by row, for piping",
+)
+# options for diff
+@click.option("--sha1", type=str, default="")
+@click.option("--index1", type=int, default=0)
+@click.option("--sha2", type=str, default="")
+@click.option("--index2", type=int, default=0)
+@click.option("--semantic", is_flag=True, default=False, help="diff class sources method by method")
+# options for compare, which selects experiments with --runs or --query
+@click.option("--runs", type=str, default="", help='e.g. "2ba4adf:0,2ba4adf:1,737b47a"')
+@click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="processes used to compare, or threads reading model logs",
+)
+# options for metrics, which selects experiments like compare
+@click.option("--metric", type=str, default="", help='metrics shown, e.g. "loss,acc"')
+def cli_main(
+    find_flag,
+    diff_flag,
+    reindex_flag,
+    retag_flag,
+    verify_flag,
+    compact_flag,
+    compare_flag,
+    migrate_flag,
+    metrics_flag,
+    stats_flag,
+    log_dir,
+    model_dir,
+    condition,
+    hash,
+    tag_type,
+    tag,
+    min,
+    max,
+    query,
+    sort,
+    desc,
+    limit,
+    offset,
+    columns,
+    format,
+    sha1,
+    index1,
+    sha2,
+    index2,
+    semantic,
+    runs,
+    workers,
+    metric,
+):
+    if find_flag:
+        find_f(
+            log_dir,
+            model_dir,
+            condition,
+            hash,
+            tag_type,
+            tag,
+            min,
+            max,
+            query,
+            sort,
+            desc,
+            limit,
+            offset,
+            columns,
+            format,
+            workers,
+        )
+    elif diff_flag:
+        diff_f(sha1, index1, sha2, index2, ask_gpt=False, log_dir=log_dir, semantic=semantic)
+    elif reindex_flag:
+        reindex_f(log_dir, workers)
+    elif retag_flag:
+        retag_f(tag_type, tag, runs, query, workers, log_dir)
+    elif verify_flag:
+        verify_f(hash, workers, log_dir)
+    elif compact_flag:
+        compact_f(hash, log_dir)
+    elif compare_flag:
+        compare_f(runs, query, workers, log_dir)
+    elif migrate_flag:
+        migrate_f(hash, log_dir)
+    elif metrics_flag:
+        metrics_f(runs, query, metric, log_dir)
+    elif stats_flag:
+        stats_f(log_dir, limit)
+    else:
+        print("tvault: not implemented")
+
+
+if __name__ == "__main__":
+    cli_main()
@@ -0,0 +1,178 @@
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from .index import encode_value
+from .optim_utils import optim_fields
+
+"""
+N-way comparison of experiments.
+
+Every experiment is reduced to a fingerprint: one set of (name, hash) per category
+    model       (path, class, extra_repr hash) of every module, or lines of the text view
+    src         (class name, source hash)
+    func        (function name, source hash)
+    optimizer   (hyperparameter, value) of the optimizer and scheduler, or lines of the
+                optimizer's text view for experiments logged with it
+    tags        (tag, value)
+Source hashes are the ones stored with the experiment, so sources are never loaded.
+The distance of two experiments is the mean Jaccard distance of their categories.
+
+Identical sets are interned to one id per category, so identical components of a sweep
+are compared once, and only distances between distinct sets are computed, across a process
+pool when there are enough of them.
+Experiments with the same model, src and func sets share an architecture and are clustered.
+"""
+
+CATEGORIES = ["model", "src", "func", "optimizer", "tags"]
+ARCHITECTURE = ["model", "src", "func"]
+# fewer distinct pairs than this are compared in process, as starting workers costs more
+MIN_PARALLEL_PAIRS = 5000
+
+
+def digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def numbered_lines(text):
+    # repeated lines are kept apart, e.g. the layers of a ModuleList
+    seen = dict()
+    lines = []
+    for line in text.split("\n"):
+        seen[line] = seen.get(line, 0) + 1
+        lines.append((line, seen[line]))
+    return frozenset(lines)
+
+
+def source_hashes(model_record, field):
+    if f"{field}_hash" in model_record:
+        return frozenset(model_record[f"{field}_hash"].items())
+    return frozenset((name, digest(source)) for name, source in model_record[field].items())
+
+
+def fingerprint(model_record):
+    if "model_tree" in model_record:
+        model = frozenset(
+            (path, type_name, digest(extra_repr))
+            for path, type_name, extra_repr in model_record["model_tree"]
+        )
+    else:
+        model = numbered_lines(model_record.get("model", ""))
+    return {
+        "model": model,
+        "src": source_hashes(model_record, "src"),
+        "func": source_hashes(model_record, "external_func"),
+        "optimizer": frozenset(
+            (key, encode_value(value)) for key, value in optim_fields(model_record).items()
+        )
+        | (numbered_lines(model_record["optimizer"]) if "optimizer" in model_record else set()),
+        "tags": frozenset(
+            (key, encode_value(value))
+            for key, value in model_record.items()
+            if key.startswith("tag-")
+        ),
+    }
+
+
+def jaccard_distance(a, b):
+    union = len(a | b)
+    if union == 0:
+        return 0.0
+    return 1.0 - len(a & b) / union
+
+
+_worker_sets = None
+
+
+def init_worker(sets):
+    global _worker_sets
+    _worker_sets = sets
+
+
+def distance_chunk(pairs):
+    return [
+        jaccard_distance(_worker_sets[category][i], _worker_sets[category][j])
+        for category, i, j in pairs
+    ]
+
+
+"""
+compare experiments with each other.
+model_records: list of model records
+workers: size of the process pool, defaults to the number of cpus
+returns (distance matrix, clusters), where
+    distance matrix[i][j] is the distance of experiment i and j, from 0 (identical) to 1
+    clusters is a list of lists of experiment positions sharing an architecture
+"""
+
+
+def compare_records(model_records, workers=None):
+    # intern identical sets to ids
+    sets = {category: [] for category in CATEGORIES}
+    set_ids = {category: dict() for category in CATEGORIES}
+    experiment_ids = []
+    for model_record in model_records:
+        ids = dict()
+        for category, values in fingerprint(model_record).items():
+            if values not in set_ids[category]:
+                set_ids[category][values] = len(sets[category])
+                sets[category].append(values)
+            ids[category] = set_ids[category][values]
+        experiment_ids.append(ids)
+
+    # distances between distinct sets only
+    pairs = [
+        (category, i, j)
+        for category in CATEGORIES
+        for i in range(len(sets[category]))
+        for j in range(i + 1, len(sets[category]))
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(pairs) >= MIN_PARALLEL_PAIRS:
+        chunk_size = -(-len(pairs) // (workers * 4))
+        chunks = [pairs[k : k + chunk_size] for k in range(0, len(pairs), chunk_size)]
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(sets,)) as pool:
+            distances = [d for chunk in pool.map(distance_chunk, chunks) for d in chunk]
+    else:
+        init_worker(sets)
+        distances = distance_chunk(pairs)
+    set_distances = {(category, i, j): d for (category, i, j), d in zip(pairs, distances)}
+
+    def set_distance(category, i, j):
+        if i == j:
+            return 0.0
+        return set_distances[(category, min(i, j), max(i, j))]
+
+    n = len(model_records)
+    matrix = [[0.0] * n for _ in range(n)]
+    for a in range(n):
+        for b in range(a + 1, n):
+            d = sum(
+                set_distance(category, experiment_ids[a][category], experiment_ids[b][category])
+                for category in CATEGORIES
+            ) / len(CATEGORIES)
+            matrix[a][b] = matrix[b][a] = d
+
+    clusters = dict()
+    for position, ids in enumerate(experiment_ids):
+        key = tuple(ids[category] for category in ARCHITECTURE)
+        clusters.setdefault(key, []).append(position)
+    return matrix, list(clusters.values())
+
+
+"""
+parse experiments given as "sha:idx" or "sha" (every experiment of the commit),
+separated by commas.
+returns a list of (sha, idx or None)
+"""
+
+
+def parse_runs(text):
+    runs = []
+    for run in text.split(","):
+        run = run.strip()
+        if run == "":
+            continue
+        sha, _, idx = run.partition(":")
+        runs.append((sha, int(idx) if idx else None))
+    return runs
@@ -0,0 +1,498 @@
+import ast
+import hashlib
+
+"""
+Diff engines of extract_diff.
+
+Line diff
+difflib.ndiff does fuzzy intraline matching and degrades badly on large model
+representations with many near-identical lines, so lines are diffed with histogram diff
+(as in git diff --histogram) instead:
+1. common prefix and suffix of a region are matched directly.
+2. the region is split on the longest match around its least frequent common line,
+   and both sides are diffed the same way.
+3. small regions, and regions whose common lines are all very frequent, are diffed with
+   Myers' O(ND) diff, which gives a minimal diff, in linear space (middle snake).
+   very large regions of frequent lines only are shown replaced as a whole.
+Identical texts are short-circuited without diffing.
+
+Model tree diff
+Models logged with their module tree are diffed structurally: submodules are matched by
+qualified path, and added / removed / changed layers are reported with the
+hyperparameters that changed. Every subtree is hashed, so identical subtrees are skipped
+without being walked.
+
+Semantic diff
+Class and function sources are compared per method: methods are hashed from their ast
+(ast.dump leaves out line numbers and formatting), unchanged methods are skipped by hash,
+and only hunks around the changes of changed methods are shown.
+"""
+
+# lines occurring more often than this in a region are not used as split points
+MAX_OCCURRENCES = 64
+# regions with at most this many lines in total are diffed with Myers' diff
+MYERS_REGION_SIZE = 128
+# larger regions without a usable common line are shown replaced as a whole, as Myers' diff
+# takes time of their size times the number of changes
+MYERS_MAX_SIZE = 4096
+
+EQUAL = " "
+DELETE = "-"
+INSERT = "+"
+
+
+"""
+middle snake of Myers' diff of a region: the snake in the middle of a shortest edit
+script, found by searching forward from the start and backward from the end at once.
+returns (x start, y start, x end, y end) relative to the region, which is not empty on
+either side and has no common first or last line.
+"""
+
+
+def _middle_snake(a, b, alo, ahi, blo, bhi):
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    # furthest x on each diagonal k = x - y, forward and on the reversed region
+    forward, backward = {1: 0}, {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if delta % 2 == 1 and -d < delta - k < d and x + backward[delta - k] >= n:
+                return start_x, start_y, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if delta % 2 == 0 and -d <= delta - k <= d and x + forward[delta - k] >= n:
+                return n - x, m - y, n - start_x, m - start_y
+
+
+"""
+Myers' diff of a region in linear space: the region is split on its middle snake, and
+both sides are diffed the same way.
+"""
+
+
+def _myers(a, b, alo, ahi, blo, bhi, ops):
+    # stack of regions to diff and ops to emit, processed in order
+    stack = [("region", alo, ahi, blo, bhi)]
+    while stack:
+        item = stack.pop()
+        if item[0] == "ops":
+            ops.extend(item[1])
+            continue
+        _, alo, ahi, blo, bhi = item
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            ops.append((EQUAL, start, alo))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if ahi < end:
+            stack.append(("ops", [(EQUAL, ahi, end)]))
+
+        if alo == ahi or blo == bhi:
+            if alo < ahi:
+                ops.append((DELETE, alo, ahi))
+            if blo < bhi:
+                ops.append((INSERT, blo, bhi))
+            continue
+        x, y, u, v = _middle_snake(a, b, alo, ahi, blo, bhi)
+        stack.append(("region", alo + u, ahi, blo + v, bhi))
+        if u > x:
+            stack.append(("ops", [(EQUAL, alo + x, alo + u)]))
+        stack.append(("region", alo, alo + x, blo, blo + y))
+
+
+"""
+find the longest match around the least frequent line common to both regions.
+returns (a start, b start, length), or None if there is no usable common line
+"""
+
+
+def _split_point(a, b, alo, ahi, blo, bhi):
+    occurrences = dict()
+    for i in range(alo, ahi):
+        occurrences.setdefault(a[i], []).append(i)
+
+    best, best_count = None, MAX_OCCURRENCES
+    j = blo
+    while j < bhi:
+        next_j = j + 1
+        positions = occurrences.get(b[j])
+        if positions is not None and len(positions) <= best_count:
+            for i in positions:
+                start_i, start_j = i, j
+                while start_i > alo and start_j > blo and a[start_i - 1] == b[start_j - 1]:
+                    start_i -= 1
+                    start_j -= 1
+                end_i, end_j = i + 1, j + 1
+                while end_i < ahi and end_j < bhi and a[end_i] == b[end_j]:
+                    end_i += 1
+                    end_j += 1
+                length = end_i - start_i
+                if best is None or len(positions) < best_count or length > best[2]:
+                    best, best_count = (start_i, start_j, length), len(positions)
+                    # lines inside this match don't need to be tried again
+                    next_j = max(next_j, end_j)
+        j = next_j
+    return best
+
+
+def _histogram(a, b, ops):
+    # stack of regions to diff and ops to emit, processed in order
+    stack = [("region", 0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if item[0] == "ops":
+            ops.extend(item[1])
+            continue
+        _, alo, ahi, blo, bhi = item
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            ops.append((EQUAL, start, alo))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if ahi < end:
+            stack.append(("ops", [(EQUAL, ahi, end)]))
+
+        if alo == ahi or blo == bhi:
+            if alo < ahi:
+                ops.append((DELETE, alo, ahi))
+            if blo < bhi:
+                ops.append((INSERT, blo, bhi))
+            continue
+        if (ahi - alo) + (bhi - blo) <= MYERS_REGION_SIZE:
+            _myers(a, b, alo, ahi, blo, bhi, ops)
+            continue
+        split = _split_point(a, b, alo, ahi, blo, bhi)
+        if split is None and (ahi - alo) + (bhi - blo) > MYERS_MAX_SIZE:
+            ops.append((DELETE, alo, ahi))
+            ops.append((INSERT, blo, bhi))
+            continue
+        if split is None:
+            _myers(a, b, alo, ahi, blo, bhi, ops)
+            continue
+        i, j, length = split
+        stack.append(("region", i + length, ahi, j + length, bhi))
+        stack.append(("ops", [(EQUAL, i, i + length)]))
+        stack.append(("region", alo, i, blo, j))
+
+
+"""
+diff two lists of lines.
+returns a list of (op, line), op being " ", "-" or "+".
+deletions of a changed block come before its insertions, as in ndiff.
+"""
+
+
+def line_diff(a, b):
+    if a == b:
+        return [(EQUAL, line) for line in a]
+    ops = []
+    _histogram(a, b, ops)
+
+    # ops are ranges (op, lo, hi) of lines of a, or of b for insertions
+    diff, deleted, inserted = [], [], []
+    for op, lo, hi in ops:
+        if op == EQUAL:
+            diff += deleted + inserted
+            deleted, inserted = [], []
+            diff += [(EQUAL, line) for line in a[lo:hi]]
+        elif op == DELETE:
+            deleted += [(DELETE, line) for line in a[lo:hi]]
+        else:
+            inserted += [(INSERT, line) for line in b[lo:hi]]
+    return diff + deleted + inserted
+
+
+"""
+colored line diff of two texts, in the format of extract_diff.
+context: number of unchanged lines shown around changes, or None for all of them
+returns an empty string if the texts are identical.
+"""
+
+
+def color_diff(prev_text, cur_text, context=None):
+    if prev_text == cur_text:
+        return ""
+    diff = line_diff(prev_text.split("\n"), cur_text.split("\n"))
+    changed = [i for i, (op, _) in enumerate(diff) if op != EQUAL]
+    if len(changed) == 0:
+        return ""
+    shown = None
+    if context is not None:
+        shown = set()
+        for i in changed:
+            shown.update(range(i - context, i + context + 1))
+    color_lines = []
+    for i, (op, line) in enumerate(diff):
+        if shown is not None and i not in shown:
+            # one marker per run of hidden lines
+            if i == 0 or i - 1 in shown:
+                color_lines.append("  ...")
+            continue
+        if op == INSERT:
+            color_lines.append("\033[32m+ " + line + "\033[0m")
+        elif op == DELETE:
+            color_lines.append("\033[31m- " + line + "\033[0m")
+        else:
+            color_lines.append("  " + line)
+    return "\n".join(color_lines)
+
+
+"""
+hash every subtree of a model tree.
+returns {path: hash of the module's class, extra_repr and children}
+"""
+
+
+def subtree_hashes(model_tree):
+    hashes = dict()
+    children = dict()
+    # named_modules lists parents before children, so children are hashed first in reverse
+    for path, type_name, extra_repr in reversed(model_tree):
+        h = hashlib.sha256(f"{type_name}\0{extra_repr}".encode())
+        for child in reversed(children.pop(path, [])):
+            h.update(f"\0{child}\0{hashes[child]}".encode())
+        hashes[path] = h.hexdigest()
+        if path != "":
+            parent = path.rsplit(".", 1)[0] if "." in path else ""
+            children.setdefault(parent, []).append(path)
+    return hashes
+
+
+"""
+split an extra_repr into hyperparameters, e.g. "3, 64, kernel_size=(3, 3)" into
+{"0": "3", "1": "64", "kernel_size": "(3, 3)"}.
+"""
+
+
+def split_extra_repr(extra_repr):
+    args, depth, current = [], 0, ""
+    for c in extra_repr:
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        if c == "," and depth == 0:
+            args.append(current.strip())
+            current = ""
+        else:
+            current += c
+    if current.strip():
+        args.append(current.strip())
+
+    hparams = dict()
+    for i, arg in enumerate(args):
+        key, sep, value = arg.partition("=")
+        if sep and key.strip().isidentifier():
+            hparams[key.strip()] = value.strip()
+        else:
+            hparams[str(i)] = arg
+    return hparams
+
+
+"""
+structural diff of two model trees.
+returns a list of (change, path, detail) in module order, where change is
+    "added" / "removed"     detail is the class name of the module
+    "type"                  detail is (previous class name, current class name)
+    "hparams"               detail is (class name,
+                                       [(hyperparameter, previous value, current value)])
+values of added or removed hyperparameters are None.
+"""
+
+
+def tree_diff(prev_tree, cur_tree):
+    prev_nodes = {path: (type_name, extra_repr) for path, type_name, extra_repr in prev_tree}
+    cur_nodes = {path: (type_name, extra_repr) for path, type_name, extra_repr in cur_tree}
+    prev_hashes, cur_hashes = subtree_hashes(prev_tree), subtree_hashes(cur_tree)
+    prev_children, cur_children = tree_children(prev_tree), tree_children(cur_tree)
+
+    changes = []
+    # stack of paths to visit and changes to emit, processed in order
+    stack = [("visit", "")]
+    while stack:
+        kind, value = stack.pop()
+        if kind == "change":
+            changes.append(value)
+            continue
+        path = value
+        if prev_hashes[path] == cur_hashes[path]:
+            continue
+        (prev_type, prev_extra), (cur_type, cur_extra) = prev_nodes[path], cur_nodes[path]
+        if prev_type != cur_type:
+            changes.append(("type", path, (prev_type, cur_type)))
+        elif prev_extra != cur_extra:
+            prev_hparams, cur_hparams = split_extra_repr(prev_extra), split_extra_repr(cur_extra)
+            changed = []
+            for key in list(prev_hparams) + [k for k in cur_hparams if k not in prev_hparams]:
+                prev_value, cur_value = prev_hparams.get(key), cur_hparams.get(key)
+                if prev_value != cur_value:
+                    changed.append((key, prev_value, cur_value))
+            changes.append(("hparams", path, (cur_type, changed)))
+
+        # removed children are reported at their previous position, added ones last
+        cur_set, prev_set = set(cur_children[path]), set(prev_children[path])
+        next_items = []
+        for child in prev_children[path]:
+            if child in cur_set:
+                next_items.append(("visit", child))
+            else:
+                next_items.append(("change", ("removed", child, prev_nodes[child][0])))
+        for child in cur_children[path]:
+            if child not in prev_set:
+                next_items.append(("change", ("added", child, cur_nodes[child][0])))
+        stack.extend(reversed(next_items))
+    return changes
+
+
+"""
+children paths of every module of a model tree.
+"""
+
+
+def tree_children(model_tree):
+    children = {path: [] for path, _, _ in model_tree}
+    for path, _, _ in model_tree[1:]:
+        parent = path.rsplit(".", 1)[0] if "." in path else ""
+        children[parent].append(path)
+    return children
+
+
+"""
+colored text of a structural model tree diff, in the format of extract_diff.
+returns an empty string if the trees are identical.
+"""
+
+
+def color_tree_diff(prev_tree, cur_tree):
+    lines = []
+    for change, path, detail in tree_diff(prev_tree, cur_tree):
+        name = path if path else "(model)"
+        if change == "added":
+            lines.append(f"\033[32m+ {name}: {detail}\033[0m")
+        elif change == "removed":
+            lines.append(f"\033[31m- {name}: {detail}\033[0m")
+        elif change == "type":
+            lines.append(f"~ {name}: \033[31m{detail[0]}\033[0m -> \033[32m{detail[1]}\033[0m")
+        else:
+            type_name, hparams = detail[0], []
+            for key, prev_value, cur_value in detail[1]:
+                prev_value = "(none)" if prev_value is None else prev_value
+                cur_value = "(none)" if cur_value is None else cur_value
+                key = "" if key.isdigit() else f"{key}="
+                hparams.append(f"{key}\033[31m{prev_value}\033[0m -> \033[32m{cur_value}\033[0m")
+            lines.append(f"~ {name}: {type_name}({', '.join(hparams)})")
+    return "\n".join(lines)
+
+
+"""
+split a class or function source into units compared by the semantic diff.
+returns {name: (hash of the normalized ast, source lines)}, where methods of a class are
+units of their own and other statements of a class body form the "class body" unit.
+a function is a single unit.
+"""
+
+
+def ast_units(source):
+    tree = ast.parse(source)
+    lines = source.split("\n")
+    if len(tree.body) != 1 or type(tree.body[0]) != ast.ClassDef:
+        return {"": (hashlib.sha256(ast.dump(tree).encode()).hexdigest(), source)}
+
+    methods = dict()
+    body_nodes, body_lines = [], []
+    for node in tree.body[0].body:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        node_source = "\n".join(lines[start - 1 : node.end_lineno])
+        if type(node) in (ast.FunctionDef, ast.AsyncFunctionDef):
+            digest = hashlib.sha256(ast.dump(node).encode()).hexdigest()
+            methods[f"method {node.name}"] = (digest, node_source)
+        else:
+            body_nodes.append(ast.dump(node))
+            body_lines.append(node_source)
+    units = dict()
+    if body_nodes:
+        digest = hashlib.sha256("\n".join(body_nodes).encode()).hexdigest()
+        units["class body"] = (digest, "\n".join(body_lines))
+    units.update(methods)
+    return units
+
+
+"""
+semantic diff of two class or function sources.
+reports changed, removed and added methods, with hunks of changed methods only.
+returns an empty string if the sources are semantically identical.
+"""
+
+
+def semantic_diff(prev_source, cur_source, context=3):
+    try:
+        prev_units, cur_units = ast_units(prev_source), ast_units(cur_source)
+    except SyntaxError:
+        return color_diff(prev_source, cur_source, context)
+
+    hunks = []
+    for name, (prev_hash, prev_text) in prev_units.items():
+        if name not in cur_units:
+            hunks.append(f"\033[31m- {name}: removed\033[0m")
+            continue
+        cur_hash, cur_text = cur_units[name]
+        if prev_hash == cur_hash:
+            continue
+        diff = color_diff(prev_text, cur_text, context)
+        if name == "":
+            hunks.append(diff)
+        else:
+            hunks.append(f"{name}: changed\n{diff}" if diff else f"{name}: changed")
+    for name in cur_units:
+        if name not in prev_units:
+            hunks.append(f"\033[32m+ {name}: added\033[0m")
+    return "\n".join(hunks)
+
+
+"""
+colored diff of two flat dicts of fields, in the format of extract_diff.
+returns an empty string if the fields are identical.
+"""
+
+
+def color_fields_diff(prev_fields, cur_fields):
+    lines = []
+    for key in list(prev_fields) + [k for k in cur_fields if k not in prev_fields]:
+        if key not in cur_fields:
+            lines.append(f"\033[31m- {key}: {prev_fields[key]}\033[0m")
+        elif key not in prev_fields:
+            lines.append(f"\033[32m+ {key}: {cur_fields[key]}\033[0m")
+        elif prev_fields[key] != cur_fields[key]:
+            lines.append(
+                f"~ {key}: \033[31m{prev_fields[key]}\033[0m -> \033[32m{cur_fields[key]}\033[0m"
+            )
+    return "\n".join(lines)
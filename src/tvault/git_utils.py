@@ -0,0 +1,138 @@
+import os
+
+"""
+Resolves the commit hash of HEAD by reading .git directly.
+
+Walking parent directories and looking up HEAD through GitPython costs a lot for something
+done on every log call, so HEAD is read from .git/HEAD, the loose ref file it points to,
+or packed-refs. The result is memoized per process and invalidated when any of those files
+changes, e.g. after a commit or a checkout.
+GitPython is only imported when .git can't be read this way.
+"""
+
+_git_dirs = dict()
+_head_memo = dict()
+
+
+"""
+find the git directory of path, following .git files of worktrees and submodules.
+returns (git_dir, common_dir), or None if path is not in a git repository
+"""
+
+
+def find_git_dir(path="."):
+    path = os.path.abspath(path)
+    if path in _git_dirs:
+        return _git_dirs[path]
+    git_dir = None
+    current = path
+    while True:
+        dot_git = os.path.join(current, ".git")
+        if os.path.isdir(dot_git):
+            git_dir = dot_git
+            break
+        if os.path.isfile(dot_git):
+            with open(dot_git, "r") as f:
+                content = f.read().strip()
+            if content.startswith("gitdir: "):
+                git_dir = os.path.normpath(os.path.join(current, content[len("gitdir: ") :]))
+            break
+        parent = os.path.dirname(current)
+        if parent == current:
+            break
+        current = parent
+
+    if git_dir is None:
+        _git_dirs[path] = None
+        return None
+    common_dir = git_dir
+    if os.path.isfile(os.path.join(git_dir, "commondir")):
+        with open(os.path.join(git_dir, "commondir"), "r") as f:
+            common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    _git_dirs[path] = (git_dir, common_dir)
+    return _git_dirs[path]
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def read_packed_ref(common_dir, ref):
+    path = os.path.join(common_dir, "packed-refs")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("#") or line.startswith("^"):
+                continue
+            parts = line.split()
+            if len(parts) == 2 and parts[1] == ref:
+                return parts[0]
+    return None
+
+
+"""
+read HEAD from the git directory.
+returns (sha, files it was read from), or None if it can't be read without git
+"""
+
+
+def read_head(git_dir, common_dir):
+    head_path = os.path.join(git_dir, "HEAD")
+    with open(head_path, "r") as f:
+        head = f.read().strip()
+    if not head.startswith("ref: "):
+        # detached HEAD
+        return head, [head_path]
+    ref = head[len("ref: ") :]
+    for ref_dir in (git_dir, common_dir):
+        ref_path = os.path.join(ref_dir, ref)
+        if os.path.isfile(ref_path):
+            with open(ref_path, "r") as f:
+                return f.read().strip(), [head_path, ref_path]
+    packed_refs_path = os.path.join(common_dir, "packed-refs")
+    sha = read_packed_ref(common_dir, ref)
+    if sha is None:
+        return None
+    # a loose ref created later takes over packed-refs
+    return sha, [head_path, packed_refs_path, os.path.join(common_dir, ref)]
+
+
+def head_sha_from_gitpython(path="."):
+    import git
+
+    repo = git.Repo(path, search_parent_directories=True)
+    return repo.head.object.hexsha
+
+
+"""
+full commit hash of HEAD of the repository containing path.
+"""
+
+
+def head_sha(path="."):
+    git_dirs = find_git_dir(path)
+    if git_dirs is None:
+        return head_sha_from_gitpython(path)
+    git_dir, common_dir = git_dirs
+
+    memo = _head_memo.get(git_dir)
+    if memo is not None:
+        sha, signatures = memo
+        if all(file_signature(p) == s for p, s in signatures):
+            return sha
+
+    try:
+        head = read_head(git_dir, common_dir)
+    except (OSError, UnicodeDecodeError):
+        head = None
+    # sha-1 or sha-256 object names
+    if head is None or len(head[0]) not in (40, 64):
+        return head_sha_from_gitpython(path)
+    sha, paths = head
+    _head_memo[git_dir] = (sha, [(p, file_signature(p)) for p in paths])
+    return sha
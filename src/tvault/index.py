@@ -0,0 +1,278 @@
+import os
+import json
+import sqlite3
+import contextlib
+
+from .profiler import profiled
+
+"""
+Experiment index of a log directory.
+
+A sqlite sidecar (index.sqlite) holding hash, model index, result, timestamp and fields
+(tags) of every experiment, so that find can answer without loading model logs.
+The index is updated on every write of the log store, and is only a cache: commits whose
+model log files changed behind its back (e.g. copied from a colleague, or written by an
+older tvault) are detected from their file signature and indexed again by sync.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (sha TEXT PRIMARY KEY, signature TEXT);
+CREATE TABLE IF NOT EXISTS experiments (
+    sha TEXT, idx INTEGER, result, timestamp REAL, PRIMARY KEY (sha, idx)
+);
+CREATE TABLE IF NOT EXISTS fields (
+    sha TEXT, idx INTEGER, key TEXT, value TEXT, PRIMARY KEY (sha, idx, key)
+);
+CREATE INDEX IF NOT EXISTS experiments_result ON experiments (result);
+CREATE INDEX IF NOT EXISTS fields_key_value ON fields (key, value);
+"""
+# stored as the user_version of the database once its schema is created
+SCHEMA_VERSION = 1
+
+
+# tags, and optimizer / scheduler hyperparameters (see optim_utils.py)
+INDEXED_PREFIXES = ("tag-", "optimizer.", "scheduler.")
+
+
+def is_indexed_field(key):
+    return key.startswith(INDEXED_PREFIXES)
+
+
+# fields of a record read by the index, so that syncing skips sources and model trees
+def is_index_input(key):
+    return key in ("result", "timestamp") or is_indexed_field(key)
+
+
+def encode_value(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def encode_result(result):
+    if result is None or isinstance(result, (int, float, str)):
+        return result
+    return encode_value(result)
+
+
+"""
+fields of a model log read by the index, or the error reading it, e.g. of a model log
+pickled by an older tvault with values that are not plain data.
+"""
+
+
+def read_index_input(store, sha):
+    try:
+        return store.read(sha, is_index_input)
+    except Exception as e:
+        return e
+
+
+class ExperimentIndex:
+    def __init__(self, log_dir="./model_log"):
+        self.path = f"{log_dir}/index.sqlite"
+
+    """
+    connection to the index, creating its schema if the index is new.
+    """
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        if version < SCHEMA_VERSION:
+            conn.executescript(SCHEMA + f"PRAGMA user_version = {SCHEMA_VERSION};")
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = self.connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _set_fields(self, conn, sha, idx, fields):
+        for key, value in fields.items():
+            if key == "result":
+                conn.execute(
+                    "UPDATE experiments SET result = ? WHERE sha = ? AND idx = ?",
+                    (encode_result(value), sha, idx),
+                )
+            elif key == "timestamp":
+                conn.execute(
+                    "UPDATE experiments SET timestamp = ? WHERE sha = ? AND idx = ?",
+                    (value, sha, idx),
+                )
+            elif is_indexed_field(key):
+                conn.execute(
+                    "INSERT OR REPLACE INTO fields VALUES (?, ?, ?, ?)",
+                    (sha, idx, key, encode_value(value)),
+                )
+
+    def _add(self, conn, sha, idx, model_record):
+        conn.execute("DELETE FROM fields WHERE sha = ? AND idx = ?", (sha, idx))
+        conn.execute("INSERT OR REPLACE INTO experiments VALUES (?, ?, NULL, NULL)", (sha, idx))
+        self._set_fields(conn, sha, idx, model_record)
+
+    def _replace(self, conn, sha, model_log, signature):
+        conn.execute("DELETE FROM experiments WHERE sha = ?", (sha,))
+        conn.execute("DELETE FROM fields WHERE sha = ?", (sha,))
+        for idx, model_record in model_log.items():
+            self._add(conn, sha, idx, model_record)
+        conn.execute("INSERT OR REPLACE INTO commits VALUES (?, ?)", (sha, signature))
+
+    """
+    whether the commit was indexed from its model log as it was before a write,
+    previous being the signature of the model log then, None if it had none.
+    otherwise the commit is left stale, to be indexed in full by the next sync.
+    """
+
+    def _is_current(self, conn, sha, previous):
+        row = conn.execute("SELECT signature FROM commits WHERE sha = ?", (sha,)).fetchone()
+        return (row[0] if row is not None else None) == previous
+
+    """
+    index a new experiment.
+    """
+
+    def add(self, sha, idx, model_record, previous, signature):
+        with self.transaction() as conn:
+            if not self._is_current(conn, sha, previous):
+                return
+            self._add(conn, sha, idx, model_record)
+            conn.execute("INSERT OR REPLACE INTO commits VALUES (?, ?)", (sha, signature))
+
+    """
+    index changed fields of an experiment.
+    """
+
+    def update(self, sha, idx, fields, previous, signature):
+        with self.transaction() as conn:
+            if not self._is_current(conn, sha, previous):
+                return
+            conn.execute("INSERT OR IGNORE INTO experiments VALUES (?, ?, NULL, NULL)", (sha, idx))
+            self._set_fields(conn, sha, idx, fields)
+            conn.execute("INSERT OR REPLACE INTO commits VALUES (?, ?)", (sha, signature))
+
+    """
+    index every experiment of a commit again.
+    """
+
+    def replace(self, sha, model_log, signature):
+        with self.transaction() as conn:
+            self._replace(conn, sha, model_log, signature)
+
+    def _remove(self, conn, sha):
+        conn.execute("DELETE FROM experiments WHERE sha = ?", (sha,))
+        conn.execute("DELETE FROM fields WHERE sha = ?", (sha,))
+        conn.execute("DELETE FROM commits WHERE sha = ?", (sha,))
+
+    """
+    bring the index up to date with the log store, indexing again only commits whose
+    model log files changed since they were indexed.
+    if shas is given, only those commits are checked.
+    if rebuild is set, every commit is indexed again.
+    workers: threads reading model logs, see storage.parallel_map
+    returns the number of commits indexed.
+    model logs are read before the index is locked, which is then written in one short
+    transaction, skipping commits indexed by a write of the log store in between.
+    """
+
+    @profiled("index_sync")
+    def sync(self, store, shas=None, rebuild=False, workers=None):
+        from .storage import parallel_map
+
+        with self.transaction() as conn:
+            indexed = dict(conn.execute("SELECT sha, signature FROM commits"))
+        if shas is None:
+            shas = store.list_shas()
+            removed = set(indexed) - set(shas)
+        else:
+            removed = {sha for sha in shas if not store.exists(sha) and sha in indexed}
+            shas = [sha for sha in shas if store.exists(sha)]
+        signatures = parallel_map(store.signature, shas, workers)
+        stale = [(sha, s) for sha, s in zip(shas, signatures) if rebuild or indexed.get(sha) != s]
+        # logs are read by the pool, and indexed in the order of shas
+        model_logs = parallel_map(
+            lambda sha: read_index_input(store, sha), [sha for sha, _ in stale], workers
+        )
+
+        with self.transaction() as conn:
+            for (sha, signature), model_log in zip(stale, model_logs):
+                if not self._is_current(conn, sha, indexed.get(sha)):
+                    continue
+                if isinstance(model_log, Exception):
+                    # left out of the index, and tried again by the next sync
+                    print(
+                        f"tvault error: skipped model log {sha}, which can't be read: {model_log}"
+                    )
+                    self._remove(conn, sha)
+                    continue
+                self._replace(conn, sha, model_log, signature)
+            for sha in removed:
+                if self._is_current(conn, sha, indexed.get(sha)):
+                    self._remove(conn, sha)
+        return len(stale)
+
+    def count(self, sha):
+        with self.transaction() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM experiments WHERE sha = ?", (sha,)
+            ).fetchone()[0]
+
+    """
+    iterate over experiments matching the condition, as find's model info dicts
+    {HASH, MODEL-IDX, tag-..., RESULT}, ordered by hash and model index.
+    condition is a sql expression over experiments e, with its parameters.
+    """
+
+    def select(self, condition="1", params=()):
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                "SELECT e.sha, e.idx, e.result, f.key, f.value FROM experiments e "
+                "LEFT JOIN fields f ON f.sha = e.sha AND f.idx = e.idx "
+                f"WHERE {condition} ORDER BY e.sha, e.idx, f.rowid",
+                params,
+            )
+            model_info = None
+            for sha, idx, result, key, value in rows:
+                if model_info is None or (model_info["HASH"], model_info["MODEL-IDX"]) != (
+                    sha,
+                    idx,
+                ):
+                    if model_info is not None:
+                        yield finish_model_info(model_info)
+                    model_info = {"HASH": sha, "MODEL-IDX": idx, "RESULT": result}
+                if key is not None:
+                    model_info[key] = json.loads(value)
+            if model_info is not None:
+                yield finish_model_info(model_info)
+        finally:
+            conn.close()
+
+    """
+    keys of the fields of experiments matching the condition that start with prefix,
+    e.g. every tag of a find, in the order they were first indexed.
+    """
+
+    def field_keys(self, condition="1", params=(), prefix=""):
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT f.key FROM experiments e "
+                "JOIN fields f ON f.sha = e.sha AND f.idx = e.idx "
+                f"WHERE {condition} AND substr(f.key, 1, ?) = ? "
+                "GROUP BY f.key ORDER BY MIN(f.rowid)",
+                tuple(params) + (len(prefix), prefix),
+            )
+            return [key for key, in rows]
+
+
+def finish_model_info(model_info):
+    # RESULT goes last, and only if the experiment has one
+    result = model_info.pop("RESULT")
+    if result is not None:
+        model_info["RESULT"] = result
+    return model_info
@@ -0,0 +1,292 @@
+import os
+import sys
+import array
+import atexit
+import struct
+import threading
+from concurrent.futures import Future
+
+"""
+Per-step metric series of experiments, e.g. loss curves.
+
+A series lives in log_dir/metrics/{sha}/{idx}/ as column files of little-endian arrays
+    {name}.steps     int64 step of every point
+    {name}.values    float32 value of every point
+and summary levels {name}.L1, {name}.L2, ..., where every block of level k summarizes
+BLOCK_SIZE blocks of level k - 1 (points for level 1) as
+    (first step, last step, min, max, mean, last value)
+Points are buffered in memory and appended in batches, and only the blocks completed by a
+batch are added to the levels, so logging never rewrites a series or the model log.
+min / max / last of millions of points are read from a few blocks, and downsampled series
+from the coarsest level that still has enough blocks.
+A crash between the writes of a batch leaves columns of different lengths; only the points
+present in both are read, and the next batch cuts the longer column back.
+"""
+
+STEP_TYPE = "q"
+VALUE_TYPE = "f"
+BLOCK = struct.Struct("<qqffff")
+BLOCK_SIZE = 64
+MAX_LEVELS = 6
+# buffered points of a series written at once
+FLUSH_POINTS = 1024
+
+
+def series_dir(log_dir, sha, idx):
+    return f"{log_dir}/metrics/{sha}/{idx}"
+
+
+def file_name(name):
+    # metric names like train/loss
+    return name.replace("%", "%25").replace("/", "%2F")
+
+
+def metric_name(file_name):
+    return file_name.replace("%2F", "/").replace("%25", "%")
+
+
+def read_column(path, typecode, start=0, count=None):
+    column = array.array(typecode)
+    if not os.path.exists(path):
+        return column
+    with open(path, "rb") as f:
+        f.seek(start * column.itemsize)
+        data = f.read() if count is None else f.read(count * column.itemsize)
+    column.frombytes(data[: len(data) - len(data) % column.itemsize])
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def column_length(path, typecode):
+    if not os.path.exists(path):
+        return 0
+    return os.path.getsize(path) // array.array(typecode).itemsize
+
+
+def append_column(path, column):
+    if sys.byteorder == "big":
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    with open(path, "ab") as f:
+        f.write(column.tobytes())
+
+
+def summarize(blocks):
+    # blocks are (first step, last step, min, max, mean, last value, number of points)
+    count = sum(b[6] for b in blocks)
+    return (
+        blocks[0][0],
+        blocks[-1][1],
+        min(b[2] for b in blocks),
+        max(b[3] for b in blocks),
+        sum(b[4] * b[6] for b in blocks) / count,
+        blocks[-1][5],
+        count,
+    )
+
+
+class MetricSeries:
+    def __init__(self, log_dir, sha, idx, name):
+        self.dir = series_dir(log_dir, sha, idx)
+        self.name = name
+        self.path = f"{self.dir}/{file_name(name)}"
+
+    def level_path(self, level):
+        return f"{self.path}.L{level}"
+
+    def length(self):
+        return min(
+            column_length(self.path + ".steps", STEP_TYPE),
+            column_length(self.path + ".values", VALUE_TYPE),
+        )
+
+    def level_length(self, level):
+        if not os.path.exists(self.level_path(level)):
+            return 0
+        return os.path.getsize(self.level_path(level)) // BLOCK.size
+
+    def read_level(self, level, start=0):
+        if level == 0:
+            steps = read_column(self.path + ".steps", STEP_TYPE, start, self.length() - start)
+            values = read_column(self.path + ".values", VALUE_TYPE, start, len(steps))
+            return [(s, s, v, v, v, v, 1) for s, v in zip(steps, values)]
+        with open(self.level_path(level), "rb") as f:
+            f.seek(start * BLOCK.size)
+            data = f.read(BLOCK.size * (self.level_length(level) - start))
+        points = BLOCK_SIZE**level
+        return [block + (points,) for block in BLOCK.iter_unpack(data)]
+
+    """
+    append points, given as columns of steps and values.
+    """
+
+    def append(self, steps, values):
+        os.makedirs(self.dir, exist_ok=True)
+        length = self.length()
+        for suffix in (".steps", ".values"):
+            path = self.path + suffix
+            if os.path.exists(path):
+                typecode = STEP_TYPE if suffix == ".steps" else VALUE_TYPE
+                if column_length(path, typecode) > length:
+                    os.truncate(path, length * array.array(typecode).itemsize)
+        append_column(self.path + ".steps", array.array(STEP_TYPE, steps))
+        append_column(self.path + ".values", array.array(VALUE_TYPE, values))
+        self.update_levels()
+
+    def update_levels(self):
+        below = self.length()
+        for level in range(1, MAX_LEVELS + 1):
+            complete = below // BLOCK_SIZE
+            done = self.level_length(level)
+            if done > complete:
+                os.truncate(self.level_path(level), complete * BLOCK.size)
+                done = complete
+            if complete > done:
+                items = self.read_level(level - 1, done * BLOCK_SIZE)
+                blocks = []
+                for i in range(complete - done):
+                    block = summarize(items[i * BLOCK_SIZE : (i + 1) * BLOCK_SIZE])
+                    blocks.append(BLOCK.pack(*block[:6]))
+                with open(self.level_path(level), "ab") as f:
+                    f.write(b"".join(blocks))
+            below = complete
+            if below < BLOCK_SIZE:
+                break
+
+    """
+    blocks covering the whole series at the given level: the blocks of that level, then
+    finer blocks and points for the tail the level doesn't cover yet.
+    """
+
+    def cover(self, level):
+        blocks = []
+        covered = 0
+        for current in range(level, -1, -1):
+            # points of the series covered by one block of this level
+            points = BLOCK_SIZE**current
+            start = covered // points
+            if current > 0 and self.level_length(current) <= start:
+                continue
+            blocks += self.read_level(current, start)
+            covered = sum(b[6] for b in blocks)
+        return blocks
+
+    def summary(self):
+        level = 0
+        while level < MAX_LEVELS and self.level_length(level + 1) > 0:
+            level += 1
+        blocks = self.cover(level)
+        if not blocks:
+            return None
+        first, last_step, low, high, mean, last, count = summarize(blocks)
+        return {
+            "min": low,
+            "max": high,
+            "mean": mean,
+            "last": last,
+            "last_step": last_step,
+            "count": count,
+        }
+
+    """
+    the series downsampled to at most about points blocks, as
+    (first step, last step, min, max, mean, last value) of every block.
+    every point is returned if points is None or the series is small enough.
+    """
+
+    def read(self, points=None):
+        level = 0
+        if points is not None:
+            while level < MAX_LEVELS and self.length() // BLOCK_SIZE**level > points:
+                if self.level_length(level + 1) == 0:
+                    break
+                level += 1
+        return [block[:6] for block in self.cover(level)]
+
+
+"""
+Buffers points per series and writes them in batches.
+"""
+
+
+class MetricBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.points = dict()
+
+    """
+    buffer a point. idx may be a Future of the model index of an experiment still being
+    logged in the background.
+    """
+
+    def add(self, store, sha, idx, name, value, step):
+        key = (store.log_dir, sha, idx, name)
+        with self.lock:
+            if key not in self.points:
+                self.points[key] = (store, [], [])
+            _, steps, values = self.points[key]
+            steps.append(step)
+            values.append(value)
+            full = len(steps) % FLUSH_POINTS == 0
+        if full:
+            self.flush(key)
+
+    """
+    write the buffered points of the series key, or of every series if key is None.
+    points of an experiment still being logged are kept buffered, unless every series is
+    written, which waits for it.
+    """
+
+    def flush(self, key=None):
+        with self.lock:
+            keys = [key] if key is not None else list(self.points)
+            batches = [(k, self.points.pop(k)) for k in keys if k in self.points]
+        for batch_key, (store, steps, values) in batches:
+            log_dir, sha, idx, name = batch_key
+            if isinstance(idx, Future):
+                if key is not None and not idx.done():
+                    self.keep(batch_key, store, steps, values)
+                    continue
+                try:
+                    idx = idx.result()
+                except Exception:
+                    print(f"tvault error: dropped metric {name}, its model failed to be logged.")
+                    continue
+            with store.lock(sha):
+                MetricSeries(log_dir, sha, idx, name).append(steps, values)
+
+    # put points back in front of the ones added since
+    def keep(self, key, store, steps, values):
+        with self.lock:
+            if key in self.points:
+                _, new_steps, new_values = self.points[key]
+                steps, values = steps + new_steps, values + new_values
+            self.points[key] = (store, steps, values)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = MetricBuffer()
+            atexit.register(_buffer.flush)
+    return _buffer
+
+
+def flush():
+    if _buffer is not None:
+        _buffer.flush()
+
+
+def list_metrics(log_dir, sha, idx):
+    path = series_dir(log_dir, sha, idx)
+    if not os.path.exists(path):
+        return []
+    return sorted(
+        metric_name(f[: -len(".steps")]) for f in os.listdir(path) if f.endswith(".steps")
+    )
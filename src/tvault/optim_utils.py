@@ -0,0 +1,92 @@
+"""
+Structured capture of optimizers and schedulers.
+
+Optimizers are logged as flat, typed fields instead of their text view:
+    optimizer.type          class name, e.g. SGD
+    optimizer.<name>        hyperparameter of the first param group, e.g. optimizer.lr
+    optimizer.<i>.<name>    hyperparameter of param group i > 0
+and schedulers as scheduler.type and scheduler.<name> for the scalars of their state_dict.
+Parameters, tensors and other values that aren't plain scalars are left out, so fields
+are identical across runs of the same configuration, can be filtered on by find
+(e.g. optimizer.lr>=0.01) and are diffed field by field.
+Experiments logged by older versions keep the text view under "optimizer".
+"""
+
+PREFIXES = ("optimizer.", "scheduler.")
+
+
+def is_optim_field(key):
+    return key.startswith(PREFIXES)
+
+
+"""
+value as a json scalar or a list of scalars.
+returns (whether the value is kept, value), values that are neither aren't kept
+"""
+
+
+def plain_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True, value
+    if isinstance(value, (list, tuple)):
+        values = [plain_value(v) for v in value]
+        if all(kept for kept, _ in values):
+            return True, [v for _, v in values]
+        return False, None
+    # single element tensors and numpy scalars
+    if hasattr(value, "item") and getattr(value, "ndim", 0) == 0:
+        try:
+            return plain_value(value.item())
+        except (TypeError, ValueError):
+            pass
+    return False, None
+
+
+def capture_optimizer(optimizer):
+    fields = {"optimizer.type": type(optimizer).__name__}
+    if not hasattr(optimizer, "param_groups"):
+        return fields
+    for i, group in enumerate(optimizer.param_groups):
+        prefix = "optimizer." if i == 0 else f"optimizer.{i}."
+        for name, value in group.items():
+            if name == "params":
+                continue
+            kept, value = plain_value(value)
+            if kept:
+                fields[prefix + name] = value
+    return fields
+
+
+def capture_scheduler(scheduler):
+    fields = {"scheduler.type": type(scheduler).__name__}
+    if not hasattr(scheduler, "state_dict"):
+        return fields
+    for name, value in scheduler.state_dict().items():
+        # private bookkeeping, e.g. _step_count and _last_lr
+        if name.startswith("_"):
+            continue
+        kept, value = plain_value(value)
+        if kept:
+            fields["scheduler." + name] = value
+    return fields
+
+
+"""
+optimizer and scheduler fields of a model record.
+"""
+
+
+def optim_fields(model_record):
+    return {k: v for k, v in model_record.items() if is_optim_field(k)}
+
+
+"""
+text view of the optimizer of a model record, for records logged with the text view or
+diffed against one.
+"""
+
+
+def optimizer_text(model_record):
+    if "optimizer" in model_record:
+        return model_record["optimizer"]
+    return "\n".join(f"{k}: {v}" for k, v in optim_fields(model_record).items())
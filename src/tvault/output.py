@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import itertools
+
+from .query import INFO_KEYS, field_key
+
+"""
+Streaming output of find.
+
+Model infos are written as the query yields them, so the first rows of a large result set
+show up at once and memory stays bounded by one page:
+    table    a table of every PAGE_SIZE rows, all with the columns of the first page
+    csv      a header and one row per model, values of other types than str json encoded
+    jsonl    one json object per model, the model info or its declared columns
+Columns are either declared, e.g. "hash,idx,tag.size,result", or hash, model index, every
+tag of the matching experiments, read from the index before the rows, and result. Tables of
+rows whose tags are not known up front take the tags of each page, and csv of the first.
+Output is flushed page by page, and stops quietly when stdout is closed, e.g. by head.
+"""
+
+FORMATS = ("table", "csv", "jsonl")
+PAGE_SIZE = 100
+
+
+def column_label(key):
+    if key.startswith("tag-"):
+        return key[len("tag-") :]
+    return key
+
+
+"""
+[(model info key, label)] of declared columns, e.g. "hash,idx,tag.size,result".
+"""
+
+
+def resolve_columns(names):
+    if isinstance(names, str):
+        names = names.split(",")
+    keys = [INFO_KEYS.get(name.strip().lower(), field_key(name.strip())) for name in names]
+    return [(key, column_label(key)) for key in keys if key != ""]
+
+
+def model_tag_keys(model_infos):
+    tags = []
+    for model_info in model_infos:
+        tags += [key for key in model_info if key.startswith("tag-") and key not in tags]
+    return tags
+
+
+def default_columns(tag_keys):
+    keys = ["HASH", "MODEL-IDX"] + list(tag_keys) + ["RESULT"]
+    return [(key, column_label(key)) for key in keys]
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def write_table(pages, columns, out):
+    from prettytable import PrettyTable
+
+    count = 0
+    for page in pages:
+        page_columns = columns or default_columns(model_tag_keys(page))
+        tab = PrettyTable([label for _, label in page_columns])
+        for model_info in page:
+            tab.add_row([model_info.get(key, "") for key, _ in page_columns])
+        out.write(f"{tab}\n")
+        out.flush()
+        count += len(page)
+    return count
+
+
+def write_csv(pages, columns, out):
+    import csv
+
+    writer = csv.writer(out)
+    writer.writerow([label for _, label in columns])
+    count = 0
+    for page in pages:
+        for model_info in page:
+            writer.writerow([csv_value(model_info.get(key)) for key, _ in columns])
+        out.flush()
+        count += len(page)
+    return count
+
+
+def write_jsonl(pages, columns, out):
+    count = 0
+    for page in pages:
+        for model_info in page:
+            if columns is not None:
+                model_info = {key: model_info.get(key) for key, _ in columns}
+            out.write(json.dumps(model_info) + "\n")
+        out.flush()
+        count += len(page)
+    return count
+
+
+def paginate(model_infos, page_size):
+    model_infos = iter(model_infos)
+    while True:
+        page = list(itertools.islice(model_infos, page_size))
+        if not page:
+            return
+        yield page
+
+
+"""
+write model infos in format as they are yielded, returns the number of models written,
+or None if stdout was closed.
+columns: declared columns, as a list or comma separated names
+tag_keys: tag keys of every model, for the default columns, if known up front
+"""
+
+
+def write_results(
+    model_infos, columns=None, format="table", out=None, page_size=PAGE_SIZE, tag_keys=None
+):
+    out = out or sys.stdout
+    columns = resolve_columns(columns) if columns else None
+    pages = paginate(model_infos, page_size)
+    first = next(pages, None)
+    if first is None and columns is None:
+        return 0
+    pages = itertools.chain([first] if first else [], pages)
+    try:
+        if format == "jsonl":
+            return write_jsonl(pages, columns, out)
+        if columns is None and tag_keys is not None:
+            columns = default_columns(tag_keys)
+        if format == "csv":
+            return write_csv(pages, columns or default_columns(model_tag_keys(first)), out)
+        return write_table(pages, columns, out)
+    except BrokenPipeError:
+        # the reader is gone, e.g. | head, so silence the flush at exit as well
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, out.fileno())
+        return None
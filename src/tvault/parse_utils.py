@@ -1,48 +1,384 @@
+import os
+import re
 import ast
+import sys
 import glob
-import difflib
+import json
+import hashlib
+import inspect
 from collections import defaultdict
+from collections.abc import Mapping
+
+from .profiler import add_bytes, profiled
 
 """
-extract target_modules, class_defs, function_defs from model.
+Walks the module hierarchy of a pytorch model once.
+returns the model tree as a list of (path, class name, extra_repr) in named_modules order,
+or None if model is not a nn.Module.
 """
 
 
-def extract_info_from_model(model, model_dir):
-    model = model.__str__()
-    target_modules = set()
-    # retrieve target modules
-    for line in model.split("\n"):
-        if "(" in line:
-            if line == line.strip():
-                # model classname
-                target_module = line.split("(")[0]
+def extract_model_tree(model):
+    if not hasattr(model, "named_modules"):
+        return None
+    try:
+        named_modules = model.named_modules(remove_duplicate=False)
+    # older pytorch versions list shared modules once
+    except TypeError:
+        named_modules = model.named_modules()
+    return [(path, type(module).__name__, module.extra_repr()) for path, module in named_modules]
+
+
+"""
+Renders a model tree the way nn.Module.__repr__ does.
+Only done when the text view is displayed, as it is costly for large models.
+"""
+
+
+def render_model_tree(model_tree):
+    children = defaultdict(list)
+    for path, type_name, extra_repr in model_tree[1:]:
+        parent = path.rsplit(".", 1)[0] if "." in path else ""
+        children[parent].append((path, type_name, extra_repr))
+
+    def render(path, type_name, extra_repr):
+        extra_lines = extra_repr.split("\n") if extra_repr else []
+        child_lines = []
+        for child in children[path]:
+            child_repr = render(*child).replace("\n", "\n  ")
+            child_lines.append(f"({child[0].rsplit('.', 1)[-1]}): {child_repr}")
+        lines = extra_lines + child_lines
+        main_str = type_name + "("
+        if lines:
+            if len(extra_lines) == 1 and not child_lines:
+                main_str += extra_lines[0]
             else:
-                # submodules
-                target_module = line.split("(")[1].split(" ")[-1]
-            target_modules.add(target_module)
+                main_str += "\n  " + "\n  ".join(lines) + "\n"
+        return main_str + ")"
+
+    return render(*model_tree[0])
+
+
+"""
+Text view of a logged model.
+"""
 
-    # retrieve class / function definitions
-    class_defs, function_defs = get_defs(model_dir)
+
+def model_repr(model_record):
+    if "model" in model_record:
+        return model_record["model"]
+    return render_model_tree(model_record["model_tree"])
+
+
+"""
+Captures what logging needs from a live model: its model tree (or its text view if it is
+not a nn.Module) and the classes of its modules.
+Only walks the model in memory, so it is cheap enough to run in the training loop, while
+sources are parsed later from the capture by extract_info_from_model.
+"""
+
+
+@profiled("capture")
+def capture_model(model):
+    capture = {"model_tree": extract_model_tree(model), "classes": None}
+    if capture["model_tree"] is None:
+        capture["model"] = model.__str__()
+    if hasattr(model, "modules"):
+        capture["classes"] = {type(m) for m in model.modules()}
+    return capture
+
+
+"""
+extract target_modules, class_defs, function_defs from model, or from its capture.
+"""
+
+
+def extract_info_from_model(model, model_dir, cache_dir=None, capture=None):
+    if capture is None:
+        capture = capture_model(model)
+    target_modules = set()
+    if capture["model_tree"] is not None:
+        target_modules = {type_name for _, type_name, _ in capture["model_tree"]}
+    else:
+        # retrieve target modules from model representation
+        for line in capture["model"].split("\n"):
+            if "(" in line:
+                if line == line.strip():
+                    # model classname
+                    target_module = line.split("(")[0]
+                else:
+                    # submodules
+                    target_module = line.split("(")[1].split(" ")[-1]
+                target_modules.add(target_module)
+
+    # retrieve class / function definitions, scanning model_dir only if the model's source
+    # files can't be located
+    defs = resolve_model_defs(capture["classes"], model_dir, target_modules, cache_dir)
+    if defs is None:
+        defs = get_defs(model_dir, cache_dir)
+    class_defs, function_defs = defs
     return class_defs, function_defs, target_modules
 
 
+"""
+Definition cache of parsed .py files.
+Entries are keyed by absolute path and hold (mtime_ns, size, content hash, defs), where defs
+is a list of top-level (kind, name, source) of the file.
+A file whose mtime and size are unchanged is never read again, and a touched file whose
+content hash is unchanged is not parsed again.
+The in-process memo makes repeated calls within one process skip the disk cache as well.
+Sources are cached instead of ast nodes, as json so that a shared log dir never runs code
+from the cache when it is loaded.
+"""
+
+_defs_memo = dict()
+_disk_caches = dict()
+
+
+def defs_cache_path(cache_dir):
+    return f"{cache_dir}/defs-py{sys.version_info.major}{sys.version_info.minor}.json"
+
+
+def load_defs_cache(cache_dir):
+    if cache_dir not in _disk_caches:
+        disk_cache = dict()
+        if os.path.exists(defs_cache_path(cache_dir)):
+            try:
+                with open(defs_cache_path(cache_dir)) as f:
+                    for path, (mtime_ns, size, digest, file_defs) in json.load(f).items():
+                        file_defs = [tuple(file_def) for file_def in file_defs]
+                        disk_cache[path] = (mtime_ns, size, digest, file_defs)
+            # a broken cache is rebuilt from scratch
+            except Exception:
+                disk_cache = dict()
+        _disk_caches[cache_dir] = disk_cache
+    return _disk_caches[cache_dir]
+
+
+def save_defs_cache(cache_dir):
+    from .storage import tmp_suffix
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = defs_cache_path(cache_dir)
+    tmp_path = path + tmp_suffix()
+    # a copy, as a background log may add entries while it is written
+    disk_cache = dict(_disk_caches[cache_dir])
+    with open(tmp_path, "w") as f:
+        json.dump(disk_cache, f)
+    os.replace(tmp_path, path)
+
+
+"""
+lines of a file as the tokenizer counts them, decoded with its PEP 263 encoding.
+str.splitlines also breaks on form feeds and other separators, which would shift the
+line numbers of ast nodes.
+"""
+
+
+def source_lines(source):
+    import io
+    import tokenize
+
+    encoding, _ = tokenize.detect_encoding(io.BytesIO(source).readline)
+    return re.split(r"\r\n|\r|\n", source.decode(encoding, errors="replace"))
+
+
+def parse_file_defs(source):
+    file_defs = []
+    lines = None
+    for stmt in ast.parse(source).body:
+        if type(stmt) == ast.ClassDef:
+            kind = "class"
+        elif type(stmt) == ast.FunctionDef:
+            kind = "function"
+        else:
+            continue
+        if lines is None:
+            lines = source_lines(source)
+        start = min([stmt.lineno] + [d.lineno for d in stmt.decorator_list])
+        file_defs.append((kind, stmt.name, "\n".join(lines[start - 1 : stmt.end_lineno])))
+    return file_defs
+
+
+"""
+key -> ast node mapping of definitions.
+A definition is parsed from its source only when it is accessed.
+"""
+
+
+class DefinitionMap(Mapping):
+    def __init__(self):
+        self.sources = dict()
+        self.nodes = dict()
+
+    def add(self, key, source):
+        self.sources[key] = source
+
+    def __getitem__(self, key):
+        if key not in self.nodes:
+            self.nodes[key] = ast.parse(self.sources[key]).body[0]
+        return self.nodes[key]
+
+    def __contains__(self, key):
+        return key in self.sources
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+
+"""
+Top-level definitions of one file, from the memo, the disk cache or by parsing it.
+returns (defs, whether the disk cache was updated)
+"""
+
+
+def get_file_defs(filename, cache_dir=None):
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    memo = _defs_memo.get(path)
+    if memo is not None and memo[:2] == (stat.st_mtime_ns, stat.st_size):
+        return memo[3], False
+
+    disk_cache = load_defs_cache(cache_dir) if cache_dir is not None else dict()
+    entry = disk_cache.get(path)
+    if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+        _defs_memo[path] = entry
+        return entry[3], False
+
+    with open(path, "rb") as f:
+        source = f.read()
+    add_bytes(read=len(source))
+    digest = hashlib.sha256(source).hexdigest()
+    if entry is not None and entry[2] == digest:
+        file_defs = entry[3]
+    elif memo is not None and memo[2] == digest:
+        file_defs = memo[3]
+    else:
+        file_defs = parse_file_defs(source)
+    entry = (stat.st_mtime_ns, stat.st_size, digest, file_defs)
+    _defs_memo[path] = entry
+    if cache_dir is None:
+        return file_defs, False
+    disk_cache[path] = entry
+    return file_defs, True
+
+
+# directories of installed packages, e.g. of a project-local .venv
+PACKAGE_DIRS = ("site-packages", "dist-packages")
+
+
+"""
+whether path is a source file of the model in model directory root: not in a hidden
+directory, which the glob of get_defs skips, nor in installed packages.
+"""
+
+
+def is_model_file(path, root):
+    if not path.startswith(root + os.sep):
+        return False
+    parts = os.path.relpath(path, root).split(os.sep)[:-1]
+    return not any(part.startswith(".") or part in PACKAGE_DIRS for part in parts)
+
+
 """
 From model directory, retrieves every class and function definition from .py files
 """
 
 
-def get_defs(model_dir):
-    function_defs = defaultdict(lambda: "")
-    class_defs = defaultdict(lambda: "")
+@profiled("get_defs")
+def get_defs(model_dir, cache_dir=None):
+    function_defs = DefinitionMap()
+    class_defs = DefinitionMap()
+    cache_updated = False
+    root = os.path.abspath(model_dir or ".")
     for filename in glob.iglob(model_dir + "**/*.py", recursive=True):
-        with open(filename, "r") as f:
-            file_ast = ast.parse(f.read())
-        for stmt in file_ast.body:
-            if type(stmt) == ast.ClassDef:
-                class_defs[filename + ":" + stmt.name] = stmt
-            elif type(stmt) == ast.FunctionDef:
-                function_defs[filename + ":" + stmt.name] = stmt
+        if not is_model_file(os.path.abspath(filename), root):
+            continue
+        file_defs, updated = get_file_defs(filename, cache_dir)
+        cache_updated = cache_updated or updated
+        for kind, name, source in file_defs:
+            if kind == "class":
+                class_defs.add(filename + ":" + name, source)
+            else:
+                function_defs.add(filename + ":" + name, source)
+    if cache_updated:
+        save_defs_cache(cache_dir)
+    return class_defs, function_defs
+
+
+"""
+Retrieves class and function definitions of the files that define the model's classes,
+instead of every .py file in model directory.
+Files are located from the classes of the model's submodules, and external functions are
+followed through the globals of the modules that use them, so only files inside model
+directory that the model actually depends on are parsed.
+Returns None if the source of a class can't be located, e.g. classes defined in a notebook,
+or if classes is None.
+"""
+
+
+@profiled("resolve_model_defs")
+def resolve_model_defs(classes, model_dir, target_modules, cache_dir=None):
+    if classes is None:
+        return None
+    root = os.path.abspath(model_dir or ".")
+    function_defs = DefinitionMap()
+    class_defs = DefinitionMap()
+    loaded = set()
+    cache_updated = False
+
+    def load(path):
+        nonlocal cache_updated
+        if path in loaded:
+            return
+        loaded.add(path)
+        file_defs, updated = get_file_defs(path, cache_dir)
+        cache_updated = cache_updated or updated
+        # keys look the same as the ones of get_defs
+        filename = os.path.join(model_dir, os.path.relpath(path, root))
+        for kind, name, source in file_defs:
+            if kind == "class":
+                class_defs.add(filename + ":" + name, source)
+            else:
+                function_defs.add(filename + ":" + name, source)
+
+    def locate(obj):
+        try:
+            path = inspect.getsourcefile(obj)
+        except TypeError:
+            path = getattr(sys.modules.get(obj.__module__), "__file__", None)
+        if path is None or not os.path.isfile(path):
+            return None
+        return os.path.abspath(path)
+
+    for cls in classes:
+        path = locate(cls)
+        if path is None:
+            return None
+        if is_model_file(path, root):
+            load(path)
+
+    # follow functions used by target classes, if they are not defined in the loaded files
+    target_class_defs = {k: class_defs[k] for k in class_defs if k.split(":")[-1] in target_modules}
+    defined_funcs = {k.split(":")[-1] for k in function_defs}
+    for function_name in match_external_funcs(target_class_defs):
+        if function_name in defined_funcs:
+            continue
+        for cls in classes:
+            module = sys.modules.get(cls.__module__)
+            func = getattr(module, function_name, None)
+            if not inspect.isfunction(func):
+                continue
+            path = locate(func)
+            if path is not None and is_model_file(path, root):
+                load(path)
+                break
+
+    if cache_updated:
+        save_defs_cache(cache_dir)
     return class_defs, function_defs
 
 
@@ -103,110 +439,90 @@ def print_util(diff_dict):
     if len(diff_dict["optimizer"]) > 0:
         ret_str += "4. OPTIMIZER DIFF: diff of optimizer used in each experiments.\n"
         ret_str += diff_dict["optimizer"] + "\n"
+
+    if len(diff_dict.get("weights", "")) > 0:
+        ret_str += "5. WEIGHTS DIFF: tensors that differ between experiments.\n"
+        ret_str += diff_dict["weights"] + "\n"
     return ret_str
 
 
-def extract_diff(prev_model, cur_model):
+"""
+Checks whether a class / function source is identical in two experiments.
+Compares stored hashes when both experiments have them, so sources are never loaded.
+"""
+
+
+def same_source(prev_model, cur_model, field, name):
+    prev_hash = prev_model.get(f"{field}_hash", {}).get(name)
+    cur_hash = cur_model.get(f"{field}_hash", {}).get(name)
+    if prev_hash is not None and cur_hash is not None:
+        return prev_hash == cur_hash
+    return prev_model[field][name] == cur_model[field][name]
+
+
+@profiled("extract_diff")
+def extract_diff(prev_model, cur_model, semantic=False):
+    from .diff_utils import color_diff, color_fields_diff, color_tree_diff, semantic_diff
+    from .optim_utils import optim_fields, optimizer_text
+
+    # semantic mode diffs sources method by method, see diff_utils
+    source_diff = semantic_diff if semantic else color_diff
+
     diff_dict = dict()
-    # 1. get model diff using string
-    model_diff = [
-        e for e in difflib.ndiff(prev_model["model"].split("\n"), cur_model["model"].split("\n"))
-    ]
-    filter_model_diff = [l for l in model_diff if not l.startswith("? ")]
-    changes = [l for l in model_diff if l.startswith("+ ") or l.startswith("- ")]
-    if len(changes) > 0:
-        color_model_diff = []
-        for e in filter_model_diff:
-            if e.startswith("+ "):
-                color_model_diff.append("\033[32m" + e + "\033[0m")
-            elif e.startswith("- "):
-                color_model_diff.append("\033[31m" + e + "\033[0m")
-            else:
-                color_model_diff.append(e)
-        model_diff = "\n".join(color_model_diff)
-        diff_dict["model"] = model_diff
+    # 1. get model diff, over the module tree if both models were logged with it
+    if "model_tree" in prev_model and "model_tree" in cur_model:
+        diff_dict["model"] = color_tree_diff(prev_model["model_tree"], cur_model["model_tree"])
     else:
-        diff_dict["model"] = ""
+        diff_dict["model"] = color_diff(model_repr(prev_model), model_repr(cur_model))
 
     # 2. Check module definition between modules
     class_diff_dict = dict()
-    for p_module, p_source in prev_model["src"].items():
+    for p_module in prev_model["src"].keys():
         # if module still exists in current model
         if p_module in cur_model["src"].keys():
-            class_diff = [
-                e
-                for e in difflib.ndiff(p_source.split("\n"), cur_model["src"][p_module].split("\n"))
-            ]  # generator requires this wrapping
-            changes = [l for l in class_diff if l.startswith("+ ") or l.startswith("- ")]
-            filter_class_diff = [l for l in class_diff if not l.startswith("? ")]
-            if len(changes) > 0:
-                color_class_diff = []
-                for e in filter_class_diff:
-                    if e.startswith("+ "):
-                        color_class_diff.append("\033[32m" + e + "\033[0m")
-                    elif e.startswith("- "):
-                        color_class_diff.append("\033[31m" + e + "\033[0m")
-                    else:
-                        color_class_diff.append(e)
-                class_diff_dict[p_module] = "\n".join(color_class_diff)
+            if same_source(prev_model, cur_model, "src", p_module):
+                continue
+            class_diff = source_diff(prev_model["src"][p_module], cur_model["src"][p_module])
+            if class_diff:
+                class_diff_dict[p_module] = class_diff
         else:
             class_diff_dict[p_module] = "module removed"
-    for c_module, c_source in cur_model["src"].items():
+    for c_module in cur_model["src"].keys():
         if c_module not in prev_model["src"].keys():
             class_diff_dict[c_module] = "module added"
     diff_dict["src"] = class_diff_dict
 
     # 3. Check external function diff
     func_diff_dict = dict()
-    for p_func, p_source in prev_model["external_func"].items():
+    for p_func in prev_model["external_func"].keys():
         if p_func in cur_model["external_func"].keys():
-            func_diff = [
-                e
-                for e in difflib.ndiff(
-                    p_source.split("\n"), cur_model["external_func"][p_func].split("\n")
-                )
-            ]  # generator requires this wrapping
-            changes = [l for l in func_diff if l.startswith("+ ") or l.startswith("- ")]
-            filter_func_diff = [l for l in func_diff if not l.startswith("? ")]
-            if len(changes) > 0:
-                color_func_diff = []
-                for e in filter_func_diff:
-                    if e.startswith("+ "):
-                        color_func_diff.append("\033[32m" + e + "\033[0m")
-                    elif e.startswith("- "):
-                        color_func_diff.append("\033[31m" + e + "\033[0m")
-                    else:
-                        color_func_diff.append(e)
-                func_diff_dict[p_func] = "\n".join(color_func_diff)
+            if same_source(prev_model, cur_model, "external_func", p_func):
+                continue
+            func_diff = source_diff(
+                prev_model["external_func"][p_func], cur_model["external_func"][p_func]
+            )
+            if func_diff:
+                func_diff_dict[p_func] = func_diff
         else:
             func_diff_dict[p_func] = "function removed"
-    for c_func, c_source in cur_model["external_func"].items():
+    for c_func in cur_model["external_func"].keys():
         if c_func not in prev_model["external_func"].keys():
             func_diff_dict[c_func] = "function added"
     diff_dict["func"] = func_diff_dict
 
-    # 4. Check optimizer diff
-    opt_diff = [
-        e
-        for e in difflib.ndiff(
-            prev_model["optimizer"].split("\n"), cur_model["optimizer"].split("\n")
-        )
-    ]
-    filter_opt_diff = [l for l in opt_diff if not l.startswith("? ")]
-    changes = [l for l in opt_diff if l.startswith("+ ") or l.startswith("- ")]
-    if len(changes) > 0:
-        color_opt_diff = []
-        for e in filter_opt_diff:
-            if e.startswith("+ "):
-                color_opt_diff.append("\033[32m" + e + "\033[0m")
-            elif e.startswith("- "):
-                color_opt_diff.append("\033[31m" + e + "\033[0m")
-            else:
-                color_opt_diff.append(e)
-        opt_diff = "\n".join(color_opt_diff)
-        diff_dict["optimizer"] = opt_diff
+    # 4. Check optimizer diff, field by field unless an experiment only has the text view
+    if "optimizer" in prev_model or "optimizer" in cur_model:
+        diff_dict["optimizer"] = color_diff(optimizer_text(prev_model), optimizer_text(cur_model))
     else:
-        diff_dict["optimizer"] = ""
+        diff_dict["optimizer"] = color_fields_diff(
+            optim_fields(prev_model), optim_fields(cur_model)
+        )
+
+    # 5. Check weights diff, if both experiments were logged with weights
+    if "weights" in prev_model and "weights" in cur_model:
+        from .weights import color_weights_diff
+
+        diff_dict["weights"] = color_weights_diff(prev_model["weights"], cur_model["weights"])
 
     ret_str = print_util(diff_dict)
 
@@ -0,0 +1,224 @@
+import os
+import time
+import threading
+import functools
+
+"""
+Opt-in profiling of tvault calls, enabled by TVAULT_PROFILE=1 or TorchVault(profile=True).
+
+Profiled calls (log_model, read_model_log, find, ...) and the phases inside them (git,
+scan, unparse, io, ...) record their count, time and bytes read and written, keyed by
+    call           e.g. log_model
+    call/phase     e.g. log_model/unparse, the phase as part of the outermost call
+so the cost of tvault in a training loop can be told apart phase by phase.
+Calls nested in another call are only recorded as its phases.
+When profiling is enabled, the stats of a process are appended as one json line to
+log_dir/stats/profile.jsonl when it exits, and aggregated across runs by
+`tvault --stats_flag`.
+When disabled, a profiled call or phase costs one check of a global flag.
+"""
+
+_enabled = os.environ.get("TVAULT_PROFILE", "") not in ("", "0")
+_output_dir = None
+_stats = dict()
+_stats_lock = threading.Lock()
+_local = threading.local()
+
+
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_phase = NullPhase()
+
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.key = self.name if not stack else f"{stack[0].key}/{self.name}"
+        # a phase re-entered within itself is recorded once, by the outer one
+        self.recorded = all(frame.key != self.key for frame in stack)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        _local.stack.pop()
+        if self.recorded:
+            with _stats_lock:
+                entry = _stats.setdefault(self.key, [0, 0.0, 0, 0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] += self.bytes_read
+                entry[3] += self.bytes_written
+        return False
+
+
+def enabled():
+    return _enabled
+
+
+"""
+enable profiling, stats are saved to log_dir when the process exits.
+"""
+
+
+def enable(log_dir=None):
+    global _enabled
+    _enabled = True
+    if log_dir is not None:
+        set_output(log_dir, replace=True)
+
+
+"""
+log dir stats are saved to, kept if already set unless replace is set.
+"""
+
+
+def set_output(log_dir, replace=False):
+    global _output_dir
+    if _output_dir is None:
+        import atexit
+
+        atexit.register(save)
+    elif not replace:
+        return
+    _output_dir = os.path.abspath(log_dir)
+
+
+def phase(name):
+    if not _enabled:
+        return _null_phase
+    return Phase(name)
+
+
+"""
+decorator recording every call of a function as the phase name.
+"""
+
+
+def profiled(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+"""
+count bytes read or written by the current phase and the phases it is part of.
+"""
+
+
+def add_bytes(read=0, written=0):
+    if not _enabled:
+        return
+    for frame in getattr(_local, "stack", ()):
+        frame.bytes_read += read
+        frame.bytes_written += written
+
+
+"""
+stats of this process, as {key: {"count", "seconds", "bytes_read", "bytes_written"}}
+"""
+
+
+def stats():
+    with _stats_lock:
+        return {
+            key: {"count": c, "seconds": s, "bytes_read": r, "bytes_written": w}
+            for key, (c, s, r, w) in sorted(_stats.items())
+        }
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
+
+
+def format_bytes(n):
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GiB"
+
+
+def stats_path(log_dir):
+    return f"{log_dir}/stats/profile.jsonl"
+
+
+def save():
+    import sys
+    import json
+
+    if _output_dir is None or not _stats:
+        return
+    run = {"time": time.time(), "pid": os.getpid(), "argv": sys.argv, "stats": stats()}
+    try:
+        os.makedirs(os.path.dirname(stats_path(_output_dir)), exist_ok=True)
+        # one write of one line, so runs exiting together don't interleave
+        fd = os.open(stats_path(_output_dir), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(run) + "\n").encode("utf-8"))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"tvault error: could not save profile stats: {e}")
+
+
+"""
+runs saved in log_dir, the last limit runs if limit is set.
+"""
+
+
+def load_runs(log_dir, limit=None):
+    import json
+
+    if not os.path.exists(stats_path(log_dir)):
+        return []
+    runs = []
+    with open(stats_path(log_dir)) as f:
+        for line in f:
+            try:
+                runs.append(json.loads(line))
+            # a line cut short by a crash
+            except ValueError:
+                continue
+    return runs[-limit:] if limit else runs
+
+
+"""
+sum stats of runs, as {key: {"runs", "count", "seconds", "bytes_read", "bytes_written"}}
+"""
+
+
+def aggregate(runs):
+    total = dict()
+    for run in runs:
+        for key, entry in run["stats"].items():
+            agg = total.setdefault(
+                key, {"runs": 0, "count": 0, "seconds": 0.0, "bytes_read": 0, "bytes_written": 0}
+            )
+            agg["runs"] += 1
+            for k in ("count", "seconds", "bytes_read", "bytes_written"):
+                agg[k] += entry[k]
+    return dict(sorted(total.items()))
@@ -0,0 +1,209 @@
+import re
+import json
+import heapq
+import itertools
+
+from .index import encode_value
+
+"""
+Query engine of find.
+
+A query is a list of predicates joined by AND, e.g.
+    tag.size=0.5x AND result>=0.9 AND sha in 2ba4adf..737b47a
+Each predicate is (field, op, value), where field is one of
+    result, idx, sha      columns of the experiment index
+    tag.<name>            tag of the experiment
+    <name>                any other indexed field
+and op is one of =, !=, <, <=, >, >=, in.
+sha in takes a comma separated list of hashes, or a git revision range a..b.
+
+Predicates are compiled to sql and evaluated by the experiment index, and matching
+experiments are streamed from it. Sorting with a limit keeps only the top-k experiments
+in a bounded heap, so the whole registry is never materialized.
+"""
+
+COLUMNS = {
+    "result": "e.result",
+    "idx": "e.idx",
+    "model-idx": "e.idx",
+    "sha": "e.sha",
+    "hash": "e.sha",
+}
+# keys of the model info dicts returned by find
+INFO_KEYS = {
+    "result": "RESULT",
+    "idx": "MODEL-IDX",
+    "model-idx": "MODEL-IDX",
+    "sha": "HASH",
+    "hash": "HASH",
+}
+
+PREDICATE_RE = re.compile(
+    r"^\s*(?P<field>[\w.\-]+)\s*(?P<op><=|>=|!=|==|=|<|>|\s+in\s+)\s*(?P<value>.*?)\s*$",
+    re.IGNORECASE,
+)
+
+
+class QueryError(Exception):
+    pass
+
+
+def parse_value(text):
+    if not isinstance(text, str):
+        return text
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "\"'":
+        return text[1:-1]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def field_key(field):
+    if field.startswith("tag."):
+        return "tag-" + field[len("tag.") :]
+    return field
+
+
+def parse_query(text):
+    predicates = []
+    if text.strip() == "":
+        return predicates
+    for term in re.split(r"\s+and\s+", text.strip(), flags=re.IGNORECASE):
+        match = PREDICATE_RE.match(term)
+        if match is None:
+            raise QueryError(f"cannot parse predicate '{term}'")
+        op = match.group("op").strip().lower()
+        value = match.group("value")
+        if op == "in":
+            value = [v.strip() for v in value.strip("()[]").split(",") if v.strip()]
+        predicates.append((match.group("field"), op, value))
+    return predicates
+
+
+"""
+resolve a git revision range a..b to the short hashes tvault logs commits with.
+"""
+
+
+def resolve_sha_range(rev_range):
+    import subprocess
+
+    out = subprocess.run(["git", "rev-list", rev_range], capture_output=True, text=True)
+    if out.returncode != 0:
+        raise QueryError(f"cannot resolve git range '{rev_range}': {out.stderr.strip()}")
+    return [line[:7] for line in out.stdout.split()]
+
+
+def compile_predicate(field, op, value):
+    if op == "==":
+        op = "="
+    if field.lower() in COLUMNS:
+        column = COLUMNS[field.lower()]
+        if op == "in":
+            values = []
+            for v in value:
+                values += resolve_sha_range(v) if ".." in v else [v]
+            if len(values) == 0:
+                return "0", []
+            return f"{column} IN ({', '.join('?' * len(values))})", values
+        # hashes stay strings even if they look like numbers
+        if isinstance(value, str) and column != "e.sha":
+            value = parse_value(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return f"(typeof({column}) IN ('integer', 'real') AND {column} {op} ?)", [value]
+        return f"{column} {op} ?", [value]
+
+    key = field_key(field)
+    exists = "EXISTS (SELECT 1 FROM fields t WHERE t.sha = e.sha AND t.idx = e.idx AND t.key = ?"
+    if op == "in":
+        values = [encode_value(parse_value(v)) for v in value] + [encode_value(v) for v in value]
+        return f"{exists} AND t.value IN ({', '.join('?' * len(values))}))", [key] + values
+    parsed = parse_value(value)
+    if op in ("=", "!="):
+        # match both the parsed value and the raw text, e.g. tag.seed=1 for seed "1"
+        condition = f"{exists} AND t.value IN (?, ?))"
+        params = [key, encode_value(parsed), encode_value(str(value))]
+        return (condition if op == "=" else f"NOT {condition}"), params
+    if isinstance(parsed, (int, float)) and not isinstance(parsed, bool):
+        value_type = "json_type(t.value) IN ('integer', 'real')"
+    else:
+        value_type = "json_type(t.value) = 'text'"
+    return f"{exists} AND {value_type} AND json_extract(t.value, '$') {op} ?)", [key, parsed]
+
+
+def compile_query(predicates):
+    conditions, params = ["1"], []
+    for field, op, value in predicates:
+        condition, condition_params = compile_predicate(field, op, value)
+        conditions.append(condition)
+        params += condition_params
+    return " AND ".join(conditions), tuple(params)
+
+
+def sort_key(field, descending=False):
+    key = INFO_KEYS.get(field.lower(), field_key(field))
+    # missing values always go last, and numbers are not compared with strings
+    present, missing = (1, 0) if descending else (0, 1)
+
+    def get_key(model_info):
+        if key not in model_info or model_info[key] is None:
+            return (missing, 0, 0)
+        value = model_info[key]
+        if isinstance(value, (int, float)):
+            return (present, 0, value)
+        return (present, 1, str(value))
+
+    return get_key
+
+
+"""
+experiments of a query as they are read from the index, see run_query.
+"""
+
+
+class QueryResult:
+    def __init__(self, index, condition, params, model_infos):
+        self.index = index
+        self.condition = condition
+        self.params = params
+        self.model_infos = model_infos
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.model_infos)
+
+    """
+    tag keys of every matching experiment, read from the index without reading them.
+    """
+
+    def tag_keys(self):
+        return self.index.field_keys(self.condition, self.params, "tag-")
+
+
+"""
+iterate over experiments matching the predicates, as find's model info dicts.
+sort: field to sort by, e.g. result or tag.size
+limit: maximum number of experiments returned
+offset: number of matching experiments skipped, to page through results with limit
+"""
+
+
+def run_query(index, predicates, sort="", descending=False, limit=None, offset=0):
+    if isinstance(predicates, str):
+        predicates = parse_query(predicates)
+    condition, params = compile_query(predicates)
+    model_infos = index.select(condition, params)
+    end = None if limit is None else offset + limit
+    if sort:
+        key = sort_key(sort, descending)
+        if end is not None:
+            select = heapq.nlargest if descending else heapq.nsmallest
+            model_infos = iter(select(end, model_infos, key=key))
+        else:
+            model_infos = iter(sorted(model_infos, key=key, reverse=descending))
+    if end is not None or offset > 0:
+        model_infos = itertools.islice(model_infos, offset, end)
+    return QueryResult(index, condition, params, model_infos)
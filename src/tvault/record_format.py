@@ -0,0 +1,248 @@
+import io
+import os
+import json
+import mmap
+import struct
+import pickle
+
+"""
+On-disk format of model log records.
+
+A record is a field table followed by the json encoded values of its fields:
+  number of fields
+  (key length, value length, key) of every field
+  values
+so a reader can decode only the fields it selects, e.g. tags and result for the index,
+and skip the others without parsing them.
+Values are json, so loading a log never runs code from it. Values json can't represent
+are stored as numbers if they are scalars (e.g. numpy or torch scalars), else as text.
+
+A snapshot (model_{sha}) holds every compacted experiment of a commit:
+  magic, format version, number of experiments
+  (model index, offset, length) of every record
+  records
+Large snapshots are memory-mapped, so a projected read only touches the pages of the
+fields it decodes.
+
+Model logs written by older tvault versions are pickles. They are still read, with an
+unpickler that refuses anything but plain containers, and are rewritten in this format by
+migrate.
+"""
+
+SNAPSHOT_MAGIC = b"TVS1"
+FORMAT_VERSION = 1
+# magic, format version, number of experiments
+SNAPSHOT_HEADER = struct.Struct(">4sHI")
+# model index, offset, length
+SNAPSHOT_ENTRY = struct.Struct(">IQI")
+FIELD_COUNT = struct.Struct(">H")
+# key length, value length
+FIELD_HEADER = struct.Struct(">HI")
+
+# snapshots larger than this are memory-mapped instead of read
+MMAP_THRESHOLD = 1 << 20
+
+
+def encode_default(value):
+    if hasattr(value, "item"):
+        try:
+            return value.item()
+        except (TypeError, ValueError):
+            pass
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+"""
+value as it is read back from a record, e.g. a tensor or numpy scalar as a python number.
+"""
+
+
+def plain_value(value):
+    return json.loads(json.dumps(value, default=encode_default))
+
+
+def encode_record(fields):
+    table, values = [FIELD_COUNT.pack(len(fields))], []
+    for key, value in fields.items():
+        key = key.encode("utf-8")
+        value = json.dumps(value, default=encode_default, separators=(",", ":")).encode("utf-8")
+        table.append(FIELD_HEADER.pack(len(key), len(value)) + key)
+        values.append(value)
+    return b"".join(table + values)
+
+
+"""
+decode a record from buf at offset.
+select: function telling whether a field is decoded, every field is decoded if None
+"""
+
+
+def decode_record(buf, offset=0, select=None):
+    (count,) = FIELD_COUNT.unpack_from(buf, offset)
+    position = offset + FIELD_COUNT.size
+    fields = []
+    for _ in range(count):
+        key_length, value_length = FIELD_HEADER.unpack_from(buf, position)
+        position += FIELD_HEADER.size
+        fields.append((bytes(buf[position : position + key_length]).decode("utf-8"), value_length))
+        position += key_length
+
+    record = dict()
+    for key, value_length in fields:
+        if select is None or select(key):
+            record[key] = json.loads(bytes(buf[position : position + value_length]))
+        position += value_length
+    return record
+
+
+def encode_snapshot(model_log):
+    records = [(idx, encode_record(model_record)) for idx, model_record in model_log.items()]
+    offset = SNAPSHOT_HEADER.size + SNAPSHOT_ENTRY.size * len(records)
+    entries = []
+    for idx, record in records:
+        entries.append(SNAPSHOT_ENTRY.pack(idx, offset, len(record)))
+        offset += len(record)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, len(records))
+    return b"".join([header] + entries + [record for _, record in records])
+
+
+def is_snapshot(head):
+    return head[: len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC
+
+
+"""
+number of experiments in a snapshot, from its header only.
+"""
+
+
+def snapshot_count(head):
+    magic, version, count = SNAPSHOT_HEADER.unpack_from(head)
+    return count
+
+
+def decode_snapshot(buf, select=None, path=""):
+    magic, version, count = SNAPSHOT_HEADER.unpack_from(buf)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"{path} was written by a newer tvault (format version {version})")
+    model_log = dict()
+    for i in range(count):
+        idx, offset, _ = SNAPSHOT_ENTRY.unpack_from(
+            buf, SNAPSHOT_HEADER.size + i * SNAPSHOT_ENTRY.size
+        )
+        model_log[idx] = decode_record(buf, offset, select)
+    return model_log
+
+
+"""
+read a snapshot file, in this format or as a legacy pickle.
+"""
+
+
+def read_snapshot_file(path, select=None):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if is_snapshot(buf[: len(SNAPSHOT_MAGIC)]):
+                    return decode_snapshot(buf, select, path)
+                return select_fields(load_legacy(buf[:]), select)
+        data = f.read()
+    if is_snapshot(data):
+        return decode_snapshot(data, select, path)
+    return select_fields(load_legacy(data), select)
+
+
+def select_fields(model_log, select=None):
+    if select is None:
+        return model_log
+    return {
+        idx: {k: v for k, v in model_record.items() if select(k)}
+        for idx, model_record in model_log.items()
+    }
+
+
+# globals plain model logs may refer to
+LEGACY_GLOBALS = {
+    ("collections", "defaultdict"),
+    ("collections", "OrderedDict"),
+    ("builtins", "set"),
+    ("builtins", "frozenset"),
+    ("builtins", "complex"),
+}
+
+
+"""
+stand-in of numpy.dtype, so numpy scalars of legacy logs load without numpy.
+"""
+
+
+class LegacyDtype:
+    def __init__(self, name, align=False, copy=False):
+        self.name = name
+        self.byteorder = "="
+
+    def __setstate__(self, state):
+        self.byteorder = state[1]
+
+
+# struct format of numpy scalar types, by dtype name
+SCALAR_FORMATS = {
+    "b1": "?",
+    "i1": "b",
+    "i2": "h",
+    "i4": "i",
+    "i8": "q",
+    "u1": "B",
+    "u2": "H",
+    "u4": "I",
+    "u8": "Q",
+    "f2": "e",
+    "f4": "f",
+    "f8": "d",
+    "c8": "ff",
+    "c16": "dd",
+}
+
+
+"""
+numpy scalar of a legacy log, as the python number it holds.
+"""
+
+
+def legacy_scalar(dtype, data=b""):
+    if not isinstance(dtype, LegacyDtype) or dtype.name not in SCALAR_FORMATS:
+        raise pickle.UnpicklingError(f"model log holds a numpy value of unsupported type")
+    if isinstance(data, str):
+        # pickled by python 2
+        data = data.encode("latin-1")
+    byteorder = ">" if dtype.byteorder == ">" else "<" if dtype.byteorder == "<" else "="
+    values = struct.unpack(byteorder + SCALAR_FORMATS[dtype.name], data)
+    return complex(*values) if len(values) == 2 else values[0]
+
+
+# numpy globals of scalars pickled in older logs, e.g. an np.float64 result
+LEGACY_NUMPY_GLOBALS = {
+    ("numpy", "dtype"): LegacyDtype,
+    ("numpy.core.multiarray", "scalar"): legacy_scalar,
+    ("numpy._core.multiarray", "scalar"): legacy_scalar,
+}
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) in LEGACY_GLOBALS:
+            return super().find_class(module, name)
+        if (module, name) in LEGACY_NUMPY_GLOBALS:
+            return LEGACY_NUMPY_GLOBALS[(module, name)]
+        raise pickle.UnpicklingError(f"model log refers to {module}.{name}, which is not loaded")
+
+
+"""
+load a model log written by older tvault versions, without running code from it.
+"""
+
+
+def load_legacy(data):
+    return LegacyUnpickler(io.BytesIO(data)).load()
@@ -0,0 +1,562 @@
+import os
+import zlib
+import struct
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from collections import defaultdict
+from collections.abc import Mapping
+
+from .index import ExperimentIndex, is_index_input
+from .profiler import add_bytes, profiled
+from .profiler import enabled as profiling
+from .record_format import (
+    SNAPSHOT_HEADER,
+    decode_record,
+    encode_record,
+    encode_snapshot,
+    is_snapshot,
+    plain_value,
+    read_snapshot_file,
+    snapshot_count,
+)
+
+"""
+Append-only storage for model logs.
+
+Experiments of a commit live in two files:
+  model_{sha}          snapshot of compacted experiments
+  model_{sha}.journal  length-prefixed records appended after the snapshot
+Records are encoded as described in record_format.py, so readers can load only some
+fields of them. Logs written as pickles by older tvault versions are still read, and
+rewritten in the current format by migrate.
+
+Logging an experiment or changing a field only appends one record to the journal,
+so the cost of a write no longer grows with the number of experiments in the commit.
+Reading replays the journal over the snapshot, and compaction folds the journal back
+into the snapshot.
+
+Class and function sources are stored once in a content-addressed object store
+(objects/ab/cdef..., like git objects), and experiments only keep their hashes under
+src_hash / external_func_hash. Readers get src / external_func back as mappings that
+load a source from the object store only when it is accessed.
+
+Every write also updates the experiment index (index.sqlite) used by find.
+
+Several processes may log on the same commit, e.g. the workers of a sweep or every rank
+of a DDP job. Writes of a commit are serialized by an exclusive lock on locks/{sha}, held
+while the model index is allocated and the record appended, so indices stay unique and no
+record is lost. Reads take the lock shared, so they never see a journal being folded into
+its snapshot. Rewrites go through a temporary file and an atomic rename.
+"""
+
+try:
+    import fcntl
+# no inter-process locking where flock is not available (windows)
+except ImportError:
+    fcntl = None
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_MAGIC = b"TVJ2"
+# magic, number of experiments in the snapshot when the journal was started
+JOURNAL_HEADER = struct.Struct(">4sI")
+# op, model index, payload length
+RECORD_HEADER = struct.Struct(">BII")
+
+OP_ADD = 1
+OP_SET = 2
+
+SOURCE_FIELDS = ("src", "external_func")
+# threads reading model logs in scans, many more than cores as they wait on i/o
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+# per-process lock state of every lock file, shared by the stores and threads of a process
+_lock_mutexes = dict()
+_lock_files = dict()
+_lock_depths = dict()
+
+
+def tmp_suffix():
+    return f".tmp.{os.getpid()}.{threading.get_ident()}"
+
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def blob_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+"""
+call func on every item with a pool of threads, returns the results in the order of items.
+reading a model log mostly waits on the filesystem, which releases the GIL, so scans of
+many logs are bound by i/o instead of per-file latency, e.g. on network filesystems.
+workers: threads, defaults to SCAN_WORKERS, items are read one by one if 1
+"""
+
+
+def parallel_map(func, items, workers=None):
+    items = list(items)
+    workers = min(workers or SCAN_WORKERS, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(func, items))
+
+
+class ObjectStore:
+    def __init__(self, log_dir="./model_log"):
+        self.object_dir = f"{log_dir}/objects"
+
+    def path(self, digest):
+        return f"{self.object_dir}/{digest[:2]}/{digest[2:]}"
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    """
+    store data once, returns its hash.
+    """
+
+    def put(self, data):
+        digest = blob_digest(data)
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + tmp_suffix()
+        compressed = zlib.compress(data)
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        add_bytes(written=len(compressed))
+        return digest
+
+    def get(self, digest):
+        with open(self.path(digest), "rb") as f:
+            compressed = f.read()
+        add_bytes(read=len(compressed))
+        return zlib.decompress(compressed)
+
+    """
+    whether the object of a hash exists and still holds the data it was stored with.
+    """
+
+    def verify(self, digest):
+        try:
+            return blob_digest(self.get(digest)) == digest
+        except (OSError, zlib.error):
+            return False
+
+
+"""
+name -> source mapping of an experiment, backed by the object store.
+Sources are loaded lazily, so comparing hashes never reads them.
+"""
+
+
+class SourceBlobs(Mapping):
+    def __init__(self, objects, digests):
+        self.objects = objects
+        self.digests = digests
+        self.cache = dict()
+
+    def digest(self, name):
+        return self.digests[name]
+
+    def __getitem__(self, name):
+        if name not in self.cache:
+            self.cache[name] = self.objects.get(self.digests[name]).decode("utf-8")
+        return self.cache[name]
+
+    def __contains__(self, name):
+        return name in self.digests
+
+    def __iter__(self):
+        return iter(self.digests)
+
+    def __len__(self):
+        return len(self.digests)
+
+
+class ModelLogStore:
+    def __init__(self, log_dir="./model_log"):
+        self.log_dir = log_dir
+        self.objects = ObjectStore(log_dir)
+        self.index = ExperimentIndex(log_dir)
+
+    def snapshot_path(self, sha):
+        return f"{self.log_dir}/model_{sha}"
+
+    def journal_path(self, sha):
+        return f"{self.log_dir}/model_{sha}{JOURNAL_SUFFIX}"
+
+    def lock_path(self, sha):
+        return f"{self.log_dir}/locks/{sha}"
+
+    """
+    hold the lock of a commit, exclusive for writes and shared for reads.
+    the lock is reentrant within a process, so a write may call other locked methods.
+    """
+
+    @contextlib.contextmanager
+    def lock(self, sha, shared=False):
+        path = os.path.abspath(self.lock_path(sha))
+        mutex = _lock_mutexes.setdefault(path, threading.RLock())
+        with mutex:
+            if _lock_depths.get(path, 0) == 0:
+                lock_file = None
+                if fcntl is not None:
+                    try:
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        lock_file = open(path, "a+b")
+                    except OSError:
+                        # read-only log dirs are read without locking
+                        if not shared:
+                            raise
+                if lock_file is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                _lock_files[path] = lock_file
+            _lock_depths[path] = _lock_depths.get(path, 0) + 1
+            try:
+                yield
+            finally:
+                _lock_depths[path] -= 1
+                if _lock_depths[path] == 0:
+                    lock_file = _lock_files.pop(path)
+                    if lock_file is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                        lock_file.close()
+
+    def exists(self, sha):
+        return os.path.exists(self.snapshot_path(sha)) or os.path.exists(self.journal_path(sha))
+
+    """
+    size and modification time of the model log files of a commit.
+    changes whenever the model log is written.
+    """
+
+    def signature(self, sha):
+        signature = []
+        for path in (self.snapshot_path(sha), self.journal_path(sha)):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                signature.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+            else:
+                signature.append("-")
+        return "/".join(signature)
+
+    """
+    keep the experiment index up to date after a write.
+    the index is only a cache, a failed update is repaired by the next sync.
+    """
+
+    def _index(self, method, sha, *args):
+        try:
+            getattr(self.index, method)(sha, *args, self.signature(sha))
+        except sqlite3.Error:
+            pass
+
+    """
+    fields of a record the index reads, as sync would read them back from the model log.
+    """
+
+    def _index_fields(self, fields):
+        return {k: plain_value(v) for k, v in fields.items() if is_index_input(k)}
+
+    """
+    signature of the model log of a commit before a write, taken under its lock.
+    """
+
+    def _previous_signature(self, sha):
+        return self.signature(sha) if self.exists(sha) else None
+
+    """
+    list commit hashes that have a model log, in directory order.
+    """
+
+    def list_shas(self):
+        shas = []
+        if not os.path.exists(self.log_dir):
+            return shas
+        for filename in os.listdir(self.log_dir):
+            if not filename.startswith("model_") or ".tmp." in filename:
+                continue
+            if filename.endswith(JOURNAL_SUFFIX):
+                sha = filename[len("model_") : -len(JOURNAL_SUFFIX)]
+                # listed through its snapshot if there is one
+                if os.path.exists(self.snapshot_path(sha)):
+                    continue
+            else:
+                sha = filename[len("model_") :]
+            shas.append(sha)
+        return shas
+
+    def read_snapshot(self, sha, select=None):
+        if not os.path.exists(self.snapshot_path(sha)):
+            return dict()
+        return read_snapshot_file(self.snapshot_path(sha), select)
+
+    """
+    number of experiments in the snapshot of a commit.
+    """
+
+    def snapshot_count(self, sha):
+        if not os.path.exists(self.snapshot_path(sha)):
+            return 0
+        with open(self.snapshot_path(sha), "rb") as f:
+            head = f.read(SNAPSHOT_HEADER.size)
+        if is_snapshot(head):
+            return snapshot_count(head)
+        return len(self.read_snapshot(sha))
+
+    """
+    whether the model log of a commit was pickled by an older tvault version.
+    """
+
+    def is_legacy(self, sha):
+        if not os.path.exists(self.snapshot_path(sha)):
+            return False
+        with open(self.snapshot_path(sha), "rb") as f:
+            head = f.read(SNAPSHOT_HEADER.size)
+        return len(head) > 0 and not is_snapshot(head)
+
+    """
+    iterate over (op, idx, fields) records of the journal.
+    select: function telling whether a field is loaded, every field is loaded if None
+    A record cut short by a crash while appending is ignored.
+    """
+
+    def iter_journal(self, sha, select=None):
+        if not os.path.exists(self.journal_path(sha)):
+            return
+        with open(self.journal_path(sha), "rb") as f:
+            header = f.read(JOURNAL_HEADER.size)
+            if len(header) < JOURNAL_HEADER.size:
+                return
+            magic, _ = JOURNAL_HEADER.unpack(header)
+            if magic != JOURNAL_MAGIC:
+                raise ValueError(f"{self.journal_path(sha)} is not a tvault journal")
+            while True:
+                record_header = f.read(RECORD_HEADER.size)
+                if len(record_header) < RECORD_HEADER.size:
+                    return
+                op, idx, length = RECORD_HEADER.unpack(record_header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield op, idx, decode_record(payload, 0, select)
+
+    def journal_base(self, sha):
+        if not os.path.exists(self.journal_path(sha)):
+            return None
+        with open(self.journal_path(sha), "rb") as f:
+            header = f.read(JOURNAL_HEADER.size)
+        if len(header) < JOURNAL_HEADER.size:
+            return None
+        return JOURNAL_HEADER.unpack(header)[1]
+
+    """
+    reads every experiment of a commit as dict[int, dict].
+    select: function telling whether a field is loaded, e.g. to load tags only.
+    every field is loaded if None
+    returns empty model_log if nothing logged
+    """
+
+    @profiled("read")
+    def read(self, sha, select=None):
+        with self.lock(sha, shared=True):
+            if profiling():
+                # snapshots read through a memory map may only touch the selected fields
+                add_bytes(
+                    read=sum(map(file_size, (self.snapshot_path(sha), self.journal_path(sha))))
+                )
+            model_log = defaultdict(lambda: dict(), self.read_snapshot(sha, select))
+            journal = list(self.iter_journal(sha, select))
+        for op, idx, fields in journal:
+            if op == OP_ADD:
+                model_log[idx] = fields
+            else:
+                model_log[idx].update(fields)
+        for model_record in model_log.values():
+            self._internalize(model_record)
+        return model_log
+
+    """
+    move sources of a record into the object store, keeping only their hashes.
+    """
+
+    def _externalize(self, model_record):
+        model_record = dict(model_record)
+        for field in SOURCE_FIELDS:
+            if field not in model_record:
+                continue
+            sources = model_record.pop(field)
+            if isinstance(sources, SourceBlobs):
+                model_record[f"{field}_hash"] = dict(sources.digests)
+            else:
+                model_record[f"{field}_hash"] = {
+                    name: self.objects.put(source.encode("utf-8"))
+                    for name, source in sources.items()
+                }
+        return model_record
+
+    def _internalize(self, model_record):
+        for field in SOURCE_FIELDS:
+            if f"{field}_hash" in model_record:
+                model_record[field] = SourceBlobs(self.objects, model_record[f"{field}_hash"])
+
+    """
+    walk record headers of the journal without loading payloads.
+    returns (number of experiments, offset where the last complete record ends)
+    """
+
+    def scan_journal(self, sha):
+        base = self.journal_base(sha)
+        if base is None:
+            return self.snapshot_count(sha), 0
+        count, end = base, JOURNAL_HEADER.size
+        with open(self.journal_path(sha), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(end)
+            while True:
+                record_header = f.read(RECORD_HEADER.size)
+                if len(record_header) < RECORD_HEADER.size:
+                    break
+                op, idx, length = RECORD_HEADER.unpack(record_header)
+                if end + RECORD_HEADER.size + length > size:
+                    break
+                end += RECORD_HEADER.size + length
+                f.seek(end)
+                if op == OP_ADD:
+                    count = max(count, idx + 1)
+        return count, end
+
+    """
+    number of experiments logged in a commit, read from record headers only.
+    """
+
+    def count(self, sha):
+        if not os.path.exists(self.journal_path(sha)):
+            return self.snapshot_count(sha)
+        return self.scan_journal(sha)[0]
+
+    def _append_record(self, sha, op, idx, fields):
+        payload = encode_record(fields)
+        path = self.journal_path(sha)
+        end = self.scan_journal(sha)[1] if os.path.exists(path) else 0
+        if end == 0:
+            base = self.snapshot_count(sha)
+            with open(path, "wb") as f:
+                f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, base))
+        elif os.path.getsize(path) > end:
+            # drop a record cut short by a crash, so the new one is not appended after it
+            os.truncate(path, end)
+        with open(path, "ab") as f:
+            f.write(RECORD_HEADER.pack(op, idx, len(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        add_bytes(written=RECORD_HEADER.size + len(payload))
+
+    """
+    append a new experiment, returns its model index.
+    """
+
+    @profiled("write")
+    def append(self, sha, record):
+        # sources are stored before taking the lock, objects need no locking
+        model_record = self._externalize(record)
+        with self.lock(sha):
+            previous = self._previous_signature(sha)
+            model_idx = self.count(sha)
+            self._append_record(sha, OP_ADD, model_idx, model_record)
+            self._index("add", sha, model_idx, self._index_fields(record), previous)
+        return model_idx
+
+    """
+    set fields of an existing experiment.
+    """
+
+    @profiled("write")
+    def update(self, sha, idx, fields):
+        with self.lock(sha):
+            previous = self._previous_signature(sha)
+            self._append_record(sha, OP_SET, idx, dict(fields))
+            self._index("update", sha, idx, self._index_fields(fields), previous)
+
+    """
+    rewrite the snapshot of a commit and drop its journal.
+    The snapshot is written to a temporary file and swapped in, so a crash never leaves
+    a truncated log.
+    """
+
+    @profiled("write")
+    def write(self, sha, model_log):
+        path = self.snapshot_path(sha)
+        data = encode_snapshot({idx: self._externalize(v) for idx, v in model_log.items()})
+        with self.lock(sha):
+            tmp_path = path + tmp_suffix()
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            add_bytes(written=len(data))
+            if os.path.exists(self.journal_path(sha)):
+                os.remove(self.journal_path(sha))
+            self._index(
+                "replace", sha, {idx: self._index_fields(r) for idx, r in model_log.items()}
+            )
+
+    """
+    fold the journal of a commit into its snapshot.
+    """
+
+    def compact(self, sha):
+        with self.lock(sha):
+            if not os.path.exists(self.journal_path(sha)):
+                return False
+            self.write(sha, self.read(sha))
+        return True
+
+    """
+    check that the model log of a commit reads back whole.
+    returns (problems found, hashes of the sources it refers to), sources are checked by
+    the caller so that those shared by commits are read once.
+    """
+
+    def verify(self, sha):
+        problems, digests = [], set()
+        try:
+            model_log = self.read(sha)
+        except Exception as e:
+            return [f"unreadable model log: {e}"], digests
+        with self.lock(sha, shared=True):
+            if self.is_legacy(sha):
+                problems.append("written by an older tvault, run tvault --migrate_flag")
+            elif os.path.exists(self.journal_path(sha)):
+                # harmless, dropped by the next append, but a sign of a crashed writer
+                if self.scan_journal(sha)[1] < file_size(self.journal_path(sha)):
+                    problems.append("journal ends with a record cut short")
+        for model_record in model_log.values():
+            for field in SOURCE_FIELDS:
+                sources = model_record.get(field)
+                if isinstance(sources, SourceBlobs):
+                    digests.update(sources.digests.values())
+        return problems, digests
+
+    """
+    rewrite a model log written by an older tvault version in the current format.
+    """
+
+    def migrate(self, sha):
+        with self.lock(sha):
+            if not self.is_legacy(sha):
+                return False
+            self.write(sha, self.read(sha))
+        return True
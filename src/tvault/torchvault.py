@@ -1,76 +1,168 @@
 import os
 import sys
-import ast
-import git
-import pickle
-import astunparse
-from prettytable import PrettyTable
+import time
+import itertools
 from collections import defaultdict
 
-from .parse_utils import match_external_funcs, extract_info_from_model, extract_diff
+from .storage import ModelLogStore, parallel_map
+from .git_utils import head_sha
+from .query import QueryError, parse_query, run_query
+from . import profiler
+from .profiler import phase, profiled
+
+# parse_utils, astunparse and prettytable are imported by the methods using them,
+# so that commands like find don't pay for parsing and rendering modules at startup.
 
 
 class TorchVaultError(Exception):
     pass
 
 
+"""
+profile: record timings and bytes of tvault calls, see profiler.py.
+profiling is also enabled for every vault by the TVAULT_PROFILE environment variable.
+workers: threads reading model logs in scans of the log dir, see storage.parallel_map
+"""
+
+
+# experiment this process logged last on each (log dir, commit), as its model index, or a
+# Future of it while a background log is queued. metrics, optimizers, schedulers and
+# checkpoints of the process attach to it, not to experiments of other sweep workers.
+_own_experiments = dict()
+
+
 class TorchVault:
-    def __init__(self, log_dir="./model_log", model_dir="./"):
+    def __init__(self, log_dir="./model_log", model_dir="./", profile=False, workers=None):
+        if profile:
+            profiler.enable(log_dir)
+        elif profiler.enabled():
+            profiler.set_output(log_dir)
         self.log_dir = log_dir
         self.model_dir = model_dir
+        self.workers = workers
         self.use_astunparse = True if sys.version_info.minor < 9 else False
-
-        repo = git.Repo(search_parent_directories=True)
-        sha = repo.head.object.hexsha
-        short_sha = sha[:7]
-        self.sha = short_sha
+        self._sha = None
+        self._idx_memo = None
         os.makedirs(self.log_dir, exist_ok=True)
+        self.store = ModelLogStore(self.log_dir)
+
+    """
+    short commit hash of HEAD, resolved on first use.
+    commands working on a given hash never look up git.
+    """
+
+    @property
+    def sha(self):
+        if self._sha is None:
+            with phase("git"):
+                self._sha = head_sha()[:7]
+        return self._sha
+
+    @sha.setter
+    def sha(self, sha):
+        self._sha = sha
 
     """
     reads model log from git hash
+    select: function telling whether a field is loaded, every field is loaded if None
     returns empty model_log if nothing logged
     """
 
-    def read_model_log(self, sha=""):
+    @profiled("read_model_log")
+    def read_model_log(self, sha="", select=None):
         if sha == "":
             sha = self.sha
 
-        if os.path.exists(f"{self.log_dir}/model_{sha}"):
-            with open(f"{self.log_dir}/model_{sha}", "rb") as f:
-                model_log = defaultdict(lambda: dict(), pickle.load(f))
-        else:
-            model_log = defaultdict(lambda: dict())
-        return model_log
+        return self.store.read(sha, select)
 
     """
-    write model log to git hash
+    write model log to git hash, replacing every experiment logged in it
     """
 
+    @profiled("write_model_log")
     def write_model_log(self, sha="", model_log=defaultdict(lambda: dict())):
         if sha == "":
             sha = self.sha
-        with open(f"{self.log_dir}/model_{sha}", "wb") as f:
-            pickle.dump(dict(model_log), f)
+        self.store.write(sha, model_log)
+
+    """
+    fold the journal of appended experiments into the model log of git hash
+    """
+
+    def compact_model_log(self, sha=""):
+        if sha == "":
+            sha = self.sha
+        return self.store.compact(sha)
 
     """
     log torch scheduler 
     """
 
     def log_scheduler(self, scheduler):
-        model_log = self.read_model_log()
-        model_idx = len(model_log.keys()) - 1
-        model_log[model_idx]["scheduler"] = scheduler.__str__()
-        self.write_model_log("", model_log)
+        from .optim_utils import capture_scheduler
+
+        model_idx = self.current_idx(wait=True)
+        if model_idx < 0:
+            print(f"tvault error: log the model of commit {self.sha} before its scheduler.")
+            raise TorchVaultError
+        self.store.update(self.sha, model_idx, capture_scheduler(scheduler))
 
     """
     log torch optimizer
     """
 
     def log_optimizer(self, optimizer):
-        model_log = self.read_model_log()
-        model_idx = len(model_log.keys()) - 1
-        model_log[model_idx]["optimizer"] = optimizer.__str__()
-        self.write_model_log("", model_log)
+        from .optim_utils import capture_optimizer
+
+        model_idx = self.current_idx(wait=True)
+        if model_idx < 0:
+            print(f"tvault error: log the model of commit {self.sha} before its optimizer.")
+            raise TorchVaultError
+        self.store.update(self.sha, model_idx, capture_optimizer(optimizer))
+
+    """
+    log one point of a metric series, e.g. the loss of a training step, for the most
+    recent experiment of the commit, see metrics.py.
+    points are buffered and written in batches, and when the program exits or by flush().
+    points of an experiment still queued by log_all(..., background=True) are buffered until
+    it is written, so logging a metric never waits for it.
+    """
+
+    def log_metric(self, name, value, step):
+        from .metrics import get_buffer
+
+        idx = self.current_idx()
+        if isinstance(idx, int) and idx < 0:
+            print(f"tvault error: log the model of commit {self.sha} before its metrics.")
+            raise TorchVaultError
+        get_buffer().add(self.store, self.sha, idx, name, float(value), int(step))
+
+    """
+    index of the experiment of the commit logged last by this process, or a Future of it if
+    it is still queued in the background, resolved if wait is set.
+    if this process logged none, the most recent experiment of the commit. counting
+    experiments scans the journal, so the index is kept until the model log changes, as
+    metrics are logged every step.
+    """
+
+    def current_idx(self, wait=False):
+        from .git_utils import file_signature
+
+        sha = self.sha
+        own = _own_experiments.get((os.path.abspath(self.log_dir), sha))
+        if own is not None:
+            if not wait or isinstance(own, int):
+                return own
+            try:
+                return own.result()
+            except Exception:
+                print(f"tvault error: the model of commit {sha} failed to be logged.")
+                raise TorchVaultError
+        paths = (self.store.snapshot_path(sha), self.store.journal_path(sha))
+        signature = (sha,) + tuple(file_signature(path) for path in paths)
+        if self._idx_memo is None or self._idx_memo[0] != signature:
+            self._idx_memo = (signature, self.store.count(sha) - 1)
+        return self._idx_memo[1]
 
     """
     add tag to model log, commit sha may be from previous results.
@@ -80,7 +172,7 @@ class TorchVault:
 
     def add_tag(self, sha="", tag_type="", tag="", idx=None):
         # if commit hash is not given, use current commit hash
-        model_log = self.read_model_log(sha)
+        model_log = self.read_model_log(sha, lambda key: key == f"tag-{tag_type}")
         if len(model_log.keys()) == 0:
             print(f"tvault error: model log with commit hash {sha} does not exist.")
             raise TorchVaultError
@@ -100,8 +192,7 @@ class TorchVault:
                 )
             else:
                 print(f"tvault: setting tag {tag} for model {sha}")
-            model_log[model_idx][f"tag-{tag_type}"] = tag
-        self.write_model_log(sha, model_log)
+            self.store.update(sha or self.sha, model_idx, {f"tag-{tag_type}": tag})
 
     """
     add result to model log, commit sha may be from previous results.
@@ -111,7 +202,7 @@ class TorchVault:
 
     def add_result(self, sha="", result=0, idx=None):
         # if commit hash is not given, use current commit hash
-        model_log = self.read_model_log(sha)
+        model_log = self.read_model_log(sha, lambda key: key == "result")
         if len(model_log.keys()) == 0:
             print(f"tvault error: model log with commit hash {sha} does not exist.")
             raise TorchVaultError
@@ -131,53 +222,213 @@ class TorchVault:
                 )
             else:
                 print(f"tvault: setting result {result} for model {sha}")
-            model_log[model_idx]["result"] = result
-        self.write_model_log(sha, model_log)
+            self.store.update(sha or self.sha, model_idx, {"result": result})
 
     """
     Basic logging for pytorch model.
-    1. Retrives target modules from pytorch model representation.
+    1. Retrives target modules from pytorch model structure.
     2. Get class definition of target modules.
     3. Get external function definition of those used in target model.
+    weights: also log a fingerprint of every tensor, see weights.py
+    weight_stats: also log summary stats of every tensor, implies weights
+    checkpoint: also store the state_dict, see checkpoint.py
 
     Each logged model is stacked using index.
     """
 
-    def log_model(self, model):
-        class_defs, function_defs, target_modules = extract_info_from_model(model, self.model_dir)
+    @profiled("log_model")
+    def log_model(self, model, weights=False, weight_stats=False, checkpoint=False):
+        capture = self.capture_model_record(
+            model, weights=weights, weight_stats=weight_stats, checkpoint=checkpoint
+        )
+        self.set_own_experiment(self.sha, self.save_capture(self.sha, capture))
+
+    """
+    Builds the log record of a pytorch model in memory, without touching the model log.
+    """
+
+    def build_model_record(self, model, weights=False, weight_stats=False):
+        capture = self.capture_model_record(model, weights=weights, weight_stats=weight_stats)
+        return self.complete_model_record(capture)
+
+    """
+    capture the parts of an experiment read from memory: model tree and classes,
+    optimizer, tags and result. cheap enough to run in the training loop.
+    weights and checkpoint chunks are read here too, as the model keeps training after.
+    """
+
+    def capture_model_record(
+        self,
+        model,
+        tags=dict(),
+        result=-1,
+        optimizer=None,
+        weights=False,
+        weight_stats=False,
+        checkpoint=False,
+    ):
+        from .parse_utils import capture_model
+
+        capture = capture_model(model)
+        capture["timestamp"] = time.time()
+        fields = dict()
+        if checkpoint:
+            from .checkpoint import CheckpointStore
+            from .weights import weights_fingerprint
+
+            # the chunks of the checkpoint are the ones fingerprinted, so weights are read once
+            capture["checkpoint"] = CheckpointStore(self.log_dir).save(model, stats=weight_stats)
+            if weights or weight_stats:
+                fields["weights"] = weights_fingerprint(capture["checkpoint"])
+        elif weights or weight_stats:
+            from .weights import fingerprint_weights
+
+            fields["weights"] = fingerprint_weights(model, weight_stats)
+        if optimizer is not None:
+            from .optim_utils import capture_optimizer
+
+            fields.update(capture_optimizer(optimizer))
+        for tag_type, tag in tags.items():
+            fields[f"tag-{tag_type}"] = tag
+        if result != -1:
+            fields["result"] = result
+        capture["fields"] = fields
+        return capture
+
+    """
+    build the model record of a capture, parsing class and function sources.
+    """
+
+    def complete_model_record(self, capture):
+        from .parse_utils import match_external_funcs, extract_info_from_model
+
+        if self.use_astunparse:
+            from astunparse import unparse
+        else:
+            from ast import unparse
+
+        class_defs, function_defs, target_modules = extract_info_from_model(
+            None, self.model_dir, f"{self.log_dir}/cache", capture
+        )
 
         # get target module defs.
         filter_class_defs = defaultdict(lambda: "")
-        for k, v in class_defs.items():
+        for k in class_defs.keys():
             if k.split(":")[-1] in target_modules:
-                filter_class_defs[k] = v
+                filter_class_defs[k] = class_defs[k]
 
         # find functions that we only want to track
         target_funcs = match_external_funcs(filter_class_defs)
 
         # unparse
-        filter_target_class = defaultdict(lambda: "")
-        for k, v in class_defs.items():
-            if k.split(":")[-1] in target_modules:
-                if self.use_astunparse:
-                    filter_target_class[k] = astunparse.unparse(v)
-                else:
-                    filter_target_class[k] = ast.unparse(v)
-
-        filter_target_funcs = defaultdict(lambda: "")
-        for k, v in function_defs.items():
-            if k.split(":")[-1] in target_funcs:
-                if self.use_astunparse:
-                    filter_target_funcs[k] = astunparse.unparse(v)
-                else:
-                    filter_target_funcs[k] = ast.unparse(v)
-
-        model_log = self.read_model_log()
-        model_idx = len(model_log.keys())
-        model_log[model_idx]["model"] = model.__str__()
-        model_log[model_idx]["src"] = dict(filter_target_class)
-        model_log[model_idx]["external_func"] = dict(filter_target_funcs)
-        self.write_model_log("", model_log)
+        with phase("unparse"):
+            filter_target_class = defaultdict(lambda: "")
+            for k, v in filter_class_defs.items():
+                filter_target_class[k] = unparse(v)
+
+            filter_target_funcs = defaultdict(lambda: "")
+            for k in function_defs.keys():
+                if k.split(":")[-1] in target_funcs:
+                    filter_target_funcs[k] = unparse(function_defs[k])
+
+        model_record = dict()
+        model_record["timestamp"] = capture["timestamp"]
+        # the text view of the model is rendered from model_tree when displayed
+        if capture["model_tree"] is not None:
+            model_record["model_tree"] = capture["model_tree"]
+        else:
+            model_record["model"] = capture["model"]
+        model_record["src"] = dict(filter_target_class)
+        model_record["external_func"] = dict(filter_target_funcs)
+        model_record.update(capture.get("fields", dict()))
+        return model_record
+
+    """
+    Logs model, optimizer, tags and result of one experiment at once.
+    The record is built in memory and the model log is read and written only once,
+    regardless of the number of tags.
+    If background is set, only the capture runs in the caller, and sources are parsed and
+    written by a worker thread, see background.py. Returns a Future of the model index then.
+    weights / weight_stats / checkpoint are read in the caller, as in log_model, so a
+    background log has the weights the model had when logging.
+    """
+
+    @profiled("log_all")
+    def log_all(
+        self,
+        model,
+        tags=dict(),
+        result=-1,
+        optimizer=None,
+        background=False,
+        weights=False,
+        weight_stats=False,
+        checkpoint=False,
+    ):
+        start = time.perf_counter()
+        capture = self.capture_model_record(
+            model, tags, result, optimizer, weights, weight_stats, checkpoint
+        )
+        # the commit is the one checked out when logging, not when the log is written
+        sha = self.sha
+        if background:
+            from .background import get_logger
+
+            future = get_logger().submit(lambda: self.write_capture(sha, capture), start)
+            self.set_own_experiment(sha, future)
+            return future
+        return self.set_own_experiment(sha, self.write_capture(sha, capture))
+
+    def set_own_experiment(self, sha, model_idx):
+        _own_experiments[(os.path.abspath(self.log_dir), sha)] = model_idx
+        return model_idx
+
+    @profiled("write_capture")
+    def write_capture(self, sha, capture):
+        model_idx = self.save_capture(sha, capture)
+        print(f"tvault: logged model {sha} - index {model_idx}")
+        return model_idx
+
+    def save_capture(self, sha, capture):
+        model_idx = self.store.append(sha, self.complete_model_record(capture))
+        if capture.get("checkpoint") is not None:
+            from .checkpoint import CheckpointStore
+
+            CheckpointStore(self.log_dir).write_manifest(sha, model_idx, capture["checkpoint"])
+        return model_idx
+
+    """
+    store the state_dict of model as the checkpoint of the most recent experiment of the
+    commit, replacing the checkpoint it had.
+    """
+
+    def log_checkpoint(self, model):
+        from .checkpoint import CheckpointStore
+
+        model_idx = self.current_idx(wait=True)
+        if model_idx < 0:
+            print(f"tvault error: log the model of commit {self.sha} before its checkpoint.")
+            raise TorchVaultError
+        checkpoints = CheckpointStore(self.log_dir)
+        checkpoints.write_manifest(self.sha, model_idx, checkpoints.save(model))
+        return model_idx
+
+    """
+    checkpoint of an experiment, as a mapping of tensor names to tensors loaded on access.
+    idx: model index, the most recent experiment if -1
+    """
+
+    def load_checkpoint(self, sha="", idx=-1):
+        from .checkpoint import CheckpointStore
+
+        sha = sha or self.sha
+        if idx == -1:
+            idx = self.store.count(sha) - 1
+        checkpoints = CheckpointStore(self.log_dir)
+        if not checkpoints.exists(sha, idx):
+            print(f"tvault error: model {sha} - index {idx} has no checkpoint.")
+            raise TorchVaultError
+        return checkpoints.load(sha, idx)
 
     """
     Basic diff calculator between two pytorch models.
@@ -191,7 +442,8 @@ class TorchVault:
     0412: Custom keys should not be considered when calculating diff.
     """
 
-    def diff(self, sha1="", index1=-1, sha2="", index2=-1, ask_gpt=False):
+    @profiled("diff")
+    def diff(self, sha1="", index1=-1, sha2="", index2=-1, ask_gpt=False, semantic=False):
         prev_model = self.read_model_log(sha1)
         cur_model = self.read_model_log(sha2)
         if len(prev_model.keys()) == 0:
@@ -206,7 +458,9 @@ class TorchVault:
         prev_model = prev_model[index1]
         cur_model = cur_model[index2]
 
-        ret_str, diff_dict = extract_diff(prev_model, cur_model)
+        from .parse_utils import extract_diff
+
+        ret_str, diff_dict = extract_diff(prev_model, cur_model, semantic)
 
         print(ret_str)
         if ask_gpt:
@@ -217,112 +471,342 @@ class TorchVault:
         return
 
     """
-    find models using either commit hash, tag, or result
+    tensors that differ between the weights of two experiments, see weights.py.
+    both experiments must have been logged with weights.
+    returns a list of (tensor name, change, prev info, cur info)
+    """
+
+    def weights_diff(self, sha1="", index1=-1, sha2="", index2=-1):
+        from .weights import weights_diff
+
+        fingerprints = []
+        for sha, idx in ((sha1, index1), (sha2, index2)):
+            model_log = self.read_model_log(sha, lambda key: key == "weights")
+            if len(model_log) == 0:
+                print(f"tvault error: model log with commit hash {sha} does not exist.")
+                raise TorchVaultError
+            model_record = model_log[len(model_log) - 1 if idx == -1 else idx]
+            if "weights" not in model_record:
+                print(f"tvault error: model {sha} was logged without weights.")
+                raise TorchVaultError
+            fingerprints.append(model_record["weights"])
+        return weights_diff(*fingerprints)
+
+    """
+    find models using either commit hash, tag, result or a query
     should find suitable models and return list of [hash, model index, tag, result].
     Find models by that with custom keys, show result with such custom key
+    query: predicates joined by AND, e.g. "tag.size=0.5x AND result>=0.9", see query.py
+    sort: field to sort by, e.g. result or tag.size
+    desc: sort in descending order
+    limit: maximum number of models returned, only the top-k are kept when sorting
     """
 
-    def find(self, condition="hash", hash="", tag_type="", tag="", min=0, max=100):
-        target_models = []
-        if os.path.exists(self.log_dir):
-            if len(os.listdir(self.log_dir)) == 0:
-                print(f"tvault error: log dir is empty")
+    @profiled("find")
+    def find(
+        self,
+        condition="hash",
+        hash="",
+        tag_type="",
+        tag="",
+        min=0,
+        max=100,
+        query="",
+        sort="",
+        desc=False,
+        limit=None,
+    ):
+        return list(
+            self.find_iter(condition, hash, tag_type, tag, min, max, query, sort, desc, limit)
+        )
+
+    """
+    find, streaming matching models from the experiment index instead of collecting them.
+    conditions are checked when called, and models are read as the iterator is consumed.
+    offset: number of matching models skipped, to page through results with limit
+    """
+
+    def find_iter(
+        self,
+        condition="hash",
+        hash="",
+        tag_type="",
+        tag="",
+        min=0,
+        max=100,
+        query="",
+        sort="",
+        desc=False,
+        limit=None,
+        offset=0,
+    ):
+        if not os.path.exists(self.log_dir):
+            return iter([])
+        if len(self.store.list_shas()) == 0:
+            print(f"tvault error: log dir is empty")
+            raise TorchVaultError
+        if condition == "hash":
+            if hash == "":
+                print(f"tvault error: hash is not set for hash finding")
                 raise TorchVaultError
-            if condition == "hash":
-                if hash == "":
-                    print(f"tvault error: hash is not set for hash finding")
-                    raise TorchVaultError
-                if os.path.exists(f"{self.log_dir}/model_{hash}"):
-                    model_log = self.read_model_log(hash)
-                    print(
-                        f"tvault: model {hash} exists! - contains {len(model_log.keys())} experiments"
-                    )
-                    for model_idx, model in model_log.items():
-                        model_info = {"HASH": hash, "MODEL-IDX": model_idx}
-                        for k, v in model.items():
-                            if "tag-" in k:
-                                model_info[k] = v
-                        if "result" in model.keys():
-                            model_info["RESULT"] = model["result"]
-
-                        target_models.append(model_info)
-
-                else:
-                    print(f"tvault: model {hash} does not exist.")
-            elif condition == "tag":
-                for model in os.listdir(self.log_dir):
-                    with open(f"{self.log_dir}/{model}", "rb") as f:
-                        model_log = pickle.load(f)
-                    for model_idx, v in model_log.items():
-                        model_info = dict()
-
-                        if f"tag-{tag_type}" in v.keys() and v[f"tag-{tag_type}"] == tag:
-                            model_info = {
-                                "HASH": model.split("_")[1],
-                                "MODEL-IDX": model_idx,
-                            }
-                            if "result" in v.keys():
-                                model_info["RESULT"] = v["result"]
-
-                            # other tags
-                            for m_k, m_v in v.items():
-                                if "tag-" in m_k:
-                                    model_info[m_k] = m_v
-                            target_models.append(model_info)
-            elif condition == "result":
-                for model in os.listdir(self.log_dir):
-                    with open(f"{self.log_dir}/{model}", "rb") as f:
-                        model_log = pickle.load(f)
-                    for model_idx, v in model_log.items():
-                        model_info = dict()
-
-                        if "result" in v.keys() and min <= v["result"] <= max:
-                            model_info = {
-                                "HASH": model.split("_")[1],
-                                "MODEL-IDX": model_idx,
-                                "RESULT": v["result"],
-                            }
-                            # other tags
-                            for m_k, m_v in v.items():
-                                if "tag-" in m_k:
-                                    model_info[m_k] = m_v
-
-                            target_models.append(model_info)
-            else:
-                print(f"tvault error:condition other than [hash, tag, result] is not supported.")
+            if not self.store.exists(hash):
+                print(f"tvault: model {hash} does not exist.")
+                return iter([])
+            self.store.index.sync(self.store, [hash])
+            print(
+                f"tvault: model {hash} exists! - contains {self.store.index.count(hash)} experiments"
+            )
+            predicates = [("sha", "=", hash)]
+        elif condition == "tag":
+            predicates = [(f"tag.{tag_type}", "=", tag)]
+        elif condition == "result":
+            predicates = [("result", ">=", min), ("result", "<=", max)]
+        elif condition == "query":
+            try:
+                predicates = parse_query(query)
+            except QueryError as e:
+                print(f"tvault error: {e}")
                 raise TorchVaultError
-        return target_models
+        else:
+            print(f"tvault error:condition other than [hash, tag, result, query] is not supported.")
+            raise TorchVaultError
+        if condition != "hash":
+            self.store.index.sync(self.store, workers=self.workers)
+        return run_query(self.store.index, predicates, sort, desc, limit, offset)
 
-    def show_result(self, target_models):
-        if len(target_models) == 0:
-            print(f"tvault: no model satisfying the conditions")
-            return
+    """
+    rebuild the experiment index from the model logs.
+    """
+
+    def reindex(self):
+        return self.store.index.sync(self.store, rebuild=True, workers=self.workers)
+
+    """
+    set a tag on many experiments at once, e.g. across commits.
+    runs / query: experiments, as for compare
+    commits are tagged by a pool of threads, each commit under its own lock.
+    returns [(sha, number of experiments tagged)] in the order experiments were selected
+    """
+
+    def retag(self, tag_type="", tag="", runs="", query=""):
+        if tag_type == "":
+            print(f"tvault error: tag_type is not set for retagging")
+            raise TorchVaultError
+        if runs == "" and query == "":
+            print(f"tvault error: runs or query is needed to select experiments to retag")
+            raise TorchVaultError
+        targets = defaultdict(list)
+        for sha, idx in self.select_runs(runs, query):
+            targets[sha].append(idx)
+
+        def tag_commit(sha):
+            for idx in targets[sha]:
+                self.store.update(sha, idx, {f"tag-{tag_type}": tag})
+            return sha, len(targets[sha])
+
+        return parallel_map(tag_commit, list(targets), self.workers)
+
+    """
+    check model logs, the sources they refer to and their checkpoints.
+    sources are read back and hashed, checkpoint chunks are only checked to exist.
+    hash: commit checked, every commit if empty
+    returns [(sha, problem)], empty if every model log is sound
+    """
+
+    @profiled("verify")
+    def verify(self, hash=""):
+        from .checkpoint import CheckpointStore
+
+        if hash != "" and not self.store.exists(hash):
+            print(f"tvault error: model {hash} does not exist.")
+            raise TorchVaultError
+        shas = [hash] if hash != "" else sorted(self.store.list_shas())
+        checkpoints = CheckpointStore(self.log_dir)
+
+        def verify_commit(sha):
+            problems, digests = self.store.verify(sha)
+            chunks = set()
+            for idx in checkpoints.list_idxs(sha):
+                try:
+                    manifest = checkpoints.load(sha, idx).manifest
+                except (OSError, ValueError):
+                    problems.append(f"unreadable checkpoint manifest of experiment {idx}")
+                    continue
+                chunks.update(d for info in manifest.values() for d in info["chunks"])
+            return problems, digests, chunks
+
+        results = parallel_map(verify_commit, shas, self.workers)
+        # objects shared by commits are checked once, and reported with the first of them
+        owners = dict()
+        for sha, (_, digests, chunks) in zip(shas, results):
+            for digest in digests:
+                owners.setdefault(("source", digest), sha)
+            for digest in chunks:
+                owners.setdefault(("chunk", digest), sha)
+
+        def check_object(item):
+            kind, digest = item
+            if kind == "source":
+                return self.store.objects.verify(digest)
+            return os.path.exists(checkpoints.chunk_path(digest))
+
+        sound = parallel_map(check_object, list(owners), self.workers)
+        missing = defaultdict(list)
+        for (kind, digest), ok in zip(owners, sound):
+            if not ok:
+                missing[owners[(kind, digest)]].append(
+                    f"{kind} {digest[:12]} is missing or corrupt"
+                )
+        problems = []
+        for sha, (sha_problems, _, _) in zip(shas, results):
+            problems += [(sha, problem) for problem in sha_problems + missing[sha]]
+        return problems
 
-        # find model log with most tags.
-        table = []
-        for e in target_models:
-            if len(list(e.keys())) > len(table):
-                table = list(e.keys())
-
-        # table should be sorted here
-        sorted_table_out = ["HASH", "MODEL-IDX"]
-        sorted_table = ["HASH", "MODEL-IDX"]
-        for e in table:
-            if e.startswith("tag-"):
-                sorted_table_out.append(e.split("tag-")[1])
-                sorted_table.append(e)
-        sorted_table.append("RESULT")
-        sorted_table_out.append("RESULT")
-
-        # table contains model_log keys with most tags
-        # should represent [hash, model idx, tag1, tag2, tag3, result] order.
-        tab = PrettyTable(sorted_table_out)
-        for e in target_models:
-            row = []
-            for k in sorted_table:
-                if k in e.keys():
-                    row.append(e[k])
-                else:
-                    row.append("")
-            tab.add_row(row)
+    """
+    compare experiments with each other, see compare.py.
+    runs: experiments as "sha:idx" or "sha" (every experiment of the commit), comma separated
+    query: find query selecting the experiments, used if runs is not given
+    returns (experiment labels, distance matrix, clusters of labels sharing an architecture)
+    """
+
+    def compare(self, runs="", query="", workers=None):
+        from .compare import compare_records
+
+        targets = self.select_runs(runs, query)
+        # each model log is read once, however many of its experiments are compared
+        shas = list(dict.fromkeys(sha for sha, _ in targets))
+        model_logs = dict(zip(shas, parallel_map(self.read_model_log, shas, self.workers)))
+        labels, model_records = [], []
+        for sha, idx in targets:
+            labels.append(f"{sha}:{idx}")
+            model_records.append(model_logs[sha][idx])
+        if len(model_records) < 2:
+            print(f"tvault error: at least two experiments are needed to compare.")
+            raise TorchVaultError
+
+        matrix, clusters = compare_records(model_records, workers)
+        clusters = [[labels[position] for position in cluster] for cluster in clusters]
+        return labels, matrix, clusters
+
+    """
+    experiments given as runs ("sha:idx" or "sha", comma separated) or selected by a find
+    query if runs is not given.
+    returns a list of (sha, idx)
+    """
+
+    def select_runs(self, runs="", query=""):
+        from .compare import parse_runs
+
+        if not runs:
+            try:
+                predicates = parse_query(query)
+            except QueryError as e:
+                print(f"tvault error: {e}")
+                raise TorchVaultError
+            self.store.index.sync(self.store, workers=self.workers)
+            return [
+                (info["HASH"], info["MODEL-IDX"])
+                for info in run_query(self.store.index, predicates)
+            ]
+
+        targets = []
+        for sha, idx in parse_runs(runs):
+            if not self.store.exists(sha):
+                print(f"tvault error: model {sha} does not exist.")
+                raise TorchVaultError
+            count = self.store.count(sha)
+            if idx is not None and not 0 <= idx < count:
+                print(f"tvault error: model {sha} has no experiment {idx}.")
+                raise TorchVaultError
+            targets += [(sha, i) for i in range(count)] if idx is None else [(sha, idx)]
+        return targets
+
+    def show_comparison(self, labels, matrix, clusters):
+        from prettytable import PrettyTable
+
+        tab = PrettyTable([""] + labels)
+        for label, row in zip(labels, matrix):
+            tab.add_row([label] + [f"{d:.2f}" for d in row])
         print(tab)
+        print(f"tvault: {len(clusters)} architectures")
+        for i, cluster in enumerate(clusters):
+            print(f"{i + 1}. {', '.join(cluster)}")
+
+    """
+    metric series of an experiment, see metrics.py.
+    idx: model index, the most recent experiment if None
+    points: downsample to about this many (first step, last step, min, max, mean, last)
+            blocks, every point is returned if None
+    """
+
+    def read_metric(self, name, sha="", idx=None, points=None):
+        from .metrics import MetricSeries, flush
+
+        flush()
+        if idx is None and sha in ("", self.sha):
+            idx = self.current_idx(wait=True)
+        sha = sha or self.sha
+        idx = self.store.count(sha) - 1 if idx is None else idx
+        return MetricSeries(self.log_dir, sha, idx, name).read(points)
+
+    """
+    min, max, mean, last value, last step and number of points of the metrics of
+    experiments, selected as in compare.
+    names: metrics summarized, every metric of the experiments if empty
+    returns {"sha:idx": {name: summary}}
+    """
+
+    def metric_summaries(self, runs="", query="", names=()):
+        from .metrics import MetricSeries, list_metrics, flush
+
+        flush()
+        summaries = dict()
+        for sha, idx in self.select_runs(runs, query):
+            summary = dict()
+            for name in names or list_metrics(self.log_dir, sha, idx):
+                summary[name] = MetricSeries(self.log_dir, sha, idx, name).summary()
+            summaries[f"{sha}:{idx}"] = summary
+        return summaries
+
+    def show_metric_summaries(self, summaries):
+        from prettytable import PrettyTable
+
+        tab = PrettyTable(["RUN", "METRIC", "MIN", "MAX", "MEAN", "LAST", "LAST-STEP", "POINTS"])
+        for label, summary in summaries.items():
+            for name, s in summary.items():
+                if s is None:
+                    tab.add_row([label, name] + [""] * 6)
+                    continue
+                tab.add_row(
+                    [label, name]
+                    + [f"{s[k]:.6g}" for k in ("min", "max", "mean", "last")]
+                    + [s["last_step"], s["count"]]
+                )
+        print(tab)
+
+    """
+    print models found by find_iter as they are read, see output.py.
+    limit: models shown, target_models may hold one more to tell if there are more
+    """
+
+    def show_result(self, target_models, columns=None, format="table", limit=None, offset=0):
+        from .output import model_tag_keys, write_results
+
+        # default columns hold the tags of every model, not only of the first ones
+        if hasattr(target_models, "tag_keys"):
+            tag_keys = target_models.tag_keys()
+        elif isinstance(target_models, list):
+            tag_keys = model_tag_keys(target_models)
+        else:
+            tag_keys = None
+        target_models = iter(target_models)
+        shown = target_models if limit is None else itertools.islice(target_models, limit)
+        count = write_results(shown, columns, format, tag_keys=tag_keys)
+        if count is None:
+            return
+        # machine formats keep stdout for rows only
+        out = sys.stdout if format == "table" else sys.stderr
+        if count == 0:
+            print(f"tvault: no model satisfying the conditions", file=out)
+        elif limit is not None and next(target_models, None) is not None:
+            print(f"tvault: more models with --offset {offset + count}", file=out)
@@ -0,0 +1,223 @@
+import os
+import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Fingerprints of model weights, so experiments with the same code but different
+initialization or checkpoints can be told apart.
+
+Every tensor of the model's state_dict is recorded as
+    {"shape": [...], "dtype": "float32", "hash": "...", "stats": {...}}
+where stats (mean, std, min, max, norm) are only computed if asked for.
+Tensors are read in chunks of CHUNK_BYTES: every chunk is moved to the host on its own,
+so a model on the gpu is never copied to host memory at once, and the hash of a tensor is
+the hash of the blake2b digests of its chunks. Chunks of every tensor are hashed by a
+thread pool, as hashlib and device copies release the GIL, so a tensor of several GB is
+hashed by every core instead of one.
+Tensors sharing memory, e.g. tied embeddings, are hashed once.
+"""
+
+# part of the hash, changing it changes the hash of every tensor larger than a chunk
+CHUNK_BYTES = 16 * 2**20
+DIGEST_SIZE = 16
+
+
+def chunk_fingerprint(elements, stats, on_chunk=None):
+    import torch
+
+    data = elements.view(torch.uint8)
+    if data.device.type != "cpu":
+        data = data.cpu()
+    data = data.numpy()
+    digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+    if on_chunk is not None:
+        on_chunk(digest.hex(), data)
+    if not stats or elements.numel() == 0:
+        return digest, None
+    if elements.dtype == torch.bool or elements.is_complex():
+        return digest, None
+    values = elements.double()
+    return digest, (
+        values.numel(),
+        values.sum().item(),
+        values.square().sum().item(),
+        values.min().item(),
+        values.max().item(),
+    )
+
+
+def merge_stats(partials):
+    if not partials:
+        return None
+    count = sum(p[0] for p in partials)
+    total = sum(p[1] for p in partials)
+    squares = sum(p[2] for p in partials)
+    mean = total / count
+    return {
+        "mean": mean,
+        "std": math.sqrt(max(squares / count - mean * mean, 0.0)),
+        "min": min(p[3] for p in partials),
+        "max": max(p[4] for p in partials),
+        "norm": math.sqrt(squares),
+    }
+
+
+"""
+read every tensor of model's state_dict chunk by chunk.
+model may also be a state_dict.
+on_chunk: called with (chunk hash, host bytes of the chunk) of every chunk, from the
+          worker threads, e.g. to store the chunks of a checkpoint
+returns {tensor name: {"shape", "dtype", "hash", "chunks"[, "stats"]}}, chunks being the
+hashes of the chunks of the tensor
+"""
+
+
+def scan_weights(model, stats=False, workers=None, on_chunk=None):
+    state_dict = model.state_dict() if hasattr(model, "state_dict") else model
+    if not isinstance(state_dict, dict):
+        return dict()
+    tensors = dict()
+    shared = dict()
+    for name, tensor in state_dict.items():
+        if not hasattr(tensor, "data_ptr"):
+            continue
+        key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape), tuple(tensor.stride()))
+        if tensor.numel() == 0:
+            # empty tensors may share a null data pointer
+            key = name
+        if key in shared:
+            shared[key].append(name)
+        else:
+            shared[key] = [name]
+            tensors[name] = tensor.detach()
+
+    # every chunk of every tensor, as (tensor name, view of its elements)
+    chunks = []
+    for name, tensor in tensors.items():
+        flat = tensor.reshape(-1)
+        step = max(CHUNK_BYTES // tensor.element_size(), 1)
+        starts = range(0, flat.numel(), step) if flat.numel() > 0 else [0]
+        chunks += [(name, flat[start : start + step]) for start in starts]
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(workers) as pool:
+        results = list(pool.map(lambda chunk: chunk_fingerprint(chunk[1], stats, on_chunk), chunks))
+
+    digests = {name: [] for name in tensors}
+    partials = {name: [] for name in tensors}
+    for (name, _), (digest, partial) in zip(chunks, results):
+        digests[name].append(digest)
+        if partial is not None:
+            partials[name].append(partial)
+
+    weights = dict()
+    for names in shared.values():
+        name = names[0]
+        digest = hashlib.blake2b(b"".join(digests[name]), digest_size=DIGEST_SIZE)
+        info = {
+            "shape": list(tensors[name].shape),
+            "dtype": str(tensors[name].dtype).replace("torch.", ""),
+            "hash": digest.hexdigest(),
+            "chunks": [d.hex() for d in digests[name]],
+        }
+        if stats:
+            info["stats"] = merge_stats(partials[name])
+        for name in names:
+            weights[name] = info
+    return weights
+
+
+"""
+fingerprint every tensor of model's state_dict.
+stats: also compute summary stats of every tensor
+workers: threads hashing chunks, defaults to the number of cpus
+returns {tensor name: {"shape", "dtype", "hash"[, "stats"]}}, empty if the model has no
+state_dict
+"""
+
+
+def fingerprint_weights(model, stats=False, workers=None):
+    return weights_fingerprint(scan_weights(model, stats, workers))
+
+
+"""
+fingerprint of weights read by scan_weights, without chunk hashes.
+"""
+
+
+def weights_fingerprint(weights):
+    return {
+        name: {k: v for k, v in info.items() if k != "chunks"} for name, info in weights.items()
+    }
+
+
+"""
+tensors that differ between two weight fingerprints.
+returns a list of (name, change, prev info, cur info), change being one of
+added, removed, shape, dtype or changed, in the order of the tensors in the model
+"""
+
+
+def weights_diff(prev_weights, cur_weights):
+    diff = []
+    for name in list(prev_weights) + [n for n in cur_weights if n not in prev_weights]:
+        prev, cur = prev_weights.get(name), cur_weights.get(name)
+        if cur is None:
+            diff.append((name, "removed", prev, None))
+        elif prev is None:
+            diff.append((name, "added", None, cur))
+        elif prev["shape"] != cur["shape"]:
+            diff.append((name, "shape", prev, cur))
+        elif prev["dtype"] != cur["dtype"]:
+            diff.append((name, "dtype", prev, cur))
+        elif prev["hash"] != cur["hash"]:
+            diff.append((name, "changed", prev, cur))
+    return diff
+
+
+def relative_change(prev, cur):
+    if prev == cur:
+        return "+0%"
+    if prev == 0:
+        return "new"
+    return f"{(cur - prev) / abs(prev) * 100:+.2f}%"
+
+
+"""
+how much a changed tensor changed, from its stats, e.g. "norm 1.2 -> 1.3 (+8.33%)".
+empty if either experiment was logged without stats.
+"""
+
+
+def stats_change(prev, cur):
+    prev_stats, cur_stats = prev.get("stats"), cur.get("stats")
+    if not prev_stats or not cur_stats:
+        return ""
+    return ", ".join(
+        f"{k} {prev_stats[k]:.4g} -> {cur_stats[k]:.4g} "
+        f"({relative_change(prev_stats[k], cur_stats[k])})"
+        for k in ("norm", "mean", "std")
+    )
+
+
+def color_weights_diff(prev_weights, cur_weights):
+    diff = weights_diff(prev_weights, cur_weights)
+    if not diff:
+        return ""
+    lines = []
+    for name, change, prev, cur in diff:
+        if change == "removed":
+            lines.append(f"\033[31m- {name}: {prev['dtype']}{prev['shape']}\033[0m")
+        elif change == "added":
+            lines.append(f"\033[32m+ {name}: {cur['dtype']}{cur['shape']}\033[0m")
+        elif change in ("shape", "dtype"):
+            lines.append(
+                f"~ {name}: \033[31m{prev['dtype']}{prev['shape']}\033[0m -> "
+                f"\033[32m{cur['dtype']}{cur['shape']}\033[0m"
+            )
+        else:
+            change = stats_change(prev, cur)
+            lines.append(f"~ {name}: changed" + (f", {change}" if change else ""))
+    total = len(set(prev_weights) | set(cur_weights))
+    lines.append(f"{len(diff)} of {total} tensors differ")
+    return "\n".join(lines)
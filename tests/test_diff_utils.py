@@ -0,0 +1,38 @@
+import random
+
+from tvault.diff_utils import DELETE, INSERT, MYERS_MAX_SIZE, line_diff
+
+
+def sides(diff):
+    a = [line for op, line in diff if op != INSERT]
+    b = [line for op, line in diff if op != DELETE]
+    return a, b
+
+
+def lcs_length(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b):
+            previous, row[j + 1] = row[j + 1], previous + 1 if x == y else max(row[j + 1], row[j])
+    return row[-1]
+
+
+def test_line_diff_is_minimal():
+    rng = random.Random(0)
+    for _ in range(500):
+        a = [rng.choice("abc") for _ in range(rng.randint(0, 12))]
+        b = [rng.choice("abc") for _ in range(rng.randint(0, 12))]
+        diff = line_diff(a, b)
+        assert sides(diff) == (a, b)
+        changes = sum(op != " " for op, _ in diff)
+        assert changes == len(a) + len(b) - 2 * lcs_length(a, b)
+
+
+# regions of frequent lines with many changes, diffed by Myers' diff or replaced as a whole
+def test_line_diff_of_many_changes():
+    rng = random.Random(0)
+    for size in (MYERS_MAX_SIZE // 2, MYERS_MAX_SIZE):
+        a = [f"x = {i % 3}" for i in range(size)]
+        b = [f"x = {rng.randint(0, 3)}" for _ in range(size)]
+        assert sides(line_diff(a, b)) == (a, b)
@@ -0,0 +1,99 @@
+import os
+import time
+import shutil
+
+from tvault import TorchVault
+
+EXAMPLE_LOG_DIR = os.path.join(os.path.dirname(__file__), "..", "example", "model_log")
+
+
+def copy_example(tmp_path):
+    log_dir = str(tmp_path / "model_log")
+    shutil.copytree(EXAMPLE_LOG_DIR, log_dir)
+    return log_dir
+
+
+# a write on a commit that was never indexed must not mark it as indexed
+def test_write_on_unindexed_commit_keeps_it_stale(tmp_path):
+    vault = TorchVault(copy_example(tmp_path))
+    vault.add_tag("2ba4adf", "size", "1x", idx=0)
+
+    assert len(vault.find("hash", hash="2ba4adf")) == 5
+    assert len(vault.find("result", min=0, max=100)) == 25
+    (model_info,) = vault.find("tag", tag_type="size", tag="1x")
+    assert model_info["MODEL-IDX"] == 0
+    assert "tag-language" in model_info and "RESULT" in model_info
+
+
+def test_write_on_indexed_commit_updates_index(tmp_path):
+    vault = TorchVault(copy_example(tmp_path))
+    vault.reindex()
+    vault.add_tag("2ba4adf", "size", "2x", idx=1)
+    signature = vault.store.signature("2ba4adf")
+
+    with vault.store.index.transaction() as conn:
+        indexed = conn.execute("SELECT signature FROM commits WHERE sha = '2ba4adf'").fetchone()
+    assert indexed[0] == signature
+    (model_info,) = vault.find("tag", tag_type="size", tag="2x")
+    assert model_info["MODEL-IDX"] == 1
+
+
+class Scalar:
+    def __init__(self, value):
+        self.value = value
+
+    def item(self):
+        return self.value
+
+    def __str__(self):
+        return f"tensor({self.value})"
+
+
+# results such as tensors are indexed as the number the model log holds, without a reindex
+def test_scalar_result_is_indexed_as_number(tmp_path):
+    vault = TorchVault(str(tmp_path / "model_log"))
+    vault.store.index.sync(vault.store)
+    idx = vault.store.append("abc1234", {"timestamp": 1.0, "tag-seed": Scalar(3)})
+    vault.store.update("abc1234", idx, {"result": Scalar(0.75)})
+
+    (model_info,) = vault.find("query", query="result>=0.7 AND tag.seed=3")
+    assert model_info["RESULT"] == 0.75 and model_info["tag-seed"] == 3
+
+
+# model logs are read outside of the index transaction, so writes go on during a reindex
+def test_write_during_reindex(tmp_path):
+    vault = TorchVault(copy_example(tmp_path))
+    vault.reindex()
+    read = vault.store.read
+    writes = []
+
+    def read_and_write(sha, select=None):
+        if not writes and sha != "2ba4adf":
+            writes.append(vault.add_tag("2ba4adf", "size", "3x", idx=2))
+        return read(sha, select)
+
+    vault.store.read = read_and_write
+    start = time.perf_counter()
+    vault.reindex()
+    vault.store.read = read
+    # rather than waiting for the lock of the index until it times out
+    assert time.perf_counter() - start < 10
+
+    (model_info,) = vault.find("tag", tag_type="size", tag="3x")
+    assert (model_info["HASH"], model_info["MODEL-IDX"]) == ("2ba4adf", 2)
+    assert len(vault.find("result", min=0, max=100)) == 25
+
+
+# the schema is created on the first connection only, indexes of older tvault get it once
+def test_schema_created_once(tmp_path):
+    import sqlite3
+
+    from tvault.index import SCHEMA_VERSION, ExperimentIndex
+
+    index = ExperimentIndex(str(tmp_path))
+    conn = sqlite3.connect(index.path)
+    conn.execute("CREATE TABLE commits (sha TEXT PRIMARY KEY, signature TEXT)")
+    conn.close()
+    with index.transaction() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("SELECT COUNT(*) FROM experiments").fetchone()[0] == 0
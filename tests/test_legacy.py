@@ -0,0 +1,71 @@
+import sys
+import types
+import pickle
+import struct
+import decimal
+
+from tvault import TorchVault
+from tvault.record_format import load_legacy
+
+
+# pickles like numpy 1.x scalars, without numpy
+class FakeDtype:
+    def __init__(self, name):
+        self.name = name
+
+    def __reduce__(self):
+        return (fake_numpy.dtype, (self.name, False, True), (3, "<", None, None, None, -1, -1, 0))
+
+    def __setstate__(self, state):
+        pass
+
+
+def scalar(dtype, data):
+    pass
+
+
+class FakeScalar:
+    def __init__(self, name, fmt, value):
+        self.args = (FakeDtype(name), struct.pack("<" + fmt, value))
+
+    def __reduce__(self):
+        return (fake_multiarray.scalar, self.args)
+
+
+fake_numpy = types.ModuleType("numpy")
+fake_numpy.dtype = FakeDtype
+fake_multiarray = types.ModuleType("numpy.core.multiarray")
+fake_multiarray.scalar = scalar
+FakeDtype.__module__, FakeDtype.__qualname__ = "numpy", "dtype"
+scalar.__module__, scalar.__qualname__ = "numpy.core.multiarray", "scalar"
+
+
+def dump_legacy(model_log, monkeypatch):
+    monkeypatch.setitem(sys.modules, "numpy", fake_numpy)
+    monkeypatch.setitem(sys.modules, "numpy.core.multiarray", fake_multiarray)
+    return pickle.dumps(model_log)
+
+
+def test_numpy_scalars_load_as_numbers(monkeypatch):
+    data = dump_legacy(
+        {0: {"result": FakeScalar("f8", "d", 0.5), "tag-seed": FakeScalar("i8", "q", 3)}},
+        monkeypatch,
+    )
+    model_log = load_legacy(data)
+    assert model_log == {0: {"result": 0.5, "tag-seed": 3}}
+    assert type(model_log[0]["tag-seed"]) is int
+
+
+# an unreadable log is skipped by find instead of failing the whole search
+def test_sync_skips_unreadable_logs(tmp_path, monkeypatch, capsys):
+    log_dir = tmp_path / "model_log"
+    log_dir.mkdir()
+    (log_dir / "model_aaaaaaa").write_bytes(
+        dump_legacy({0: {"result": FakeScalar("f8", "d", 0.5)}}, monkeypatch)
+    )
+    (log_dir / "model_bbbbbbb").write_bytes(pickle.dumps({0: {"result": decimal.Decimal(1)}}))
+
+    vault = TorchVault(str(log_dir))
+    model_infos = vault.find("result", min=0, max=1)
+    assert [(m["HASH"], m["RESULT"]) for m in model_infos] == [("aaaaaaa", 0.5)]
+    assert "skipped model log bbbbbbb" in capsys.readouterr().out
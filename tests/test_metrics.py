@@ -0,0 +1,35 @@
+import time
+import threading
+
+import tvault
+from tvault import TorchVault
+from tvault.background import get_logger
+
+
+# metrics of an experiment queued in the background are kept for it, without waiting for it
+def test_metric_of_queued_experiment(tmp_path):
+    log_dir = str(tmp_path / "model_log")
+    vault = TorchVault(log_dir)
+    vault.sha = "abc1234"
+    vault.store.append("abc1234", {"timestamp": 1.0})
+    queued = threading.Event()
+
+    def write():
+        queued.wait()
+        return vault.store.append("abc1234", {"timestamp": 2.0})
+
+    vault.set_own_experiment("abc1234", get_logger().submit(write, time.perf_counter()))
+    start = time.perf_counter()
+    for step in range(3):
+        vault.log_metric("loss", 1.0 / (step + 1), step)
+    assert time.perf_counter() - start < 0.5
+    queued.set()
+    assert vault.current_idx(wait=True) == 1
+    # another worker logs an experiment of the commit before the metrics are written
+    vault.store.append("abc1234", {"timestamp": 3.0})
+    tvault.flush()
+
+    blocks = vault.read_metric("loss", "abc1234", 1)
+    assert [block[0] for block in blocks] == [0, 1, 2] and blocks[0][5] == 1.0
+    assert vault.read_metric("loss", "abc1234", 2) == []
+    assert vault.read_metric("loss") == blocks
@@ -0,0 +1,29 @@
+import io
+
+from tvault.output import write_results
+
+
+def model_info(idx, **tags):
+    return dict({"HASH": "abc1234", "MODEL-IDX": idx}, **{f"tag-{k}": v for k, v in tags.items()})
+
+
+# tags first seen after the first page still get a column
+def test_csv_columns_from_tag_keys():
+    model_infos = [model_info(0, lr=0.1), model_info(1, lr=0.2, seed=3)]
+    out = io.StringIO()
+    count = write_results(
+        iter(model_infos), format="csv", out=out, page_size=1, tag_keys=["tag-lr", "tag-seed"]
+    )
+    assert count == 2
+    assert out.getvalue().splitlines() == [
+        "HASH,MODEL-IDX,lr,seed,RESULT",
+        "abc1234,0,0.1,,",
+        "abc1234,1,0.2,3,",
+    ]
+
+
+def test_table_pages_without_tag_keys():
+    model_infos = [model_info(0, lr=0.1), model_info(1, seed=3)]
+    out = io.StringIO()
+    write_results(iter(model_infos), out=out, page_size=1)
+    assert "seed" in out.getvalue()
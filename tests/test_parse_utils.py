@@ -0,0 +1,36 @@
+import ast
+
+from tvault.parse_utils import parse_file_defs, resolve_model_defs
+
+
+# form feeds are not line breaks to the tokenizer, so they must not shift definitions
+def test_form_feed_does_not_shift_defs():
+    source = b"import os\n\x0c\n\nclass Net:\n    def f(self):\n        return 1\n"
+    ((kind, name, def_source),) = parse_file_defs(source)
+    assert (kind, name) == ("class", "Net")
+    assert ast.parse(def_source).body[0].name == "Net"
+
+
+def test_pep263_encoding():
+    source = '# -*- coding: latin-1 -*-\nclass L:\n    s = "\xe9"\n'.encode("latin-1")
+    ((_, _, def_source),) = parse_file_defs(source)
+    assert ast.literal_eval(ast.parse(def_source).body[0].body[0].value) == "\xe9"
+
+
+# library classes installed in a project-local .venv are not model sources
+def test_resolve_skips_project_venv(tmp_path, monkeypatch):
+    site_packages = tmp_path / ".venv" / "lib" / "site-packages"
+    (site_packages / "fakelib").mkdir(parents=True)
+    (site_packages / "fakelib" / "__init__.py").write_text("class Dropout:\n    pass\n")
+    (tmp_path / "tvnet.py").write_text(
+        "from fakelib import Dropout\n\nclass Net:\n    def __init__(self):\n"
+        "        self.drop = Dropout()\n"
+    )
+    monkeypatch.syspath_prepend(str(site_packages))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    import fakelib
+    import tvnet
+
+    class_defs, _ = resolve_model_defs({tvnet.Net, fakelib.Dropout}, "./", {"Net", "Dropout"})
+    assert list(class_defs) == ["./tvnet.py:Net"]